@@ -0,0 +1,160 @@
+"""
+Times reading prices from retailer gear pages with the price extractors against the BeautifulSoup parsing they replaced.
+
+The benchmark reads each page with the PriceExtractor registered for its retailer in gear_prices.PRICE_READERS, and
+with the function that built a BeautifulSoup tree of the whole page, which is reproduced at the bottom of this file,
+and prints the throughput of both along with any page the two read different prices from.
+
+Saved retailer pages can be benchmarked by passing a directory of html files whose names start with the retailer's
+name, such as 'rei-tent.html'. Otherwise, synthetic pages of the requested size are generated, with the price element
+placed at a random depth in the page, and JSON-LD added to a share of them.
+
+Run from the root of the repository:
+
+    python -m benchmarks.price_extraction_benchmark
+    python -m benchmarks.price_extraction_benchmark --pages saved_pages --repeat 3
+"""
+from hiking_blog.gear.gear_prices import PRICE_READERS, PriceNotFound
+from bs4 import BeautifulSoup
+import argparse
+import random
+import json
+import time
+import os
+
+PRICE_ELEMENTS = {
+    "moosejaw": '<div class="pdp-price"><span class="price-set-updated">${price} </span></div>',
+    "rei": '<div class="pdp-price"><span class="price-value">${price}</span></div>',
+    "backcountry": '<div class="pdp-price"><span class="css-1sxaem">${price}</span></div>'
+}
+
+
+def main():
+    """Parses the command line, loads or generates the pages and prints the throughput of both ways of reading them."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pages", help="directory of saved retailer pages, named after their retailer")
+    parser.add_argument("--count", type=int, default=10, help="number of synthetic pages per retailer")
+    parser.add_argument("--size", type=int, default=1_000_000, help="size of each synthetic page in bytes")
+    parser.add_argument("--json-ld", type=float, default=0.5, help="share of synthetic pages with JSON-LD")
+    parser.add_argument("--repeat", type=int, default=1, help="number of times each page is read")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.pages:
+        pages = load_pages(args.pages)
+    else:
+        rng = random.Random(args.seed)
+        pages = [
+            (retailer, make_page(retailer, rng, args.size, rng.random() < args.json_ld))
+            for retailer in PRICE_READERS for _ in range(args.count)
+        ]
+    megabytes = sum(len(page) for _, page in pages) / 1e6
+    print(f"pages: {len(pages)} ({megabytes:.1f} MB)")
+
+    extractor_time, extractor_prices = time_reads(lambda retailer, page: PRICE_READERS[retailer](page), pages,
+                                                  args.repeat)
+    legacy_time, legacy_prices = time_reads(lambda retailer, page: LEGACY_PRICE_QUERIES[retailer](page), pages,
+                                            args.repeat)
+
+    print(f"{'reader':<12}{'pages/s':>10}{'MB/s':>10}{'ms/page':>10}")
+    for name, elapsed in [("extractor", extractor_time), ("legacy", legacy_time)]:
+        print(f"{name:<12}{len(pages) / elapsed:>10.1f}{megabytes / elapsed:>10.1f}"
+              f"{elapsed / len(pages) * 1000:>10.2f}")
+    print(f"speedup: {legacy_time / extractor_time:.0f}x")
+
+    for (retailer, _), extracted, legacy in zip(pages, extractor_prices, legacy_prices):
+        if extracted != legacy:
+            print(f"mismatch: {retailer} extractor {extracted!r} legacy {legacy!r}")
+
+
+def time_reads(read_price, pages, repeat):
+    """Returns the mean time taken to read the price of every page, and the price read from each, or None."""
+    prices = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        prices = []
+        for retailer, page in pages:
+            try:
+                prices.append(read_price(retailer, page))
+            except (PriceNotFound, AttributeError, IndexError):
+                prices.append(None)
+    return (time.perf_counter() - started) / repeat, prices
+
+
+def load_pages(directory):
+    """Loads every html file in a directory whose name starts with a retailer's name."""
+    pages = []
+    for file_name in sorted(os.listdir(directory)):
+        retailer = next((retailer for retailer in PRICE_READERS if file_name.startswith(retailer)), None)
+        if retailer is not None and file_name.endswith(".html"):
+            with open(os.path.join(directory, file_name), encoding="utf-8", errors="replace") as page_file:
+                pages.append((retailer, page_file.read()))
+    return pages
+
+
+def make_page(retailer, rng, size, json_ld):
+    """
+    Makes a synthetic product page about 'size' bytes long, roughly shaped like a retailer's.
+
+    The page has a large inline script in its head, as retail pages do, then rows of navigation and product listings,
+    with the price element placed somewhere in the first three quarters of the body.
+    """
+
+    price = f"{rng.randint(20, 900)}.{rng.randint(0, 99):02d}"
+    head = ["<!DOCTYPE html><html><head><title>Product</title>",
+            "<script>" + "window.dataLayer.push({event: 'view'});" * (size // 200) + "</script>"]
+    if json_ld:
+        offer = {"@context": "https://schema.org", "@type": "Product", "name": "Tent",
+                 "offers": {"@type": "Offer", "price": price, "priceCurrency": "USD"}}
+        head.append(f'<script type="application/ld+json">{json.dumps(offer)}</script>')
+    head.append("</head><body>")
+    rows = []
+    body_size = size - sum(len(part) for part in head)
+    written = 0
+    price_at = rng.uniform(0.05, 0.75) * body_size
+    price_written = False
+    while written < body_size:
+        if not price_written and written >= price_at:
+            rows.append(PRICE_ELEMENTS[retailer].replace("{price}", price))
+            price_written = True
+        row = (f'<div class="row c{rng.randint(0, 99)}"><ul><li><a href="/p/{rng.randint(0, 99999)}">Product '
+               f'{rng.randint(0, 99999)}</a><span class="swatch">{rng.random():.6f}</span></li></ul></div>')
+        rows.append(row)
+        written += len(row)
+    return "".join(head + rows + ["</body></html>"])
+
+
+# ----------------------------------------LEGACY PRICE PARSING----------------------------------------
+def legacy_moosejaw_price(page):
+    soup = BeautifulSoup(page, features="lxml")
+    try:
+        gear_price = "$" + soup.find(class_="price-set-updated").getText().split("$")[1].split(" ")[0].strip()
+    except:
+        gear_price = "$" + soup.find(class_="price-set").getText().split("$")[1].split(" ")[0].strip().strip("-").strip()
+
+    return gear_price
+
+
+def legacy_rei_price(page):
+    soup = BeautifulSoup(page, features="lxml")
+    gear_price = "$" + soup.find(class_="price-value").getText().split("$")[1].split(" ")[0].strip("-")
+
+    return gear_price
+
+
+def legacy_backcountry_price(page):
+    soup = BeautifulSoup(page, features="lxml")
+    gear_price = "$" + soup.find(class_="css-1sxaem").getText().split("$")[1].split(" ")[0].strip("-")
+
+    return gear_price
+
+
+LEGACY_PRICE_QUERIES = {
+    "moosejaw": legacy_moosejaw_price,
+    "rei": legacy_rei_price,
+    "backcountry": legacy_backcountry_price
+}
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""
+Measures the throughput of the price scraper end to end, against a local server of retailer product pages.
+
+The benchmark starts an HTTP server in its own process, serving Moosejaw, REI and Backcountry product pages with a
+price, pages with no price on them, pages showing the item out of stock and pages that are gone, after a simulated
+network delay. It builds an SQLite database in a temporary directory with synthetic gear pieces, each with an offer
+from every retailer linking to the server, and then runs data_scraper.check_prices over every offer once for each
+engine: 'sequential' checks one page at a time, as the scraper did before it was made concurrent, and 'concurrent'
+uses the PriceScraper's thread pool with the limits given on the command line. Each engine runs in a fresh process
+on a fresh copy of the database, so its CPU time and peak memory are its own, and the server's aren't counted.
+
+For each engine the benchmark prints the pages checked per second, the 50th and 99th percentile latency of a page,
+from sending its request to reading its price, the CPU time spent per page and the peak resident memory of the
+process, along with the number of pages of each outcome, which should be the same for every engine.
+
+Saved retailer pages can be served instead of generated ones by passing a directory of html files whose names start
+with the retailer's name and the variant, such as 'rei-price-tent.html', 'rei-missing-1.html' or
+'rei-outofstock-1.html'. Results can be saved with --output and compared against a saved run with --compare, which
+exits with an error if any engine's throughput has dropped by more than --tolerance.
+
+Run from the root of the repository:
+
+    python -m benchmarks.scraper_benchmark
+    python -m benchmarks.scraper_benchmark --gear 500 --latency 0.1 --output scraper.json
+    python -m benchmarks.scraper_benchmark --compare scraper.json
+"""
+from benchmarks.price_extraction_benchmark import make_page
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter
+from datetime import datetime
+import multiprocessing
+import argparse
+import resource
+import tempfile
+import shutil
+import random
+import json
+import time
+import sys
+import os
+import re
+
+RETAILERS = ("moosejaw", "rei", "backcountry")
+VARIANTS = ("price", "missing", "outofstock", "gone")
+PRICE_ELEMENT = re.compile(r'<div class="pdp-price">.*?</div>')
+OUT_OF_STOCK_ELEMENT = '<div class="pdp-stock"><span class="stock-status">Out of stock</span></div>'
+FIXTURES_PER_VARIANT = 5
+
+
+def main():
+    """Parses the command line, starts the page server and prints the measurements of every engine."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--gear", type=int, default=200, help="number of gear pieces, each with an offer per retailer")
+    parser.add_argument("--engines", default="sequential,concurrent", help="comma-separated engines to run")
+    parser.add_argument("--max-workers", type=int, default=12, help="threads of the concurrent engine")
+    parser.add_argument("--retailer-concurrency", type=int, default=4, help="requests open to one retailer at once")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the server waits before each response")
+    parser.add_argument("--size", type=int, default=300_000, help="size of each generated page in bytes")
+    parser.add_argument("--missing", type=float, default=0.05, help="share of pages with no price")
+    parser.add_argument("--out-of-stock", type=float, default=0.05, help="share of pages showing out of stock")
+    parser.add_argument("--gone", type=float, default=0.02, help="share of pages that are gone")
+    parser.add_argument("--json-ld", type=float, default=0.5, help="share of priced pages with JSON-LD")
+    parser.add_argument("--pages", help="directory of saved retailer pages, named after their retailer and variant")
+    parser.add_argument("--output", help="file to save the results to, as json")
+    parser.add_argument("--compare", help="file of saved results to compare these to")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="largest drop in pages/s allowed by --compare")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    fixtures = load_fixtures(args.pages) if args.pages else make_fixtures(rng, args.size, args.json_ld)
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    server = context.Process(target=serve_fixtures, args=(fixtures, args.latency, ready), daemon=True)
+    server.start()
+    base_url = ready.get()
+    shares = {"missing": args.missing, "outofstock": args.out_of_stock, "gone": args.gone}
+
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            database = os.path.join(directory, "benchmark.db")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                executor.submit(create_offers, database, base_url, args.gear, shares, args.seed).result()
+            print(f"offers: {args.gear * len(RETAILERS)} from {args.gear} gear pieces, "
+                  f"server latency {args.latency * 1000:.0f} ms")
+            print(f"{'engine':<12}{'pages':>7}{'pages/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'cpu ms/page':>13}"
+                  f"{'peak MB':>9}  outcomes")
+            for engine in args.engines.split(","):
+                engine_database = os.path.join(directory, f"{engine}.db")
+                shutil.copy(database, engine_database)
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(
+                        run_engine, engine, engine_database, args.max_workers, args.retailer_concurrency
+                    ).result()
+                results[engine] = result
+                print(f"{engine:<12}{result['pages']:>7}{result['pages_per_second']:>10.1f}"
+                      f"{result['p50_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['cpu_ms_per_page']:>13.2f}"
+                      f"{result['peak_rss_mb']:>9.1f}  {format_outcomes(result['outcomes'])}")
+    finally:
+        server.terminate()
+
+    if len({json.dumps(result["outcomes"], sort_keys=True) for result in results.values()}) > 1:
+        print("warning: the engines found different outcomes for the same pages")
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"settings": vars(args), "results": results}, output_file, indent=2)
+    if args.compare and not compare_results(args.compare, results, args.tolerance):
+        sys.exit(1)
+
+
+def run_engine(engine, database, max_workers, retailer_concurrency):
+    """
+    Checks the price of every offer in a database once with one engine, in a process of its own.
+
+    Returns a dictionary of the engine's measurements, which is sent back to the process running the benchmark.
+    """
+
+    from flask import Flask
+    from hiking_blog import db
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{database}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    with app.app_context():
+        db.init_db(app)
+
+        from hiking_blog.models import RetailerOffer
+        from hiking_blog.gear.gear_prices import create_retailer_sessions, PRICE_READERS
+        from hiking_blog.data_scraper import check_prices
+
+        if engine == "sequential":
+            max_workers, retailer_concurrency = 1, 1
+        create_retailer_sessions(RETAILERS, retailer_concurrency)
+        scraper = make_timed_scraper(PRICE_READERS, max_workers, retailer_concurrency)
+        offers = RetailerOffer.query.all()
+
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.perf_counter()
+        check_prices(offers, PRICE_READERS, scraper=scraper)
+        elapsed = time.perf_counter() - started
+        usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu_time = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    latencies = sorted(scraper.latencies)
+    return {
+        "pages": len(latencies),
+        "pages_per_second": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "cpu_ms_per_page": cpu_time / max(1, len(latencies)) * 1000,
+        "peak_rss_mb": usage_after.ru_maxrss / 1024,
+        "outcomes": dict(Counter(scraper.statuses))
+    }
+
+
+def make_timed_scraper(price_readers, max_workers, retailer_concurrency):
+    """Returns a PriceScraper that records how long every job takes and the status it ends with."""
+    from hiking_blog.gear.price_scraper import PriceScraper
+
+    class TimedPriceScraper(PriceScraper):
+        """A PriceScraper that records the latency and status of every job it scrapes."""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.latencies = []
+            self.statuses = []
+
+        def scrape_job(self, job):
+            started = time.perf_counter()
+            result = super().scrape_job(job)
+            self.latencies.append(time.perf_counter() - started)
+            self.statuses.append(result.status)
+            return result
+
+    return TimedPriceScraper(price_readers, max_workers=max_workers, retailer_concurrency=retailer_concurrency)
+
+
+def create_offers(database, base_url, gear_count, shares, seed):
+    """Creates the benchmark database, with an offer from every retailer for every synthetic gear piece."""
+    from flask import Flask
+    from hiking_blog import db
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{database}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    with app.app_context():
+        db.init_db(app)
+
+        from hiking_blog.models import Gear, RetailerOffer
+
+        db.create_db()
+        rng = random.Random(seed)
+        now = datetime.now()
+        for number in range(gear_count):
+            gear = Gear(name=f"Gear {number}", category="Tents", msrp="$100", weight="1 lb", dimensions="1 x 1",
+                        img=f"gear-{number}.jpg", rating=4.0, description="A piece of gear.", keywords="gear",
+                        gear_trail="Gear", date_time_added=now)
+            for retailer in RETAILERS:
+                variant = pick_variant(rng, shares)
+                fixture = rng.randrange(FIXTURES_PER_VARIANT)
+                gear.offers.append(RetailerOffer(
+                    retailer=retailer, url=f"{base_url}/{retailer}/{variant}/{fixture}/{number}", price_cents=100,
+                    in_stock=True, link_dead=False
+                ))
+            db.db.session.add(gear)
+        db.db.session.commit()
+
+
+def pick_variant(rng, shares):
+    """Picks the variant of an offer's page, which is 'price' unless it falls in the share of another variant."""
+    draw = rng.random()
+    for variant, share in shares.items():
+        if draw < share:
+            return variant
+        draw -= share
+    return "price"
+
+
+def make_fixtures(rng, size, json_ld):
+    """
+    Generates FIXTURES_PER_VARIANT pages of every variant for every retailer, keyed by (retailer, variant).
+
+    Priced pages are the synthetic pages of the price extraction benchmark. The other variants are made from them by
+    removing the price element, and the JSON-LD, or replacing it with an out-of-stock notice.
+    """
+
+    fixtures = {}
+    for retailer in RETAILERS:
+        for variant in VARIANTS:
+            pages = []
+            for _ in range(FIXTURES_PER_VARIANT):
+                page = make_page(retailer, rng, size, variant == "price" and rng.random() < json_ld)
+                if variant == "missing":
+                    page = PRICE_ELEMENT.sub("", page, count=1)
+                elif variant == "outofstock":
+                    page = PRICE_ELEMENT.sub(OUT_OF_STOCK_ELEMENT, page, count=1)
+                pages.append(page.encode())
+            fixtures[retailer, variant] = pages
+    return fixtures
+
+
+def load_fixtures(directory):
+    """Loads saved pages named '<retailer>-<variant>-*.html', generating none, and reuses them for every fixture."""
+    fixtures = {}
+    for file_name in sorted(os.listdir(directory)):
+        parts = file_name.split("-")
+        if len(parts) < 2 or parts[0] not in RETAILERS or parts[1] not in VARIANTS or not file_name.endswith(".html"):
+            continue
+        with open(os.path.join(directory, file_name), "rb") as page_file:
+            fixtures.setdefault((parts[0], parts[1]), []).append(page_file.read())
+    for key, pages in fixtures.items():
+        fixtures[key] = [pages[number % len(pages)] for number in range(FIXTURES_PER_VARIANT)]
+    return fixtures
+
+
+def serve_fixtures(fixtures, latency, ready):
+    """Serves the fixture pages at '/<retailer>/<variant>/<fixture>/<gear number>' until the process is stopped."""
+
+    class FixtureHandler(BaseHTTPRequestHandler):
+        """Answers every request with its fixture page, or 404 for the 'gone' variant, after the latency."""
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            retailer, variant, fixture = self.path.strip("/").split("/")[:3]
+            time.sleep(latency)
+            pages = fixtures.get((retailer, variant))
+            if variant == "gone" or not pages:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = pages[int(fixture) % len(pages)]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    server.daemon_threads = True
+    ready.put(f"http://127.0.0.1:{server.server_address[1]}")
+    server.serve_forever()
+
+
+def percentile(values, fraction):
+    """Returns the value at a fraction of the way through a sorted list, or 0 if it is empty."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def format_outcomes(outcomes):
+    """Returns the number of pages of each outcome as text, such as 'found 560, missing 30'."""
+    return ", ".join(f"{status} {count}" for status, count in sorted(outcomes.items()))
+
+
+def compare_results(path, results, tolerance):
+    """
+    Prints how each engine's throughput and latency compare to a saved run.
+
+    Returns False if an engine's pages per second have dropped by more than 'tolerance', as a fraction of the saved
+    run's, or if it found different outcomes for the same pages.
+    """
+
+    with open(path) as saved_file:
+        saved = json.load(saved_file)["results"]
+    passed = True
+    for engine, result in results.items():
+        if engine not in saved:
+            continue
+        before = saved[engine]
+        change = result["pages_per_second"] / before["pages_per_second"] - 1
+        print(f"{engine}: pages/s {change:+.1%}, p99 {result['p99_ms'] - before['p99_ms']:+.1f} ms, "
+              f"cpu/page {result['cpu_ms_per_page'] - before['cpu_ms_per_page']:+.2f} ms, "
+              f"peak {result['peak_rss_mb'] - before['peak_rss_mb']:+.1f} MB")
+        if change < -tolerance:
+            print(f"regression: {engine} is {-change:.1%} slower than the saved run")
+            passed = False
+        if result["outcomes"] != before["outcomes"]:
+            print(f"regression: {engine} outcomes were {format_outcomes(result['outcomes'])}, "
+                  f"the saved run's were {format_outcomes(before['outcomes'])}")
+            passed = False
+    return passed
+
+
+if __name__ == "__main__":
+    main()
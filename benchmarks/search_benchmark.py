@@ -0,0 +1,206 @@
+"""
+Times the site-wide search against a synthetic catalog of gear, trails and comments.
+
+The benchmark builds an SQLite database in a temporary directory, fills it with synthetic gear and trail pages and
+comments written from a shared vocabulary, builds the search index, and then times a set of searches through the
+search module's ranking pipeline. For comparison, the same searches are run through the LIKE-scan search the site used
+before the search index was added, which is reproduced at the bottom of this file. Searches using phrases, prefixes and
+misspellings are timed on their own, along with a misspelling lookup in the search vocabulary against a scan of every
+word in it.
+
+Run from the root of the repository:
+
+    python -m benchmarks.search_benchmark
+    python -m benchmarks.search_benchmark --backend fts --comments 50000 --skip-legacy
+"""
+from flask import Flask
+from hiking_blog import db
+from collections import Counter
+from datetime import datetime
+import argparse
+import contextlib
+import itertools
+import operator
+import random
+import string
+import tempfile
+import time
+import os
+import re
+
+QUERY_WORDS = ["tent", "glacier", "boots", "lake", "jacket", "ridge", "stove", "larch"]
+QUERIES = [["tent"], ["glacier", "lake"], ["boots"], ["ridge", "larch", "stove"], ["jacket", "tent", "lake"]]
+SYNTAX_QUERIES = ['"glacier lake"', "glaceir", "jack*", "stvoe larhc", '"ridge larch" tent*']
+
+
+def main():
+    """Parses the command line, builds the synthetic catalog and prints the timings of every search."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--gear", type=int, default=5000, help="number of gear pages")
+    parser.add_argument("--trails", type=int, default=5000, help="number of trail pages")
+    parser.add_argument("--comments", type=int, default=200000, help="number of comments, split over gear and trails")
+    parser.add_argument("--backend", choices=["index", "fts"], default="index", help="search backend to benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="number of times each search is timed")
+    parser.add_argument("--skip-legacy", action="store_true", help="don't time the LIKE-scan search")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = Flask(__name__)
+        app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{os.path.join(directory, 'benchmark.db')}"
+        app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        app.config["SECRET_KEY"] = "benchmark"
+        app.config["SEARCH_BACKEND"] = args.backend
+        with app.app_context():
+            db.init_db(app)
+            from hiking_blog.search import search, search_backends, search_index, search_vocabulary
+            db.create_db()
+
+            started = time.perf_counter()
+            create_catalog(args.gear, args.trails, args.comments, random.Random(args.seed))
+            print(f"catalog: {args.gear} gear, {args.trails} trails, {args.comments} comments "
+                  f"({time.perf_counter() - started:.1f}s)")
+
+            search_backends.create_search_backend(app)
+            started = time.perf_counter()
+            search_index.rebuild_search_index()
+            print(f"index: {search_backends.get_search_backend().name} backend built in "
+                  f"{time.perf_counter() - started:.1f}s")
+            started = time.perf_counter()
+            vocabulary = search_vocabulary.create_search_vocabulary(app)
+            print(f"vocabulary: {len(vocabulary.words)} words loaded in {time.perf_counter() - started:.1f}s")
+
+            print(f"{'query':<28}{'results':>9}{'search ms':>12}{'legacy ms':>12}{'speedup':>10}")
+            for query in QUERIES:
+                search_time, results = time_search(search.rank_search_results, query, args.repeat)
+                line = f"{' '.join(query):<28}{len(results):>9}{search_time * 1000:>12.1f}"
+                if not args.skip_legacy:
+                    legacy_time, _ = time_search(legacy_rank_search_results, query, 1)
+                    line += f"{legacy_time * 1000:>12.1f}{legacy_time / search_time:>9.0f}x"
+                print(line)
+
+            for query in SYNTAX_QUERIES:
+                search_time, results = time_search(search.rank_search_results, search.create_search_list(query),
+                                                   args.repeat)
+                print(f"{query:<28}{len(results):>9}{search_time * 1000:>12.1f}")
+
+            for word in ["glaceir", "stvoe", "jakcet"]:
+                started = time.perf_counter()
+                corrections = vocabulary.correct(word)
+                lookup_time = time.perf_counter() - started
+                started = time.perf_counter()
+                scanned = [other for other in vocabulary.words if search_vocabulary.edit_distance(word, other, 3) <= 2]
+                scan_time = time.perf_counter() - started
+                print(f"correct {word!r}: {corrections} in {lookup_time * 1000:.2f}ms, "
+                      f"scan of {len(vocabulary.words)} words found {len(scanned)} in {scan_time * 1000:.0f}ms")
+
+
+def time_search(rank, query, repeat):
+    """Runs a search several times, discarding anything it prints, and returns the fastest time and the results."""
+    best = None
+    results = None
+    for _ in range(repeat):
+        db.db.session.expunge_all()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            started = time.perf_counter()
+            results = rank(query)
+            elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, results
+
+
+# ----------------------------------------SYNTHETIC CATALOG----------------------------------------
+def create_catalog(gear_count, trail_count, comment_count, rng):
+    """Inserts synthetic gear, trail, user and comment rows using one executemany per table."""
+    from hiking_blog.models import User, Gear, Trails, GearComments, TrailComments
+    vocabulary = make_vocabulary(rng)
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+    now = datetime.now()
+
+    def words(count):
+        return " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=count))
+
+    session = db.db.session
+    session.execute(User.__table__.insert(), [dict(
+        first_name="Bench", last_name="Mark", username="benchmark", password="-", email="bench@example.com",
+        is_admin=False, joined_on=now, email_confirmed=True, username_approved=True, username_needs_verification=False
+    )])
+    session.execute(Gear.__table__.insert(), [dict(
+        name=f"{words(2).title()} {index}", category="Tents", msrp="$100", weight="1 lb", dimensions="1x1",
+        img=f"https://example.com/{index}.jpg", rating=4.0, description=f"<p>{words(120)}</p>", keywords=words(5),
+        gear_trail="Gear", date_time_added=now
+    ) for index in range(gear_count)])
+    session.execute(Trails.__table__.insert(), [dict(
+        name=f"{words(2).title()} Trail {index}", description=f"<p>{words(150)}</p>", gear_trail="Trail",
+        latitude="46.9", longitude="-114.0", hiking_dist=5.0, elev_change=1000, difficulty="Medium",
+        date_time_added=now
+    ) for index in range(trail_count)])
+    gear_comments = comment_count // 2
+    session.execute(GearComments.__table__.insert(), [dict(
+        text=words(rng.randint(5, 40)), date_time_added=now, commenter_id=1, gear_id=rng.randint(1, gear_count)
+    ) for _ in range(gear_comments)])
+    session.execute(TrailComments.__table__.insert(), [dict(
+        text=words(rng.randint(5, 40)), date_time_added=now, commenter_id=1, trail_id=rng.randint(1, trail_count)
+    ) for _ in range(comment_count - gear_comments)])
+    session.commit()
+
+
+def make_vocabulary(rng):
+    """Makes a vocabulary of random words with the benchmark's query words placed at a spread of frequencies."""
+    vocabulary = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))) for _ in range(20000)]
+    for position, word in enumerate(QUERY_WORDS):
+        vocabulary.insert(20 + position * 150, word)
+    return vocabulary
+
+
+# ----------------------------------------LEGACY SEARCH----------------------------------------
+def legacy_rank_search_results(search_list):
+    """Ranks pages the way the search module did before the search index, with one LIKE scan per term and field."""
+    from hiking_blog.models import Gear, GearComments, Trails, TrailComments
+    results = []
+    checks = [
+        ("names", 10, lambda term: Gear.query.filter(Gear.name.like(f"%{term}%")).all() +
+            Trails.query.filter(Trails.name.like(f"%{term}%")).all()),
+        ("keywords", 7, lambda term: Gear.query.filter(Gear.keywords.like(f"%{term}%")).all()),
+        ("content", 3, lambda term: Gear.query.filter(Gear.description.like(f"%{term}%")).all() +
+            Trails.query.filter(Trails.description.like(f"%{term}%")).all()),
+        ("comments", 1, lambda term: GearComments.query.filter(GearComments.text.like(f"%{term}%")).all() +
+            TrailComments.query.filter(TrailComments.text.like(f"%{term}%")).all()),
+    ]
+    for to_check, hit_value, find_hits in checks:
+        for search_item in search_list:
+            for hit in find_hits(search_item):
+                if to_check == "comments":
+                    page = hit.parent_posts
+                    text = hit.text.lower()
+                else:
+                    page = hit
+                    text = {"names": hit.name, "keywords": getattr(hit, "keywords", ""),
+                            "content": hit.description}[to_check].lower()
+                entry_change = False
+                for listing in results:
+                    if page.name.lower() == listing["gear/trail_name"].lower():
+                        listing["relevance_points"] += legacy_count_words(text, search_item) * hit_value
+                        entry_change = True
+                if not entry_change:
+                    results.append({
+                        "gear/trail": page.gear_trail,
+                        "gear/trail_name": page.name,
+                        "id": page.id,
+                        "relevance_points": legacy_count_words(text, search_item) * hit_value
+                    })
+    for listing in results:
+        if all(item in search_list for item in listing["gear/trail_name"].lower().split()):
+            listing["relevance_points"] += 1000
+    return sorted(results, reverse=True, key=operator.itemgetter("relevance_points"))
+
+
+def legacy_count_words(text, search_item):
+    """Cleans a whole text and counts one term in it, as the search module did for every hit and every term."""
+    no_tag_text = re.sub("<.*?>", '', text).lower()
+    clean_word_list = [re.sub("[^a-zA-Z]", '', word) for word in no_tag_text.split()]
+    return Counter(clean_word_list)[search_item]
+
+
+if __name__ == "__main__":
+    main()
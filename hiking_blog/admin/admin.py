@@ -1,25 +1,31 @@
 """This file is a collection of site maintenance operations accessible to a site administrator."""
 
-from flask import Blueprint, flash, redirect, render_template, url_for, send_from_directory, request
+from flask import Blueprint, flash, redirect, render_template, url_for, send_from_directory, request, jsonify, abort
 from flask_login import current_user, login_required
 from hiking_blog.auth.auth import admin_only
 from hiking_blog.forms import UsernameForm, AddTrailForm, AddNewTrailPhotoForm, GearForm, CommentForm
-from hiking_blog.models import User, Trails, Gear, TrailPictures
+from hiking_blog.models import User, Trails, Gear, TrailPictures, RetailerOffer
 from hiking_blog.contact import send_async_email, send_email, send_username_rejected_notification, EMAIL
+from hiking_blog.search.search_index import index_gear, index_trail, remove_gear_comment, remove_trail_comment, NO_TAGS
+from hiking_blog.search.search_cache import get_search_cache
+from hiking_blog.search.search_trace import get_memory_sink
+from hiking_blog.fragment_cache import get_fragment_cache
+from hiking_blog.trails.trail_recommendations import mark_trail_changed
+from hiking_blog.gear.retailer_offers import set_offer, record_price, cents_to_price, flagged_offers, \
+    RETAILER_LINK_NAMES
+from hiking_blog.gear.price_scraper import RETAILERS
+from hiking_blog.admin.upload_manifest import record_upload_directory, finish_review, pending_upload_days, \
+    pending_upload_directories, DIR_START
 from hiking_blog.db import db
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import shutil
 import os
-import errno
 import re
 import html
 
 ADMIN_DELETE_MESSAGE = "This comment has been deleted for inappropriate content."
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif'}
-DIR_START = "hiking_blog/admin/static/"
-NO_TAGS = re.compile("<.*?>")
-NO_CHARS = re.compile("[^a-zA-Z]")
 
 
 admin_bp = Blueprint(
@@ -39,12 +45,11 @@ def admin_dashboard():
 
     After logging in as an admin, an 'Admin' option is available in the navbar. If selected, it will run this function
     and create the admin landing page where a site-runner has access to functions that will make changes to the app.
+    The dates with photos waiting to be reviewed are read from the upload manifest, rather than from the directories.
     """
 
-    pics_by_day = os.listdir("hiking_blog/admin/static/submitted_trail_pics")
+    pics_by_day = pending_upload_days()
     new_users = unapproved_usernames()
-    folder = "hiking_blog/admin/static/submitted_trail_pics"
-    pics_by_day = delete_empty_directories(folder, pics_by_day)
     return render_template("admin_dashboard.html", user=current_user, pics_by_day=pics_by_day, new_users=new_users)
 
 
@@ -92,8 +97,8 @@ def add_trail():
     form = AddTrailForm()
     if form.validate_on_submit():
         new_hiking_trail = Trails()
-        update_trail_entry(new_hiking_trail, form)
         new_hiking_trail.date_time_added = datetime.now()
+        update_trail_entry(new_hiking_trail, form)
         db.session.add(new_hiking_trail)
         db.session.commit()
         trail_id = new_hiking_trail.id
@@ -164,8 +169,8 @@ def add_gear():
     form = GearForm()
     if form.validate_on_submit():
         new_gear_description = Gear()
-        update_gear_entry(new_gear_description, form)
         new_gear_description.date_time_added = datetime.now()
+        update_gear_entry(new_gear_description, form)
         db.session.add(new_gear_description)
         db.session.commit()
         gear_id = new_gear_description.id
@@ -204,19 +209,15 @@ def dead_links():
     """
     Checks if any Gear database entries contain dead links and alerts the admin.
 
-    Cycles through all entries in the gear table of the database, checking if any of the link_dead entries are True. If
-    so, the name of the gear piece and its link are added to a list that is displayed on the admin dashboard.
+    Queries the retailer_offers table of the database for the offers whose links are dead, or whose price could not be
+    read from their page. The name of each one's gear piece, its link and what the price scraper found are added to a
+    list that is displayed on the admin dashboard.
     """
 
-    all_gear = Gear.query.all()
-    current_dead_links = []
-    for gear in all_gear:
-        if gear.moosejaw_link_dead:
-            current_dead_links.append({gear.name: ["Moosejaw Link", gear.moosejaw_url]})
-        if gear.rei_link_dead:
-            current_dead_links.append({gear.name: ["REI Link", gear.rei_url]})
-        if gear.backcountry_link_dead:
-            current_dead_links.append({gear.name: ["Backcountry Link", gear.backcountry_url]})
+    current_dead_links = [
+        {gear_name: [RETAILER_LINK_NAMES[offer.retailer], offer.url, offer.check_detail or "Link dead"]}
+        for gear_name, offer in flagged_offers()
+    ]
     if not current_dead_links:
         print("No dead links.")
     return render_template("view_dead_links.html", links=current_dead_links)
@@ -226,31 +227,62 @@ def dead_links():
 @admin_only
 def mark_out_of_stock(gear_name):
     """
-    Changes several entries in the database for a gear item that is out of stock at one of the linked retailers.
+    Changes the offer in the database of a gear item that is out of stock at one of the linked retailers.
 
     When an admin determines that a link is dead because the item is out of stock with that retailer, this function
-    changes several entries for that gear piece in the database: the link is to that retailer is no longer considered
-    dead, so the data_scraper program will continue checking for updates to its status; the out_of_stock column becomes
-    True; the price changes to "Out of Stock" to make it clear to the user why it isn't currently linked.
-    """
-    site = request.args["site"]
-    gear_piece = Gear.query.filter_by(name=gear_name).first()
-    if site == "Moosejaw Link":
-        gear_piece.moosejaw_out_of_stock = True
-        gear_piece.moosejaw_link_dead = False
-        gear_piece.moosejaw_price = "Out of stock"
-    if site == "REI Link":
-        gear_piece.rei_out_of_stock = True
-        gear_piece.rei_link_dead = False
-        gear_piece.rei_price = "Out of stock"
-    if site == "Backcountry Link":
-        gear_piece.backcountry_out_of_stock = True
-        gear_piece.backcountry_link_dead = False
-        gear_piece.backcountry_price = "Out of stock"
+    changes the gear piece's offer from that retailer: the link is no longer considered dead, so the data_scraper
+    program will continue checking for updates to its status; the offer is marked out of stock, which is recorded in
+    its price history, and its price is shown as "Out of stock" to make it clear to the user why it isn't currently
+    linked. A missing or unknown 'site' gives a 400 error, and a gear piece with no offer from that retailer a 404.
+    """
+    site = request.args.get("site")
+    retailer = next((retailer for retailer, link_name in RETAILER_LINK_NAMES.items() if link_name == site), None)
+    if retailer is None:
+        abort(400)
+    offer = RetailerOffer.query.join(Gear).filter(Gear.name == gear_name, RetailerOffer.retailer == retailer).first()
+    if offer is None:
+        abort(404)
+    offer.link_dead = False
+    offer.check_status = None
+    offer.check_detail = None
+    record_price(offer, offer.price_cents, False)
     db.session.commit()
     return redirect(url_for("admin_bp.dead_links"))
 
 
+# ----------------------------------------CACHE AND SEARCH STATS----------------------------------------
+@admin_bp.route("/tamarack-treks/admin/search_cache_stats")
+@admin_only
+@login_required
+def search_cache_stats():
+    """Returns the hit and miss counts of the search cache as json, so the admin can see whether it is sized well."""
+    return jsonify(get_search_cache().stats())
+
+
+@admin_bp.route("/tamarack-treks/admin/fragment_cache_stats")
+@admin_only
+@login_required
+def fragment_cache_stats():
+    """Returns the hit and miss counts of the cache of rendered page sections, such as the home page's, as json."""
+    return jsonify(get_fragment_cache().stats())
+
+
+@admin_bp.route("/tamarack-treks/admin/search_traces")
+@admin_only
+@login_required
+def search_traces():
+    """
+    Returns the most recent search traces and the mean and worst time taken by each stage of search as json.
+
+    Traces are only kept when SEARCH_TRACE_SAMPLE_RATE is above 0 and 'memory' is one of the SEARCH_TRACE_SINKS.
+    """
+
+    sink = get_memory_sink()
+    if sink is None:
+        return jsonify(error="Search traces aren't being kept in memory."), 404
+    return jsonify(sink.summary())
+
+
 # ----------------------------------------TRAIL PHOTO FUNCTIONS----------------------------------------
 @admin_bp.route("/tamarack-treks/admin/submitted_trail_pics/<date>")
 @login_required
@@ -270,9 +302,10 @@ def submitted_trail_pics(date):
     """
 
     photos = {}
-    user_trail_directories = os.listdir(f"hiking_blog/admin/static/submitted_trail_pics/{date}")
+    user_trail_directories = pending_upload_directories(date)
     for directory in user_trail_directories:
-        photos[str(directory)] = os.listdir(f"hiking_blog/admin/static/submitted_trail_pics/{date}/{directory}")
+        path = f"hiking_blog/admin/static/submitted_trail_pics/{date}/{directory}"
+        photos[str(directory)] = os.listdir(path) if os.path.isdir(path) else []
     is_empty = True
     for key in photos:
         if photos[key]:
@@ -343,6 +376,7 @@ def delete_submitted_photo(date, user_trail, pic):
     create_photo_notification_email(user_trail, save_pic, reason)
     if os.path.exists(to_delete):
         os.remove(to_delete)
+    finish_review(date, user_trail)
     return redirect(url_for("admin_bp.submitted_trail_pics", date=date))
 
 
@@ -400,6 +434,7 @@ def move_file_and_email_user(user_trail, save_pic, date, pic, reason):
         sorting_directory = "save_for_appeal_pics"
     target = create_file_name(sorting_directory, date, user_trail)
     shutil.move(origin, target)
+    finish_review(date, user_trail)
 
 
 def create_photo_notification_email(user_trail, save_pic, reason):
@@ -536,7 +571,7 @@ def create_file_name(sorting_dir, date, user_trail):
 
     If the user has already submitted photos for the same trail on the same date, no new file will be created and the
     new submissions will be sent to the same directory as the others. Otherwise, a new directory will be created to
-    store the photos.
+    store the photos, and added to the upload manifest.
 
     PARAMETERS
     ----------
@@ -551,50 +586,16 @@ def create_file_name(sorting_dir, date, user_trail):
         that stores the user's photos. It is contained inside the date file.
     """
 
-    parent_dir = f"{DIR_START}{sorting_dir}/{date}"
+    bucket = sorting_dir.strip("/")
+    parent_dir = f"{DIR_START}{bucket}/{date}"
     directory = f"{parent_dir}/{user_trail}"
     in_existence = os.path.exists(directory)
     if not in_existence:
         directory = make_new_directory(parent_dir, user_trail)
+        record_upload_directory(bucket, date, user_trail)
     return directory
 
 
-def delete_empty_directories(folder, directories):
-    """
-    Deletes empty user-submitted photo directories after their contents have been approved or rejected by an admin.
-
-    This function is called upon loading the admin_dashboard function. Before rendering that template, this function
-    iterates through the approved, save_for_appeal, and submitted_trail_pics directories in this blueprint's static
-    folder. During that iteration, it iterates through each sub-directory, removing that sub-directory if it is empty.
-    Then, it checks to see if the parent directory it's iterating through is empty, deleting it if it is. Finally, it
-    returns a list of all directories that still have contents to be displayed in the admin_dashboard template.
-
-    PARAMETERS
-    ----------
-    folder : str
-        The pathway to be joined with each directory to be iterated through.
-    directories : list
-        A list of directories to be iterated through.
-    """
-
-    for directory in directories:
-        working_directory = os.path.join(folder, directory)
-        sub_directories = os.listdir(working_directory)
-        for sub_directory in sub_directories:
-            try:
-                os.rmdir(os.path.join(working_directory, sub_directory))
-            except OSError as e:
-                if e.errno != errno.ENOTEMPTY:
-                    raise
-        try:
-            os.rmdir(os.path.join(folder, directory))
-        except OSError as e:
-            if e.errno != errno.ENOTEMPTY:
-                raise
-    pics_by_day = os.listdir(folder)
-    return pics_by_day
-
-
 def allowed_file(filename):
     """Checks a user-submitted file to confirm it has one of the appropriate extensions."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -635,6 +636,10 @@ def delete_comment(comment, db_id, page, admin_id):
     if form.validate_on_submit():
         commenter = User.query.get(admin_id)
         comment.deleted_by = commenter.username
+        if page == "gear":
+            remove_gear_comment(comment)
+        else:
+            remove_trail_comment(comment)
         db.session.commit()
         form.comment_text.data = ""
         next_page = redirect(url_for(f"{page}_bp.view_{page}", db_id=db_id))
@@ -693,7 +698,13 @@ def add_new_trail_photo(user, trail, photo, date):
 
 
 def update_gear_entry(gear, form):
-    """Activated during the edit_gear and add_gear functions, assigns all values in the database."""
+    """
+    Activated during the edit_gear and add_gear functions, assigns all values in the database.
+
+    Once every value has been assigned, the gear entry's postings in the search index are rebuilt from its new name,
+    keywords and description.
+    """
+
     description_text = re.sub(NO_TAGS, '', form.description.data)
     gear.name = form.name.data
     gear.category = form.category.data
@@ -704,23 +715,20 @@ def update_gear_entry(gear, form):
     gear.rating = form.rating.data
     gear.description = html.unescape(description_text)
     gear.gear_trail = "Gear"
-    gear.moosejaw_url = form.moosejaw_url.data
-    gear.moosejaw_price = form.moosejaw_price.data
-    gear.moosejaw_link_dead = False
-    gear.moosejaw_out_of_stock = False
-    gear.rei_url = form.rei_url.data
-    gear.rei_price = form.rei_price.data
-    gear.rei_link_dead = False
-    gear.rei_out_of_stock = False
-    gear.backcountry_url = form.backcountry_url.data
-    gear.backcountry_price = form.backcountry_price.data
-    gear.backcountry_link_dead = False
-    gear.backcountry_out_of_stock = False
+    for retailer in RETAILERS:
+        set_offer(gear, retailer, form[f"{retailer}_url"].data, form[f"{retailer}_price"].data)
     gear.keywords = form.keywords.data
+    index_gear(gear)
 
 
 def update_trail_entry(trail, form):
-    """Activated during the edit_trail and add_trail functions, assigns all values in the database."""
+    """
+    Activated during the edit_trail and add_trail functions, assigns all values in the database.
+
+    Once every value has been assigned, the trail entry's postings in the search index are rebuilt from its new name
+    and description, and the trail is marked for its recommendations to be updated once it is committed.
+    """
+
     description_text = re.sub(NO_TAGS, '', form.description.data)
     trail.name = form.name.data
     trail.description = html.unescape(description_text)
@@ -730,10 +738,17 @@ def update_trail_entry(trail, form):
     trail.hiking_dist = form.hiking_distance.data
     trail.elev_change = form.elevation_change.data
     trail.difficulty = form.difficulty.data
+    index_trail(trail)
+    mark_trail_changed(trail)
 
 
 def populate_gear_form(gear):
     """Activated during the edit_gear function, populates all fields of the form with data from the database."""
+    offer_fields = {}
+    for offer in gear.offers:
+        retailer = offer.retailer
+        offer_fields[f"{retailer}_url"] = offer.url
+        offer_fields[f"{retailer}_price"] = cents_to_price(offer.price_cents)
     gear_piece = GearForm(
         name=gear.name,
         category=gear.category,
@@ -743,12 +758,7 @@ def populate_gear_form(gear):
         img=gear.img,
         rating=gear.rating,
         description=gear.description,
-        moosejaw_url=gear.moosejaw_url,
-        moosejaw_price=gear.moosejaw_price,
-        rei_url=gear.rei_url,
-        rei_price=gear.rei_price,
-        backcountry_url=gear.backcountry_url,
-        backcountry_price=gear.backcountry_price
+        **offer_fields
     )
     return gear_piece
 
@@ -0,0 +1,138 @@
+"""Keeps track of the directories of user-submitted photos, so they can be listed and expired without walking them."""
+from hiking_blog.models import UploadManifest
+from hiking_blog.db import db
+from datetime import datetime, timedelta
+import shutil
+import errno
+import os
+
+DIR_START = "hiking_blog/admin/static/"
+SUBMITTED_BUCKET = "submitted_trail_pics"
+APPROVED_BUCKET = "approved"
+APPEAL_BUCKET = "save_for_appeal_pics"
+UPLOAD_BUCKETS = (SUBMITTED_BUCKET, APPROVED_BUCKET, APPEAL_BUCKET)
+UPLOAD_PENDING = "pending"
+UPLOAD_REVIEWED = "reviewed"
+UPLOAD_STORED = "stored"
+UPLOAD_EXPIRED = "expired"
+UPLOAD_MAX_AGE = timedelta(days=30)
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def upload_path(bucket, date, user_trail):
+    """Returns the path of a photo directory relative to DIR_START, which is the path it is stored under."""
+    return f"{bucket}/{date}/{user_trail}"
+
+
+def record_upload_directory(bucket, date, user_trail, created_at=None):
+    """
+    Adds a newly created photo directory to the manifest.
+
+    A directory in the submitted_trail_pics folder is pending until the admin has reviewed every photo in it, and a
+    directory in any other folder is stored until it expires. A directory that was removed and has been created again
+    starts over, with a new creation time.
+
+    PARAMETERS
+    ----------
+    bucket : str
+        The static folder the directory is in, one of UPLOAD_BUCKETS.
+    date : str
+        The date the photos were submitted, which is the name of the directory's parent.
+    user_trail : str
+        The user's username and the trail's name, joined by '^', which is the name of the directory.
+    created_at : datetime
+        The time the directory was created, which defaults to now.
+    """
+
+    path = upload_path(bucket, date, user_trail)
+    entry = UploadManifest.query.filter_by(path=path).first()
+    if entry is None:
+        entry = UploadManifest(path=path, bucket=bucket, upload_day=date)
+        db.session.add(entry)
+    entry.created_at = created_at or datetime.now()
+    entry.status = UPLOAD_PENDING if bucket == SUBMITTED_BUCKET else UPLOAD_STORED
+    db.session.commit()
+
+
+def finish_review(date, user_trail):
+    """
+    Removes a submitted photo directory once the admin has approved, saved or deleted every photo in it.
+
+    Only the one directory, and its date directory if that is left empty too, are looked at, rather than every
+    submitted directory. Its manifest entry is marked reviewed, so it is no longer listed on the admin dashboard.
+
+    PARAMETERS
+    ----------
+    date : str
+        The date the photos were submitted.
+    user_trail : str
+        The user's username and the trail's name, joined by '^'.
+    """
+
+    path = upload_path(SUBMITTED_BUCKET, date, user_trail)
+    directory = f"{DIR_START}{path}"
+    if os.path.isdir(directory) and os.listdir(directory):
+        return
+    remove_directory(directory)
+    remove_directory(os.path.dirname(directory))
+    UploadManifest.query.filter_by(path=path).update({UploadManifest.status: UPLOAD_REVIEWED})
+    db.session.commit()
+
+
+def pending_upload_days():
+    """Returns the dates that submitted photos are waiting to be reviewed from, oldest first."""
+    days = db.session.query(UploadManifest.upload_day, db.func.min(UploadManifest.created_at)).filter(
+        UploadManifest.status == UPLOAD_PENDING,
+        UploadManifest.bucket == SUBMITTED_BUCKET
+    ).group_by(UploadManifest.upload_day).order_by(db.func.min(UploadManifest.created_at))
+    return [day for day, _ in days]
+
+
+def pending_upload_directories(date):
+    """Returns the names of the submitted photo directories from a date that are waiting to be reviewed."""
+    entries = UploadManifest.query.filter(
+        UploadManifest.status == UPLOAD_PENDING,
+        UploadManifest.bucket == SUBMITTED_BUCKET,
+        UploadManifest.upload_day == date
+    ).order_by(UploadManifest.created_at)
+    return [entry.path.rsplit("/", 1)[1] for entry in entries]
+
+
+def delete_expired_uploads(now=None, max_age=UPLOAD_MAX_AGE):
+    """
+    Deletes every photo directory created more than 'max_age' ago, found with a range query on the manifest.
+
+    Only the expired directories are touched, and their date directories removed if they are left empty, so the cost
+    depends on the number of directories expiring rather than on the number of directories kept.
+
+    PARAMETERS
+    ----------
+    now : datetime
+        The current time, which defaults to now.
+    max_age : timedelta
+        How long a directory is kept for.
+
+    Returns the number of directories expired.
+    """
+
+    cutoff = (now or datetime.now()) - max_age
+    expired = UploadManifest.query.filter(
+        UploadManifest.created_at <= cutoff,
+        UploadManifest.status != UPLOAD_EXPIRED
+    ).all()
+    for entry in expired:
+        directory = f"{DIR_START}{entry.path}"
+        shutil.rmtree(directory, ignore_errors=True)
+        remove_directory(os.path.dirname(directory))
+        entry.status = UPLOAD_EXPIRED
+    db.session.commit()
+    return len(expired)
+
+
+def remove_directory(directory):
+    """Removes a directory if it exists and is empty."""
+    try:
+        os.rmdir(directory)
+    except OSError as e:
+        if e.errno not in (errno.ENOTEMPTY, errno.EEXIST, errno.ENOENT):
+            raise
@@ -12,7 +12,9 @@ def init_app():
     Initialises and runs the app.
 
     Configures the app using the config file, registers the flask blueprints from each of the packages, creates the
-    database, and runs the app.
+    database and upgrades the schema of an existing one, chooses a search backend and builds its index if it has never
+    been built, creates the search cache, the fragment cache and the gear view counter, loads the search vocabulary,
+    creates the autocomplete index, the trail recommender and the search tracer, and runs the app.
     """
 
     ckeditor = CKEditor()
@@ -45,12 +47,13 @@ def init_app():
         db.init_db(app)
 
         from hiking_blog.home import dashboard
-        from hiking_blog.gear import gear
-        from hiking_blog.trails import trails
+        from hiking_blog.gear import gear, view_counter
+        from hiking_blog.trails import trails, trail_recommendations
         from hiking_blog.auth import auth
         from hiking_blog.admin import admin
-        from hiking_blog import contact
-        from hiking_blog.search import search
+        from hiking_blog import contact, migrations, fragment_cache
+        from hiking_blog.search import search, search_index, search_backends, search_cache, search_vocabulary
+        from hiking_blog.search import autocomplete, search_trace
         from hiking_blog.profiles import user_profile
 
         app.register_blueprint(dashboard.home_bp)
@@ -63,6 +66,16 @@ def init_app():
         app.register_blueprint(user_profile.user_profile_bp)
 
         db.create_db()
+        migrations.upgrade_db()
+        search_backends.create_search_backend(app)
+        search_cache.create_search_cache(app)
+        fragment_cache.create_fragment_cache(app)
+        view_counter.create_view_counter(app)
+        autocomplete.create_autocomplete_index(app)
+        trail_recommendations.create_trail_recommender(app)
+        search_trace.create_search_tracer(app)
+        search_index.create_search_index()
+        search_vocabulary.create_search_vocabulary(app)
 
         return app
 
@@ -0,0 +1,67 @@
+"""Serves the comments of gear and trail pages a page at a time, oldest first, with keyset pagination."""
+from flask import current_app
+from hiking_blog.db import db
+from sqlalchemy import tuple_
+from sqlalchemy.orm import selectinload
+from datetime import datetime
+
+COMMENTS_PER_PAGE = 20
+CURSOR_SEPARATOR = "_"
+
+
+class InvalidCursor(ValueError):
+    """Raised when the cursor a page of comments was asked for after can't be read."""
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def get_comment_page(comment_model, parent_column, parent_id, cursor=None, limit=None):
+    """
+    Returns one page of the comments on a gear or trail page, and the cursor of the page after it.
+
+    Comments are ordered by the time they were added, with their id breaking ties, and each page starts after the last
+    comment of the page before, given by its cursor. The database finds the start of the page on the thread's
+    (parent id, date_time_added) index rather than counting through the comments before it, as an OFFSET would, so
+    every page costs the same however far into a long thread it is. One comment more than the page holds is read to
+    tell whether there is a page after it. The commenters are loaded with the page, in one more query.
+
+    PARAMETERS
+    ----------
+    comment_model : class
+        The model of the comments, GearComments or TrailComments.
+    parent_column : Column
+        The column holding the id of the page the comments are on, such as TrailComments.trail_id.
+    parent_id : int
+        The id of the gear or trail entry the comments are on.
+    cursor : str
+        The cursor of the last comment of the page before, or None for the first page.
+    limit : int
+        The number of comments on a page, which defaults to the app's COMMENTS_PER_PAGE.
+
+    Returns a list of comments and the cursor of the last one, or None if there are no more comments.
+    """
+
+    if limit is None:
+        limit = current_app.config.get("COMMENTS_PER_PAGE", COMMENTS_PER_PAGE)
+    order = (comment_model.date_time_added, comment_model.id)
+    query = db.session.query(comment_model).filter(parent_column == parent_id)
+    if cursor is not None:
+        query = query.filter(tuple_(*order) > tuple_(*read_cursor(cursor)))
+    comments = query.options(selectinload(comment_model.commenter)).order_by(*order).limit(limit + 1).all()
+    if len(comments) <= limit:
+        return comments, None
+    comments = comments[:limit]
+    return comments, make_cursor(comments[-1])
+
+
+def make_cursor(comment):
+    """Returns the cursor of a comment, which is the time it was added and its id, such as '2024-05-01T12:30:00_42'."""
+    return f"{comment.date_time_added.isoformat()}{CURSOR_SEPARATOR}{comment.id}"
+
+
+def read_cursor(cursor):
+    """Returns the (date_time_added, id) of a comment from its cursor, raising InvalidCursor if it can't be read."""
+    date_time_added, _, comment_id = cursor.rpartition(CURSOR_SEPARATOR)
+    try:
+        return datetime.fromisoformat(date_time_added), int(comment_id)
+    except ValueError:
+        raise InvalidCursor(f"'{cursor}' is not a comment cursor.")
@@ -24,3 +24,35 @@ class Config:
     # Database
     SQLALCHEMY_DATABASE_URI = os.environ["SQLALCHEMY_DATABASE_URI"]
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Pages
+    COMMENTS_PER_PAGE = int(os.environ.get("COMMENTS_PER_PAGE", 20))
+    LISTING_PAGE_SIZE = int(os.environ.get("LISTING_PAGE_SIZE", 20))
+    FRAGMENT_CACHE_SIZE = int(os.environ.get("FRAGMENT_CACHE_SIZE", 512))
+    FRAGMENT_CACHE_TTL = int(os.environ.get("FRAGMENT_CACHE_TTL", 300))
+    VIEW_COUNT_FLUSH_INTERVAL = int(os.environ.get("VIEW_COUNT_FLUSH_INTERVAL", 60))
+    RECOMMENDATION_COUNT = int(os.environ.get("RECOMMENDATION_COUNT", 5))
+    RECOMMENDATION_REFRESH_INTERVAL = int(os.environ.get("RECOMMENDATION_REFRESH_INTERVAL", 3600))
+
+    # Search
+    SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "index")
+    SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", 256))
+    SEARCH_CACHE_TTL = int(os.environ.get("SEARCH_CACHE_TTL", 300))
+    VOCABULARY_REFRESH_INTERVAL = int(os.environ.get("VOCABULARY_REFRESH_INTERVAL", 60))
+    AUTOCOMPLETE_REFRESH_INTERVAL = int(os.environ.get("AUTOCOMPLETE_REFRESH_INTERVAL", 300))
+    SEARCH_TRACE_SAMPLE_RATE = float(os.environ.get("SEARCH_TRACE_SAMPLE_RATE", 0.0))
+    SEARCH_TRACE_SINKS = os.environ.get("SEARCH_TRACE_SINKS", "log")
+    SEARCH_TRACE_BUFFER_SIZE = int(os.environ.get("SEARCH_TRACE_BUFFER_SIZE", 200))
+
+    # Price scraper
+    SCRAPER_MAX_WORKERS = int(os.environ.get("SCRAPER_MAX_WORKERS", 12))
+    SCRAPER_RETAILER_CONCURRENCY = int(os.environ.get("SCRAPER_RETAILER_CONCURRENCY", 4))
+    SCRAPER_TIMEOUT = float(os.environ.get("SCRAPER_TIMEOUT", 10))
+    SCRAPER_RETRIES = int(os.environ.get("SCRAPER_RETRIES", 2))
+    SCRAPER_POOL_SIZE = int(os.environ.get("SCRAPER_POOL_SIZE", 4))
+    SCRAPER_RETAILER_BUDGET = int(os.environ.get("SCRAPER_RETAILER_BUDGET", 30))
+    SCRAPER_MIN_INTERVAL = int(os.environ.get("SCRAPER_MIN_INTERVAL", 60))
+    SCRAPER_DEFAULT_INTERVAL = int(os.environ.get("SCRAPER_DEFAULT_INTERVAL", 900))
+    SCRAPER_MAX_INTERVAL = int(os.environ.get("SCRAPER_MAX_INTERVAL", 86400))
+    SCRAPER_CLAIM_BATCH_SIZE = int(os.environ.get("SCRAPER_CLAIM_BATCH_SIZE", 50))
+    SCRAPER_LEASE_DURATION = int(os.environ.get("SCRAPER_LEASE_DURATION", 300))
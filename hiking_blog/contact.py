@@ -3,7 +3,8 @@ from flask import render_template, redirect, url_for, Blueprint, flash, current_
 from flask_login import current_user
 from bs4 import BeautifulSoup
 from hiking_blog.forms import ContactForm, UsernameRecoveryForm
-from hiking_blog.models import User
+from hiking_blog.models import User, Gear
+from hiking_blog.mail_queue import get_mail_queue
 from itsdangerous import URLSafeTimedSerializer
 from threading import Thread
 from email.mime.multipart import MIMEMultipart
@@ -143,16 +144,48 @@ def send_username_rejected_notification(user):
     send_async_email(user.email, subject, html, send_html_mail)
 
 
-def send_dead_links():
-    """NEEDS DOCSTRING"""
-    all_users = User.query.all()
-    for user in all_users:
-        if user.is_admin:
-            subject = "Dead gear links"
-            email = user.email
-            message = "You have dead links in your gear product database. Please perform an sweep of the database to " \
-                      "uncover and correct dead links."
-            send_async_email(email, subject, message, send_email)
+def send_dead_link_digest(flagged):
+    """
+    Sends every admin one email listing the offers a price sweep has found dead links or unreadable prices for.
+
+    The admins' addresses are found with a single query for the admins alone, and the digest is sent to all of them as
+    one email through the mail queue, rather than one email and one thread per admin.
+
+    PARAMETERS
+    ----------
+    flagged : list
+        The FlaggedOffers found by the sweep.
+    """
+
+    from hiking_blog.gear.price_scraper import LINK_GONE
+    from hiking_blog.gear.retailer_offers import RETAILER_LINK_NAMES
+
+    admin_emails = [email for email, in User.query.with_entities(User.email).filter_by(is_admin=True)]
+    if not admin_emails or not flagged:
+        return
+    gear_names = dict(Gear.query.with_entities(Gear.id, Gear.name).filter(Gear.id.in_({
+        offer.gear_id for offer in flagged
+    })))
+    sections = [
+        ("Dead links, which the retailer no longer has a page for:", [
+            offer for offer in flagged if offer.status == LINK_GONE
+        ]),
+        ("Prices that could not be read from the retailer's page:", [
+            offer for offer in flagged if offer.status != LINK_GONE
+        ])
+    ]
+    lines = []
+    for heading, offers in sections:
+        if offers:
+            lines.append(heading)
+            lines.extend(
+                f"- {gear_names.get(offer.gear_id, offer.gear_id)} ({RETAILER_LINK_NAMES[offer.retailer]}, "
+                f"{offer.detail}): {offer.url}" for offer in offers
+            )
+            lines.append("")
+    lines.append("Please review them on the dead links page of the admin dashboard.")
+    subject = f"Dead gear links: {len(flagged)} found"
+    get_mail_queue().send(admin_emails, subject, "\n".join(lines), send_email)
 
 
 def check_recovery_form(user):
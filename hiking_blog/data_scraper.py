@@ -1,121 +1,340 @@
 """Contains functions for automated site updates and maintenance"""
-from flask import Flask
-import shutil
+from flask import Flask, current_app
+from hiking_blog.gear.price_scraper import PriceScraper, make_scrape_jobs, RETAILERS, MAX_WORKERS, \
+    RETAILER_CONCURRENCY, REQUEST_TIMEOUT, RETRIES, PRICE_FOUND, PRICE_MISSING, PAGE_UNCHANGED, LINK_GONE, \
+    REQUEST_FAILED
+from hiking_blog.gear.scrape_scheduler import ScrapeScheduler, popularity_factor, RETAILER_BUDGET, MIN_INTERVAL, \
+    MAX_INTERVAL, DEFAULT_INTERVAL, PRICE_CHANGED, PRICE_STABLE, OFFER_STALE, CHECK_FAILED
+from sqlalchemy import update, insert, func
+from collections import namedtuple
+from datetime import datetime
 import time
-import os
 from hiking_blog import db, login_manager
 
+WRITE_CHUNK_SIZE = 500
+SCHEDULE_SYNC_INTERVAL = 60
+CLEANUP_INTERVAL = 3600
+SCRAPE_BATCH_SIZE = 200
+
+PriceSweep = namedtuple("PriceSweep", ["checked", "changed", "failed", "observations", "flagged", "outcomes"])
+FlaggedOffer = namedtuple("FlaggedOffer", ["gear_id", "retailer", "url", "status", "detail"])
+
 
 def app_updates():
     """
     After setting up an application object so as to work within the Flask app context, this function automates some
     aspects of site maintenance. Specifically, it triggers a function that will delete all submitted photo files that
     are more than a month old, and a separate function to update the price of a piece of gear in the database. Further,
-    if the latter function fails to scrape the price from a database, this function triggers another function that will
-    notify the admins of dead links that have been found.
+    when the latter function finds links that have gone dead or prices that can no longer be read, this function sends
+    the admins a single digest of them.
+
+    Rather than sweeping every offer on a fixed cycle, prices are checked as a ScrapeScheduler makes them due: offers
+    whose prices change and gear that is viewed and favorited often are checked more often, stable, dead and
+    out-of-stock offers less and less often, and no retailer is sent more than its budget of requests per minute. The
+    scheduler is brought in line with the offers in the database every SCHEDULE_SYNC_INTERVAL seconds, so offers added
+    or removed by the admins are picked up, and the updater sleeps until the next offer is due.
     """
 
+    app = create_updater_app()
+
+    with app.app_context():
+        init_updater(app)
+
+        from hiking_blog.models import RetailerOffer
+        from hiking_blog.gear.gear_prices import PRICE_READERS
+        from hiking_blog.contact import send_dead_link_digest
+
+        scheduler = ScrapeScheduler(
+            retailer_budget=app.config.get("SCRAPER_RETAILER_BUDGET", RETAILER_BUDGET),
+            min_interval=app.config.get("SCRAPER_MIN_INTERVAL", MIN_INTERVAL),
+            max_interval=app.config.get("SCRAPER_MAX_INTERVAL", MAX_INTERVAL),
+            default_interval=app.config.get("SCRAPER_DEFAULT_INTERVAL", DEFAULT_INTERVAL)
+        )
+        next_sync = 0
+        next_cleanup = 0
+        while True:
+            now = time.time()
+            if now >= next_sync:
+                scheduler.sync(load_schedule(), load_popularity(), now)
+                next_sync = now + SCHEDULE_SYNC_INTERVAL
+            if now >= next_cleanup:
+                clean_up_files()
+                next_cleanup = now + CLEANUP_INTERVAL
+            offer_ids = scheduler.due(now, SCRAPE_BATCH_SIZE)
+            if offer_ids:
+                due_offers = RetailerOffer.query.filter(RetailerOffer.id.in_(offer_ids)).all()
+                sweep = check_prices(due_offers, PRICE_READERS)
+                print(f"checked {sweep.checked} offers: {sweep.changed} changed, {sweep.observations} new prices, "
+                      f"{sweep.failed} unreachable")
+                checked_at = time.time()
+                for offer_id, gear_id, outcome in sweep.outcomes:
+                    scheduler.reschedule(offer_id, gear_id, outcome, checked_at)
+                for offer_id in set(offer_ids) - {outcome[0] for outcome in sweep.outcomes}:
+                    scheduler.drop(offer_id)
+                if sweep.flagged:
+                    send_dead_link_digest(sweep.flagged)
+            next_due = scheduler.next_due(time.time())
+            wait = SCHEDULE_SYNC_INTERVAL if next_due is None else next_due - time.time()
+            time.sleep(max(1, min(wait, next_sync - time.time())))
+
+
+def create_updater_app():
+    """Returns an application object with the app's config, for the site updates to work within its app context."""
     app = Flask(__name__)
     app.config.from_object("config.Config")
     login_manager.create_login_manager(app)
+    return app
 
-    with app.app_context():
-        db.init_db(app)
 
-        from hiking_blog.gear import gear
+def init_updater(app):
+    """
+    Sets up the database, the gear blueprint and a pool of connections to every retailer for the site updates.
 
-        app.register_blueprint(gear.gear_bp)
+    Must be called within the app context, once in every process that checks prices.
+    """
 
-        from hiking_blog.models import Gear
-        from hiking_blog.gear.gear_prices import moosejaw_price_query, rei_price_query, backcountry_price_query
-        from hiking_blog.contact import send_dead_links
+    db.init_db(app)
 
-        while True:
-            print("starting")
-            all_gear = Gear.query.all()
-            parent_path = f"hiking_blog/admin/static"
-            all_folders = os.listdir(parent_path)
-            dead_link_change = check_prices(all_gear, moosejaw_price_query, rei_price_query, backcountry_price_query)
-            if dead_link_change:
-                send_dead_links()
-            delete_old_files(all_folders, parent_path)
-            print("waiting...")
-            time.sleep(30)
-
-
-def check_prices(all_gear, moosejaw_price_query, rei_price_query, backcountry_price_query):
+    from hiking_blog.gear import gear
+    from hiking_blog.gear.gear_prices import create_retailer_sessions
+
+    app.register_blueprint(gear.gear_bp)
+    pool_size = app.config.get("SCRAPER_POOL_SIZE", app.config.get("SCRAPER_RETAILER_CONCURRENCY",
+                                                                     RETAILER_CONCURRENCY))
+    create_retailer_sessions(RETAILERS, pool_size)
+
+
+def check_prices(all_offers, price_readers, scraper=None):
     """
-    Checks the current price of every piece of gear in the database and changes the displayed price on the app.
+    Checks the current price of the retailer offers that are due and changes the displayed price on the app.
 
-    This function iterates through every piece of gear in the database and runs the update_gear_links function to keep
-    the entry in the database current.
+    This function makes a scrape job for every offer that is still being checked, and has a PriceScraper run them
+    concurrently, with a limit on the number of requests open to each retailer at once. Each job carries the
+    validators stored with its offer, so a page that hasn't changed since the last check is neither sent again nor
+    parsed. Once every price has been scraped, the offer_changes function compares each result to its offer, and only
+    the offers that actually changed are written, with a few bulk statements in a single transaction.
+
+    PARAMETERS
+    ----------
+    all_offers : list
+        Entries from the retailer_offers table of the database.
+    price_readers : dict
+        Maps each retailer's name to the function that reads the price from the html of one of its pages.
+    scraper : PriceScraper
+        The scraper that checks the prices, which defaults to one set up from the app's SCRAPER_ config. Passing one
+        in allows the scraper benchmark to compare scrapers set up differently.
+
+    Returns a PriceSweep counting the offers checked, changed and failed and the prices recorded, a FlaggedOffer for
+    every offer whose link has gone dead or whose price can no longer be read since its last check, and an (offer id,
+    gear id, outcome) tuple for every offer, for the ScrapeScheduler.
     """
 
-    dead_link_change = False
-    for gear_piece in all_gear:
-        dead_link_change, gear_piece.moosejaw_price, gear_piece.moosejaw_link_dead, gear_piece.moosejaw_out_of_stock = \
-            update_gear_links(gear_piece.moosejaw_price, gear_piece.moosejaw_link_dead,
-                              gear_piece.moosejaw_out_of_stock, gear_piece.moosejaw_url, moosejaw_price_query,
-                              dead_link_change)
-        dead_link_change, gear_piece.rei_price, gear_piece.rei_link_dead, gear_piece.rei_out_of_stock = \
-            update_gear_links(gear_piece.rei_price, gear_piece.rei_link_dead, gear_piece.rei_out_of_stock,
-                              gear_piece.rei_url, rei_price_query, dead_link_change)
-        dead_link_change, gear_piece.backcountry_price, gear_piece.backcountry_link_dead, \
-            gear_piece.backcountry_out_of_stock = \
-            update_gear_links(gear_piece.backcountry_price, gear_piece.backcountry_link_dead,
-                              gear_piece.backcountry_out_of_stock, gear_piece.backcountry_url, backcountry_price_query,
-                              dead_link_change)
-        db.db.session.commit()
-    return dead_link_change
-
-
-def update_gear_links(price, dead_link, out_of_stock, url, price_query, dead_link_change):
+    if scraper is None:
+        config = current_app.config
+        scraper = PriceScraper(
+            price_readers,
+            max_workers=config.get("SCRAPER_MAX_WORKERS", MAX_WORKERS),
+            retailer_concurrency=config.get("SCRAPER_RETAILER_CONCURRENCY", RETAILER_CONCURRENCY),
+            timeout=config.get("SCRAPER_TIMEOUT", REQUEST_TIMEOUT),
+            retries=config.get("SCRAPER_RETRIES", RETRIES)
+        )
+    results = scraper.scrape(make_scrape_jobs(all_offers))
+
+    offers = {offer.id: offer for offer in all_offers}
+    checked_at = datetime.now()
+    checked_ids = []
+    changed_rows = []
+    observations = []
+    outcomes = []
+    flagged = []
+    for result in results:
+        offer = offers[result.offer_id]
+        changes = offer_changes(offer, result)
+        price_changed = "price_cents" in changes or "in_stock" in changes
+        if result.status == REQUEST_FAILED:
+            outcomes.append((offer.id, offer.gear_id, CHECK_FAILED))
+        elif result.status in (LINK_GONE, PRICE_MISSING) or (
+                result.status == PAGE_UNCHANGED and offer.check_status == PRICE_MISSING):
+            outcomes.append((offer.id, offer.gear_id, OFFER_STALE))
+        else:
+            outcomes.append((offer.id, offer.gear_id, PRICE_CHANGED if price_changed else PRICE_STABLE))
+        if result.status != REQUEST_FAILED:
+            checked_ids.append(result.offer_id)
+        if is_newly_flagged(offer, changes):
+            flagged.append(FlaggedOffer(offer.gear_id, offer.retailer, offer.url, result.status, result.detail))
+        if not changes:
+            continue
+        changed_rows.append({"id": offer.id, **changes})
+        if price_changed:
+            observations.append({
+                "gear_id": offer.gear_id,
+                "retailer": offer.retailer,
+                "price_cents": changes.get("price_cents", offer.price_cents),
+                "in_stock": changes.get("in_stock", offer.in_stock),
+                "observed_at": checked_at
+            })
+    save_price_changes(checked_ids, changed_rows, observations, checked_at)
+    return PriceSweep(len(checked_ids), len(changed_rows), len(results) - len(checked_ids), len(observations),
+                      flagged, outcomes)
+
+
+def offer_changes(offer, result):
     """
-    Updates a gear listing in the database.
+    Compares the result of scraping a retailer offer to the offer in the database and returns what has changed.
+
+    The result is classified, and the classification recorded on the offer, as follows:
+
+    - a price was scraped: it becomes the offer's price, and the offer is back in stock, its link alive and its flags
+      cleared, if they weren't.
+    - the retailer answered 404 Not Found or 410 Gone: the link is marked dead, which takes the offer out of the
+      lowest prices and lists it on the admin's dead links page.
+    - the page loaded, but no price could be read from it: the offer is flagged as missing its price, which is listed
+      separately, since it usually means the retailer has changed its page rather than dropped the item. The offer
+      keeps its last price.
+    - the retailer couldn't be reached, even after retrying, or answered with a server or other error: the failure is
+      recorded, unless the offer is already flagged dead or missing its price, which one failed check doesn't change.
+    - the retailer reported the page unchanged since it was last scraped: the page is as it was, so only a recorded
+      failure is cleared.
 
-    For one entry in the gear table of the database, this function updates the price listed by one of the three
-    retailers (Moosejaw, Backcountry, or REI) in the database. If, for some reason, the price cannot be scraped, the
-    entry is updated to denote that the link is dead, if it hasn't already.
+    The ETag and Last-Modified headers sent with the page are stored for the next check, and cleared for a dead link.
+    The check status and detail are only written when they change, so an offer that stays healthy or stays flagged
+    isn't written at all.
+
+    PARAMETERS
+    ----------
+    offer : obj
+        An entry from the retailer_offers table of the database.
+    result : ScrapeResult
+        The result of scraping the retailer's page for the offer.
+
+    Returns a dictionary of the new values of the offer's changed columns, which is empty if none have changed.
+    """
+
+    from hiking_blog.gear.retailer_offers import price_to_cents
+
+    changes = {}
+    if result.status == REQUEST_FAILED:
+        if offer.check_status in (None, REQUEST_FAILED):
+            set_change(changes, offer, "check_status", REQUEST_FAILED)
+            set_change(changes, offer, "check_detail", result.detail)
+        return changes
+    if result.status == PAGE_UNCHANGED:
+        if offer.check_status == REQUEST_FAILED:
+            set_change(changes, offer, "check_status", None)
+            set_change(changes, offer, "check_detail", None)
+        return changes
+    etag, last_modified = result.validators or (None, None)
+    if offer.etag != etag or offer.last_modified != last_modified:
+        changes["etag"] = etag
+        changes["last_modified"] = last_modified
+    if result.status == PRICE_FOUND:
+        set_change(changes, offer, "price_cents", price_to_cents(result.price))
+        set_change(changes, offer, "in_stock", True)
+        set_change(changes, offer, "link_dead", False)
+        set_change(changes, offer, "check_status", None)
+        set_change(changes, offer, "check_detail", None)
+    else:
+        set_change(changes, offer, "link_dead", result.status == LINK_GONE)
+        set_change(changes, offer, "check_status", result.status)
+        set_change(changes, offer, "check_detail", result.detail)
+    return changes
+
+
+def set_change(changes, offer, column, value):
+    """Adds a column's new value to an offer's changes, if it differs from the value in the database."""
+    if getattr(offer, column) != value:
+        changes[column] = value
+
+
+def is_newly_flagged(offer, changes):
     """
-    back_in_stock = True
-    if price != "" and not dead_link:
-        try:
-            price = price_query(url)
-        except AttributeError:
-            back_in_stock = False
-            if not out_of_stock:
-                dead_link = True
-                dead_link_change = True
-            else:
-                pass
-    if back_in_stock:
-        out_of_stock = False
-    return dead_link_change, price, dead_link, out_of_stock
-
-
-def delete_old_files(all_folders, parent_path):
+    Returns True if a check has just found an offer's link dead, or its price missing while the retailer has it in
+    stock, which are the offers the admins are sent a digest of.
     """
-    Deletes all photo files thirty days after creation time in static folder sub-directories.
 
-    This function iterates through the approved, save_for_appeal_pics, and submitted_trail_pics directories and deletes
-    any sub-directories that were created thirty or more days ago.
+    if changes.get("link_dead"):
+        return True
+    return changes.get("check_status") == PRICE_MISSING and offer.in_stock
+
+
+def save_price_changes(checked_ids, changed_rows, observations, checked_at):
+    """
+    Writes the changes found by a price sweep to the database in a single transaction.
+
+    The changed offers are written with bulk UPDATEs by primary key, and their new prices appended to the price history
+    with bulk INSERTs, each sent WRITE_CHUNK_SIZE rows at a time as one executemany. The time of the check is set on
+    every offer that was reached with one UPDATE per chunk of ids. An offer that didn't change isn't written at all,
+    apart from that.
 
     PARAMETERS
     ----------
-    all_folders : list
-        A list of the three directories: approved, save_for_appeal_pics, and submitted_trail_pics.
-    parent_path : str
-        The file path preceding the names of the three folders.
+    checked_ids : list
+        The ids of the offers whose retailers were reached.
+    changed_rows : list
+        A dictionary for every changed offer, holding its id and the new values of its changed columns.
+    observations : list
+        A dictionary for every new row of the price_observations table.
+    checked_at : datetime
+        The time the prices were checked.
+    """
+
+    from hiking_blog.models import RetailerOffer, PriceObservation
+
+    session = db.db.session
+    for chunk in chunks(changed_rows):
+        session.execute(update(RetailerOffer), chunk)
+    for chunk in chunks(observations):
+        session.execute(insert(PriceObservation), chunk)
+    for chunk in chunks(checked_ids):
+        session.execute(
+            update(RetailerOffer).where(RetailerOffer.id.in_(chunk)).values(last_checked=checked_at)
+            .execution_options(synchronize_session=False)
+        )
+    session.commit()
+
+
+def load_schedule():
+    """Returns an (offer id, gear id, retailer, url, last checked) tuple for every offer, for the ScrapeScheduler."""
+    from hiking_blog.models import RetailerOffer
+
+    return db.db.session.query(
+        RetailerOffer.id, RetailerOffer.gear_id, RetailerOffer.retailer, RetailerOffer.url, RetailerOffer.last_checked
+    ).all()
+
+
+def load_popularity():
+    """Returns the popularity factor of every gear piece with page views or favorites, keyed by gear id."""
+    from hiking_blog.models import Gear, Favorites
+
+    session = db.db.session
+    views = dict(session.query(Gear.id, Gear.view_count).filter(Gear.view_count > 0))
+    favorites = dict(
+        session.query(Favorites.favorite_id, func.count(Favorites.id))
+        .filter(Favorites.gear_trail == "Gear")
+        .group_by(Favorites.favorite_id)
+    )
+    return {
+        gear_id: popularity_factor(views.get(gear_id, 0), favorites.get(gear_id, 0))
+        for gear_id in set(views) | set(favorites)
+    }
+
+
+def chunks(rows):
+    """Splits a list into lists of up to WRITE_CHUNK_SIZE items."""
+    return [rows[start:start + WRITE_CHUNK_SIZE] for start in range(0, len(rows), WRITE_CHUNK_SIZE)]
+
+
+def clean_up_files():
     """
+    Deletes the photo directories that are more than a month old from the admin's static folders.
+
+    The directories that have expired are found with a range query on the created_at index of the upload manifest, so
+    no directories are listed and only the expired ones are touched.
+    """
+
+    from hiking_blog.admin.upload_manifest import delete_expired_uploads
 
-    current_time = time.time()
-    for directory in all_folders:
-        directories_queued_for_deletion = os.listdir(f"{parent_path}/{directory}")
-        for old_folder in directories_queued_for_deletion:
-            full_path = f"{parent_path}/{directory}/{old_folder}"
-            creation_time = os.path.getctime(full_path)
-            if (current_time - creation_time) // (24 * 3600) >= 30:
-                shutil.rmtree(full_path)
+    delete_expired_uploads()
 
 
 if __name__ == "__main__":
@@ -3,10 +3,11 @@
 from flask_wtf import FlaskForm
 from flask_ckeditor import CKEditorField
 from flask_wtf.file import FileField, FileRequired
-from wtforms.validators import DataRequired, URL, Length, Email
-from wtforms import StringField, SelectField, PasswordField
+from wtforms.validators import DataRequired, InputRequired, NumberRange, URL, Length, Email
+from wtforms import StringField, SelectField, PasswordField, FloatField
 
 GEAR_CATEGORIES = ["Tents", "Sleeping Bags", "Trekking Poles", "Furniture", "Kitchen"]
+TRAIL_DIFFICULTIES = ["Easy", "Medium", "Hard"]
 
 
 class SignUpForm(FlaskForm):
@@ -60,11 +61,11 @@ class AddTrailForm(FlaskForm):
 
     name = StringField("Trail Name", validators=[DataRequired()])
     description = CKEditorField("Description", validators=[DataRequired()])
-    latitude = StringField("Latitude", validators=[DataRequired()])
-    longitude = StringField("Longitude", validators=[DataRequired()])
+    latitude = FloatField("Latitude", validators=[InputRequired(), NumberRange(min=-90, max=90)])
+    longitude = FloatField("Longitude", validators=[InputRequired(), NumberRange(min=-180, max=180)])
     hiking_distance = StringField("Hiking Distance", validators=[DataRequired()])
     elevation_change = StringField("Elev Change", validators=[DataRequired()])
-    difficulty = SelectField("Difficulty", choices=["Easy", "Medium", "Hard"], validators=[DataRequired()])
+    difficulty = SelectField("Difficulty", choices=TRAIL_DIFFICULTIES, validators=[DataRequired()])
 
 
 class AddTrailPhotoForm(FlaskForm):
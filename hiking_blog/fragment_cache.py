@@ -0,0 +1,148 @@
+"""Keeps rendered sections of busy pages in memory, thrown out when a table they were built from changes."""
+from flask import current_app
+from sqlalchemy import event
+from hiking_blog.db import db
+from collections import OrderedDict
+import threading
+import time
+
+CHANGED_TABLES = "fragment_tables_changed"
+FRAGMENT_CACHE_SIZE = 512
+FRAGMENT_CACHE_TTL = 300
+
+fragment_cache = None
+
+
+class FragmentCache:
+    """
+    A class used to store rendered page sections, or any other value built from the database, keyed by name.
+
+    Once 'max_size' entries are stored, the least recently used is thrown out to make room for each new one, which
+    bounds the memory taken by entries keyed by what users ask for, such as the filters of a trail search.
+
+    Each entry is stored with the tables it was built from. Every time a change to one of those tables is committed
+    through the ORM, the entry is thrown out, and the cache's generation is bumped so that a value built from the
+    database before the change isn't stored after it. Entries are also thrown out once they are older than 'ttl'
+    seconds, which bounds how long another process of the app, whose commits this cache doesn't see, or an UPDATE run
+    outside the ORM, such as the gear view counter, can leave an entry out of date.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value stored under a key, or None if it is missing or too old."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                stored_at, tables, value = entry
+                if time.monotonic() - stored_at < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, tables, generation):
+        """
+        Stores a value under a key, unless a change has been committed since it started being built.
+
+        PARAMETERS
+        ----------
+        key : hashable
+            The name of the value, such as 'dashboard_recent_trails'.
+        value : object
+            The value, such as the rendered html of a page section.
+        tables : iterable
+            The names of the tables the value was built from.
+        generation : int
+            The generation of the cache when the value started being built.
+        """
+
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = (time.monotonic(), frozenset(tables), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, tables):
+        """Throws out every entry built from one of the tables and bumps the generation."""
+        with self.lock:
+            self.generation += 1
+            for key in [key for key, (_, built_from, _) in self.entries.items() if built_from & tables]:
+                del self.entries[key]
+
+    def stats(self):
+        """Returns the hit and miss counts of the cache, along with its size."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "generation": self.generation
+            }
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def create_fragment_cache(app):
+    """
+    Creates the fragment cache and has it invalidated every time a change to a table is committed.
+
+    The tables of the rows each flush adds, changes or deletes are marked on the session, and the entries built from
+    them are thrown out once the change is committed, so a request can't store a value read before the commit under
+    the new generation. Marks left by a session that is rolled back are cleared.
+    """
+
+    global fragment_cache
+    fragment_cache = FragmentCache(
+        app.config.get("FRAGMENT_CACHE_SIZE", FRAGMENT_CACHE_SIZE),
+        app.config.get("FRAGMENT_CACHE_TTL", FRAGMENT_CACHE_TTL)
+    )
+    if not event.contains(db.session, "after_flush", mark_tables_changed):
+        event.listen(db.session, "after_flush", mark_tables_changed)
+        event.listen(db.session, "after_commit", invalidate_after_commit)
+        event.listen(db.session, "after_rollback", clear_tables_changed)
+    return fragment_cache
+
+
+def get_fragment_cache():
+    """Returns the fragment cache, creating it if the app was started without one."""
+    if fragment_cache is None:
+        create_fragment_cache(current_app)
+    return fragment_cache
+
+
+def mark_tables_changed(session, flush_context):
+    """Marks the tables of every row a flush added, changed or deleted on the session that flushed them."""
+    changed = session.info.setdefault(CHANGED_TABLES, set())
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        table = getattr(instance, "__tablename__", None)
+        if table is not None:
+            changed.add(table)
+
+
+def invalidate_after_commit(session):
+    """Invalidates the entries built from the tables a committed session changed."""
+    changed = session.info.pop(CHANGED_TABLES, None)
+    if changed and fragment_cache is not None:
+        fragment_cache.invalidate(changed)
+
+
+def clear_tables_changed(session):
+    """Clears the marks left on a session that has been rolled back."""
+    session.info.pop(CHANGED_TABLES, None)
@@ -1,15 +1,27 @@
 """Contains the functionality for viewing gear info and editing gear entries in the database."""
-from flask import render_template, redirect, url_for, flash, Blueprint, request
+from flask import render_template, redirect, url_for, flash, Blueprint, request, jsonify
 from flask_login import current_user
 from hiking_blog.admin.admin import delete_comment, NO_TAGS
-from hiking_blog.forms import CommentForm
+from hiking_blog.forms import CommentForm, GEAR_CATEGORIES
 from hiking_blog.models import Gear, GearComments
 from hiking_blog.auth.auth import admin_only
+from hiking_blog.search.search_index import index_gear_comment, remove_gear_comment
+from hiking_blog.gear.retailer_offers import get_offers, offer_price
+from hiking_blog.gear.price_scraper import RETAILERS
+from hiking_blog.gear.view_counter import get_view_counter
+from hiking_blog.comment_threads import get_comment_page, InvalidCursor
+from hiking_blog.listings import paginate_listing, description_preview, listing_arguments
 from hiking_blog.db import db
 from datetime import datetime
 import re
 import html
 
+GEAR_SORTS = {
+    "newest": (Gear.date_time_added.desc(), Gear.id.desc()),
+    "name": (Gear.name, Gear.id),
+    "rating": (Gear.rating.desc(), Gear.id)
+}
+
 gear_bp = Blueprint(
     "gear_bp", __name__,
     template_folder="templates",
@@ -19,9 +31,31 @@ gear_bp = Blueprint(
 
 @gear_bp.route("/tamarack-treks/gear/view_all_gear")
 def view_all_gear():
-    """Collects all gear items from the database to display to the user."""
-    all_gear = db.session.query(Gear).all()
-    return render_template("view_all_gear.html", all_gear=all_gear)
+    """
+    Lists the gear in the database a page at a time, to display to the user.
+
+    Only the columns shown on the listing cards are read, with the start of each description, for the page given by
+    the 'page' query argument. The gear is sorted by the 'sort' query argument, one of GEAR_SORTS, and can be filtered
+    to one category with the 'category' query argument.
+    """
+
+    category = request.args.get("category")
+    query = db.session.query(
+        Gear.id, Gear.name, Gear.img, Gear.category, Gear.rating, Gear.weight, Gear.dimensions,
+        description_preview(Gear.description)
+    )
+    if category in GEAR_CATEGORIES:
+        query = query.filter(Gear.category == category)
+    gear_page, sort = paginate_listing(query, GEAR_SORTS, "newest")
+    return render_template(
+        "view_all_gear.html",
+        gear_page=gear_page,
+        sort=sort,
+        sorts=GEAR_SORTS,
+        category=category,
+        categories=GEAR_CATEGORIES,
+        listing_arguments=listing_arguments()
+    )
 
 
 @gear_bp.route("/tamarack-treks/gear/view_gear/<int:db_id>", methods=["GET", "POST"])
@@ -31,7 +65,10 @@ def view_gear(db_id):
 
     Directs the user to a template containing all stored information regarding a gear item in the database.
     Additionally, loads the comment form, allowing the user to comment on the gear and, when submitted, stores their
-    comment in the database as well.
+    comment in the database as well. Only the first page of comments is shown, and the rest are loaded a page at a
+    time from gear_comments. Every time the page is shown, a view is counted by the gear view counter, which adds the
+    views to the gear's view count a batch at a time, and the price scraper uses the counts to check the prices of the
+    most viewed gear more often.
 
     Parameters
     ----------
@@ -50,7 +87,28 @@ def view_gear(db_id):
         create_new_gear_comment(form, gear)
         form.comment_text.data = ""
         return redirect(url_for('gear_bp.view_gear', db_id=db_id))
-    return render_template("view_gear.html", gear=gear, form=form, current_user=current_user, info=info)
+    get_view_counter().record(db_id)
+    comments, next_cursor = get_comment_page(GearComments, GearComments.gear_id, db_id)
+    return render_template("view_gear.html", gear=gear, form=form, current_user=current_user, info=info,
+                           comments=comments, next_cursor=next_cursor)
+
+
+@gear_bp.route("/tamarack-treks/gear/view_gear/<int:db_id>/comments")
+def gear_comments(db_id):
+    """
+    Returns json holding the html of the page of comments on a gear page after the one ending at the 'after' cursor.
+
+    Called by the "Load more comments" button of the view_gear page, which appends the html to the comment thread and
+    asks for the page after it with the returned next_cursor, until next_cursor is null.
+    """
+
+    gear = Gear.query.get_or_404(db_id)
+    try:
+        comments, next_cursor = get_comment_page(GearComments, GearComments.gear_id, db_id, request.args.get("after"))
+    except InvalidCursor as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(html=render_template("gear_comment_list.html", gear=gear, comments=comments),
+                   next_cursor=next_cursor)
 
 
 @gear_bp.route("/tamarack-treks/gear/edit_comment/<comment_id>", methods=["GET", "POST"])
@@ -63,6 +121,7 @@ def edit_gear_comment(comment_id):
     )
     if form.validate_on_submit():
         comment.text = re.sub(NO_TAGS, '', form.comment_text.data)
+        index_gear_comment(comment)
         db.session.commit()
         form.comment_text.data = ""
         return redirect(url_for("gear_bp.view_gear", db_id=db_id))
@@ -90,6 +149,7 @@ def user_delete_gear_comment(comment_id):
     gear_id = request.args["gear_id"]
     comment = GearComments.query.get(comment_id)
     comment.deleted_by = comment.commenter.username
+    remove_gear_comment(comment)
     db.session.commit()
     return redirect(url_for("gear_bp.view_gear", db_id=gear_id))
 
@@ -137,6 +197,7 @@ def create_new_gear_comment(form, gear):
         parent_posts=gear
     )
     db.session.add(new_comment)
+    index_gear_comment(new_comment)
     db.session.commit()
 
 
@@ -145,7 +206,8 @@ def create_product_links(gear):
     Creates a python dictionary containing the price and url of a gear entry.
 
     This function is used by the view_gear function. It creates a dictionary that the view_gear.html page can cycle
-    through to access the price and url for each link of each product.
+    through to access the price and url for each link of each product. The gear piece's offers are loaded with one
+    query on the (gear_id, retailer) index of the retailer_offers table.
 
     Parameters
     ----------
@@ -153,12 +215,10 @@ def create_product_links(gear):
         An object from the gear table of the database.
     """
 
+    offers = get_offers(gear.id)
     info = {
-        "moosejaw": {"price": gear.moosejaw_price,
-                     "link": gear.moosejaw_url},
-        "rei": {"price": gear.rei_price,
-                "link": gear.rei_url},
-        "backcountry": {"price": gear.backcountry_price,
-                        "link": gear.backcountry_url}
+        retailer: {"price": offer_price(offers[retailer]),
+                   "link": offers[retailer].url}
+        for retailer in RETAILERS if retailer in offers
     }
     return info
@@ -1,43 +1,280 @@
 """Contains the functions that determine the price of a piece of gear from three major retailers."""
+from requests.adapters import HTTPAdapter
+from lxml import etree
+import threading
 import requests
-from bs4 import BeautifulSoup
+import json
+import re
 
 
 HEADER = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 ("
                   "KHTML, like Gecko) Chrome/98.0.4758.102 Safari/537.36",
-    "Accept-Language": "en-US,en;q=0.9,lb;q=0.8,fr;q=0.7"
+    "Accept-Language": "en-US,en;q=0.9,lb;q=0.8,fr;q=0.7",
+    "Accept-Encoding": "gzip, deflate"
 }
+REQUEST_TIMEOUT = 10
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+DEAD_STATUS_CODES = {404, 410}
+NOT_MODIFIED = 304
+POOL_SIZE = 4
+PARSE_CHUNK_SIZE = 4096
+PRICE_AMOUNT = re.compile(r"\d[\d,]*(?:\.\d+)?")
+NAME_CHARACTER = re.compile(r"[\w-]")
+JSON_LD_TYPE = "application/ld+json"
+CLASS_ATTRIBUTE = re.compile(r"<[a-zA-Z][^<>]*\sclass\s*=\s*[\"']?[^\"'<>=]*$")
 
+retailer_sessions = {}
+sessions_lock = threading.Lock()
 
-def moosejaw_price_query(moosejaw_url):
+
+class PriceNotFound(LookupError):
+    """Raised when no price can be read from a retailer page."""
+
+
+class PriceExtractor:
+    """
+    A class used to read the price from the html of a retailer's gear page without parsing the whole page.
+
+    Retailer pages are hundreds of kilobytes to a few megabytes of html, but the price sits in one small element, so
+    building a tree of the whole page just to find it costs far more than the request. The price is looked for in two
+    ways, cheapest first:
+
+    1. Most product pages describe the product in a JSON-LD script for search engines, so if the retailer's pages do,
+       the price is read from the 'offers' of that script, which is found with a plain string search and loaded with
+       json, without parsing any html.
+    2. Otherwise, each of the retailer's price classes is found in the raw html with a plain string search, and the
+       html is streamed into lxml's pull parser starting from the tag holding the class, stopping as soon as that
+       element is closed. Only the price element itself is ever parsed. A class found somewhere other than in a tag's
+       class attribute, such as in a script, is skipped, or gives no valid price, and the next place it appears is
+       tried.
+
+    Only prices made of digits, commas and a decimal point are returned, so a page whose price element holds something
+    else is treated as having no price rather than having the text stored as its price.
+
+    PARAMETERS
+    ----------
+    price_classes : list
+        The html classes of the element holding the price, the preferred one first.
+    json_ld : bool
+        True if the price should first be looked for in the page's JSON-LD.
+    """
+
+    def __init__(self, price_classes, json_ld=True):
+        self.price_classes = list(price_classes)
+        self.json_ld = json_ld
+
+    def __call__(self, page):
+        """Returns the price on the html of a gear page, raising PriceNotFound if there isn't one."""
+        if self.json_ld:
+            price = read_json_ld_price(page)
+            if price is not None:
+                return price
+        for price_class in self.price_classes:
+            for position in find_class_name(page, price_class):
+                tag_start = page.rfind("<", 0, position)
+                if tag_start == -1 or not CLASS_ATTRIBUTE.match(page, tag_start, position):
+                    continue
+                price = format_price(read_element_text(page, tag_start, price_class))
+                if price is not None:
+                    return price
+        raise PriceNotFound("No price was found on the page.")
+
+
+PRICE_READERS = {
+    "moosejaw": PriceExtractor(["price-set-updated", "price-set"]),
+    "rei": PriceExtractor(["price-value"]),
+    "backcountry": PriceExtractor(["css-1sxaem"])
+}
+
+
+def moosejaw_price_query(moosejaw_url, timeout=REQUEST_TIMEOUT):
     """Scrapes the Moosejaw page of the requested gear piece and returns its price"""
-    response = requests.get(moosejaw_url, headers=HEADER)
-    soup = BeautifulSoup(response.text, features="lxml")
+    return PRICE_READERS["moosejaw"](get_page("moosejaw", moosejaw_url, timeout).text)
+
+
+def rei_price_query(rei_url, timeout=REQUEST_TIMEOUT):
+    """Scrapes the REI page of the requested gear piece and returns its price"""
+    return PRICE_READERS["rei"](get_page("rei", rei_url, timeout).text)
+
+
+def backcountry_price_query(backcountry_url, timeout=REQUEST_TIMEOUT):
+    """Scrapes the Backcountry page of the requested gear piece and returns its price"""
+    return PRICE_READERS["backcountry"](get_page("backcountry", backcountry_url, timeout).text)
+
+
+def read_json_ld_price(page):
+    """Returns the price in the first offer of a page's JSON-LD scripts, or None if none of them has one."""
+    for script in find_json_ld(page):
+        try:
+            data = json.loads(script)
+        except ValueError:
+            continue
+        price = find_offer_price(data)
+        if price is not None:
+            return price
+    return None
+
+
+def find_json_ld(page):
+    """Yields the contents of every JSON-LD script in a page's html."""
+    position = page.find(JSON_LD_TYPE)
+    while position != -1:
+        script_start = page.find(">", position) + 1
+        script_end = page.find("</script>", script_start)
+        if script_start == 0 or script_end == -1:
+            return
+        if page.rfind("<script", 0, position) > page.rfind(">", 0, position):
+            yield page[script_start:script_end]
+        position = page.find(JSON_LD_TYPE, script_end)
+
+
+def find_class_name(page, class_name):
+    """Yields the position of every appearance of a class name in a page's html that isn't part of a longer name."""
+    position = page.find(class_name)
+    while position != -1:
+        end = position + len(class_name)
+        if not NAME_CHARACTER.match(page, position - 1 if position else 0, position) and \
+                not NAME_CHARACTER.match(page, end, end + 1):
+            yield position
+        position = page.find(class_name, end)
+
+
+def find_offer_price(data):
+    """Searches loaded JSON-LD for the first offer with a valid price and returns it, or None if there isn't one."""
+    if isinstance(data, list):
+        items = data
+    elif isinstance(data, dict):
+        offers = data.get("offers")
+        for offer in offers if isinstance(offers, list) else [offers]:
+            if isinstance(offer, dict):
+                amount = offer.get("price", offer.get("lowPrice"))
+                if isinstance(amount, (int, float)) and not isinstance(amount, bool):
+                    amount = f"{amount:.2f}"
+                if isinstance(amount, str) and PRICE_AMOUNT.fullmatch(amount.strip()):
+                    return "$" + amount.strip()
+        items = data.get("@graph", [])
+    else:
+        return None
+    for item in items:
+        price = find_offer_price(item)
+        if price is not None:
+            return price
+    return None
+
+
+def read_element_text(page, tag_start, price_class):
+    """
+    Returns the text of the element starting at 'tag_start' in a page's html, or None if it isn't an element.
+
+    The html is fed to lxml's pull parser a chunk at a time from the element's opening tag, so parsing stops as soon
+    as the element is closed, and the rest of the page is never read.
+    """
+
+    parser = etree.HTMLPullParser(events=("start", "end"))
+    element = None
+    for chunk_start in range(tag_start, len(page), PARSE_CHUNK_SIZE):
+        parser.feed(page[chunk_start:chunk_start + PARSE_CHUNK_SIZE])
+        for event, parsed in parser.read_events():
+            if element is None:
+                if event == "start" and price_class in (parsed.get("class") or "").split():
+                    element = parsed
+            elif event == "end" and parsed is element:
+                return "".join(element.itertext())
+    parser.close()
+    return None if element is None else "".join(element.itertext())
+
+
+def format_price(text):
+    """Returns the first dollar amount in the text of a price element, such as '$129.95', or None if there isn't one."""
+    if text is None:
+        return None
     try:
-        gear_price = "$" + soup.find(class_="price-set-updated").getText().split("$")[1].split(" ")[0].strip()
-    except:
-        gear_price = "$" + soup.find(class_="price-set").getText().split("$")[1].split(" ")[0].strip().strip("-").strip()
+        amount = text.split("$")[1].split()[0].strip("-")
+    except IndexError:
+        return None
+    return "$" + amount if PRICE_AMOUNT.fullmatch(amount) else None
 
-    return gear_price
 
+def get_page(retailer, url, timeout, validators=None):
+    """
+    Requests a retailer page over the retailer's shared session, giving up after 'timeout' seconds without a response.
 
-def rei_price_query(rei_url):
-    """Scrapes the REI page of the requested gear piece and returns its price"""
-    response = requests.get(rei_url, headers=HEADER)
-    soup = BeautifulSoup(response.text, features="lxml")
-    gear_price = "$" + soup.find(class_="price-value").getText().split("$")[1].split(" ")[0].strip("-")
+    If the validators stored from the last time the page was loaded are given, the request is made conditional on the
+    page having changed since, and the retailer answers with an empty 304 response when it hasn't. Rate limiting and
+    server errors are raised as a requests.HTTPError so the scraper can retry them, rather than having the error page
+    read as a page with no price on it, which would mark the link dead.
 
-    return gear_price
+    PARAMETERS
+    ----------
+    retailer : str
+        The name of the retailer the page belongs to.
+    url : str
+        The address of the gear page.
+    timeout : float
+        The number of seconds given to connect and to send each part of the response.
+    validators : tuple
+        The (ETag, Last-Modified) headers sent with the page the last time it was loaded, or None.
+    """
 
+    headers = {}
+    if validators is not None:
+        etag, last_modified = validators
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    response = get_retailer_session(retailer).get(url, headers=headers, timeout=timeout)
+    if response.status_code in RETRY_STATUS_CODES:
+        response.raise_for_status()
+    return response
 
-def backcountry_price_query(backcountry_url):
-    """Scrapes the Backcountry page of the requested gear piece and returns its price"""
-    response = requests.get(backcountry_url, headers=HEADER)
-    soup = BeautifulSoup(response.text, features="lxml")
-    gear_price = "$" + soup.find(class_="css-1sxaem").getText().split("$")[1].split(" ")[0].strip("-")
 
-    return gear_price
+def page_validators(response):
+    """Returns the (ETag, Last-Modified) headers of a response, or None if it was sent with neither."""
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if etag is None and last_modified is None:
+        return None
+    return etag, last_modified
+
+
+def create_retailer_sessions(retailers, pool_size=POOL_SIZE):
+    """
+    Creates one requests session per retailer, replacing any made before.
+
+    Each session keeps up to 'pool_size' connections to its retailer alive between requests, so a sweep over many
+    pages from the same retailer only pays for a TCP connection and TLS handshake a few times rather than once per
+    page. The sessions are safe to share between the scraper's threads, and 'pool_size' should be at least the number
+    of requests the scraper has open to one retailer at a time, or connections are dropped as soon as they're used.
+    """
+
+    sessions = {retailer: make_session(pool_size) for retailer in retailers}
+    with sessions_lock:
+        old_sessions = list(retailer_sessions.values())
+        retailer_sessions.clear()
+        retailer_sessions.update(sessions)
+    for session in old_sessions:
+        session.close()
+    return sessions
+
 
+def get_retailer_session(retailer):
+    """Returns the shared session of a retailer, creating it if the sessions haven't been created."""
+    session = retailer_sessions.get(retailer)
+    if session is None:
+        with sessions_lock:
+            if retailer not in retailer_sessions:
+                retailer_sessions[retailer] = make_session(POOL_SIZE)
+            session = retailer_sessions[retailer]
+    return session
 
 
+def make_session(pool_size):
+    """Returns a requests session sending the scraper's headers and keeping up to 'pool_size' connections alive."""
+    session = requests.Session()
+    session.headers.update(HEADER)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
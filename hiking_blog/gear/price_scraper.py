@@ -0,0 +1,143 @@
+"""Scrapes the prices of many gear pages from the three retailers at once, with limits, timeouts and retries."""
+from hiking_blog.gear.gear_prices import get_page, page_validators, PriceNotFound, NOT_MODIFIED, DEAD_STATUS_CODES
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+import threading
+import time
+import requests
+
+RETAILERS = ("moosejaw", "rei", "backcountry")
+MAX_WORKERS = 12
+RETAILER_CONCURRENCY = 4
+REQUEST_TIMEOUT = 10
+RETRIES = 2
+RETRY_BACKOFF = 1.0
+
+ScrapeJob = namedtuple("ScrapeJob", ["offer_id", "retailer", "url", "validators"])
+ScrapeResult = namedtuple("ScrapeResult", ["offer_id", "retailer", "price", "status", "validators", "detail"])
+
+PRICE_FOUND = "found"
+PRICE_MISSING = "missing"
+PAGE_UNCHANGED = "unchanged"
+LINK_GONE = "gone"
+REQUEST_FAILED = "failed"
+
+
+class PriceScraper:
+    """
+    A class used to scrape the prices of a batch of gear pages with a bounded pool of threads.
+
+    Every retailer has its own semaphore, so no more than 'retailer_concurrency' requests are ever open to one retailer
+    at a time, however many threads the pool has. Each request is given 'timeout' seconds. A request that fails to
+    connect, times out or is answered with one of the RETRY_STATUS_CODES of gear_prices, 429 Too Many Requests, 500
+    Internal Server Error, 502 Bad Gateway, 503 Service Unavailable or 504 Gateway Timeout, is retried up to 'retries'
+    times, waiting a little longer before each retry, and is only reported as failed once every attempt has. A page
+    that loads but has no price on it isn't retried, since reloading it won't change that, and neither is a page the
+    retailer answers with 404 Not Found or 410 Gone, which is reported as gone, or with any other error status,
+    including other server errors, which is reported as failed.
+
+    Every result that isn't a price carries a short detail for the admins, such as 'HTTP 404' or 'ReadTimeout'.
+
+    Pages are requested over the shared retailer sessions in gear_prices, which keep connections alive between
+    requests. When a job carries the validators stored from the last time its page was loaded, the request is
+    conditional, and a page the retailer reports as not modified is returned as unchanged without being parsed.
+
+    The threads only make requests and read prices out of the pages; they never touch the database. Every result is
+    gathered and returned together, so the caller can apply them all to the database in one batch.
+
+    PARAMETERS
+    ----------
+    price_readers : dict
+        Maps each retailer's name to the function that reads the price from the html of one of its pages, such as the
+        PriceExtractors in gear_prices. The function raises a PriceNotFound when the price can't be found on the page.
+    max_workers : int
+        The number of threads making requests.
+    retailer_concurrency : int
+        The largest number of requests open to a single retailer at a time.
+    timeout : float
+        The number of seconds each request is given to connect and to send each part of its response.
+    retries : int
+        The number of times a failed request is retried.
+    backoff : float
+        The number of seconds waited before the first retry, doubled before each retry after it.
+    """
+
+    def __init__(self, price_readers, max_workers=MAX_WORKERS, retailer_concurrency=RETAILER_CONCURRENCY,
+                 timeout=REQUEST_TIMEOUT, retries=RETRIES, backoff=RETRY_BACKOFF):
+        self.price_readers = price_readers
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.limits = {retailer: threading.BoundedSemaphore(retailer_concurrency) for retailer in price_readers}
+
+    def scrape(self, jobs):
+        """Scrapes every job concurrently and returns a ScrapeResult for each, in the same order as the jobs."""
+        if not jobs:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(jobs))) as executor:
+            return list(executor.map(self.scrape_job, jobs))
+
+    def scrape_job(self, job):
+        """Scrapes the price of one gear page, retrying requests that fail, and returns the result."""
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                with self.limits[job.retailer]:
+                    response = get_page(job.retailer, job.url, self.timeout, job.validators)
+                    page = response.text
+            except requests.RequestException as e:
+                error = e
+                continue
+            if response.status_code == NOT_MODIFIED:
+                return ScrapeResult(job.offer_id, job.retailer, None, PAGE_UNCHANGED, job.validators, None)
+            if response.status_code in DEAD_STATUS_CODES:
+                return ScrapeResult(job.offer_id, job.retailer, None, LINK_GONE, None, http_detail(response))
+            if not response.ok:
+                return ScrapeResult(job.offer_id, job.retailer, None, REQUEST_FAILED, job.validators,
+                                    http_detail(response))
+            validators = page_validators(response)
+            try:
+                price = self.price_readers[job.retailer](page)
+            except PriceNotFound as e:
+                return ScrapeResult(job.offer_id, job.retailer, None, PRICE_MISSING, validators, str(e))
+            return ScrapeResult(job.offer_id, job.retailer, price, PRICE_FOUND, validators, None)
+        return ScrapeResult(job.offer_id, job.retailer, None, REQUEST_FAILED, job.validators, error_detail(error))
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def http_detail(response):
+    """Returns the detail recorded for a page the retailer answered with an error, such as 'HTTP 404'."""
+    return f"HTTP {response.status_code}"
+
+
+def error_detail(error):
+    """Returns the detail recorded for a request that failed, such as 'HTTP 503' or 'ReadTimeout'."""
+    response = getattr(error, "response", None)
+    if response is not None:
+        return http_detail(response)
+    return type(error).__name__
+
+
+def make_scrape_jobs(all_offers):
+    """
+    Makes a ScrapeJob for every retailer offer with a link.
+
+    Each job carries the ETag and Last-Modified headers stored with the offer, so its request can be made conditional.
+
+    PARAMETERS
+    ----------
+    all_offers : list
+        Entries from the retailer_offers table of the database.
+    """
+
+    jobs = []
+    for offer in all_offers:
+        if offer.url:
+            validators = None
+            if offer.etag or offer.last_modified:
+                validators = (offer.etag, offer.last_modified)
+            jobs.append(ScrapeJob(offer.id, offer.retailer, offer.url, validators))
+    return jobs
@@ -0,0 +1,193 @@
+"""Reads and records the prices of gear at each retailer, keeping a history of every change to them."""
+from hiking_blog.models import RetailerOffer, PriceObservation, Gear
+from hiking_blog.gear.price_scraper import PRICE_MISSING
+from hiking_blog.db import db
+from sqlalchemy import func, and_, or_
+from datetime import datetime
+import re
+
+OUT_OF_STOCK = "Out of stock"
+RETAILER_LINK_NAMES = {
+    "moosejaw": "Moosejaw Link",
+    "rei": "REI Link",
+    "backcountry": "Backcountry Link"
+}
+PRICE_TEXT = re.compile(r"\$?\s*(\d[\d,]*)(?:\.(\d{1,2}))?")
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def price_to_cents(price):
+    """Returns a price such as '$1,299.95' as a number of cents, or None if the text isn't a price."""
+    match = PRICE_TEXT.fullmatch((price or "").strip())
+    if match is None:
+        return None
+    dollars, cents = match.groups()
+    return int(dollars.replace(",", "")) * 100 + int((cents or "0").ljust(2, "0"))
+
+
+def cents_to_price(cents):
+    """Returns a number of cents as a price such as '$1,299.95', or an empty string if there is no price."""
+    if cents is None:
+        return ""
+    return f"${cents // 100:,}.{cents % 100:02d}"
+
+
+def offer_price(offer):
+    """Returns the price shown for a retailer's offer, which is 'Out of stock' when the retailer has none left."""
+    return cents_to_price(offer.price_cents) if offer.in_stock else OUT_OF_STOCK
+
+
+def get_offers(gear_id):
+    """Returns a gear piece's offers, keyed by retailer, with a single query on the (gear_id, retailer) index."""
+    return {offer.retailer: offer for offer in RetailerOffer.query.filter_by(gear_id=gear_id)}
+
+
+def record_price(offer, price_cents, in_stock, observed_at=None):
+    """
+    Sets the price and stock of a retailer's offer, adding a price observation to its history if either has changed.
+
+    Observations are only added when something changes, rather than every time a price is checked, so the history
+    holds every price the offer has had and when it started, without growing with every sweep of the price scraper.
+
+    PARAMETERS
+    ----------
+    offer : RetailerOffer
+        An entry from the retailer_offers table of the database.
+    price_cents : int
+        The price in cents, or None if the price isn't known.
+    in_stock : bool
+        False if the retailer is out of stock.
+    observed_at : datetime
+        The time the price was checked, which defaults to now.
+
+    Returns True if the price or stock changed.
+    """
+
+    if offer.price_cents == price_cents and offer.in_stock == in_stock and offer.id is not None:
+        return False
+    offer.price_cents = price_cents
+    offer.in_stock = in_stock
+    db.session.add(PriceObservation(
+        gear=offer.gear,
+        retailer=offer.retailer,
+        price_cents=price_cents,
+        in_stock=in_stock,
+        observed_at=observed_at or datetime.now()
+    ))
+    return True
+
+
+def set_offer(gear, retailer, url, price):
+    """
+    Sets a gear piece's offer from a retailer to the url and price entered in the gear form.
+
+    An offer with neither a url nor a price entered is removed. An offer that is saved is no longer considered dead or
+    out of stock, so the price scraper will check it again, and one with a url but no price is given its price on the
+    scraper's next sweep. An offer whose url changes is due to be checked straight away, and loses the flags its old
+    url was given.
+
+    PARAMETERS
+    ----------
+    gear : Gear
+        An entry from the gear table of the database, which may not have been added yet.
+    retailer : str
+        The name of the retailer.
+    url : str
+        The link to the gear piece on the retailer's site, or an empty string if there is none, stored as None.
+    price : str
+        The price as entered, such as '$129.95'.
+    """
+
+    offer = next((offer for offer in gear.offers if offer.retailer == retailer), None)
+    if not url and not price:
+        if offer is not None:
+            gear.offers.remove(offer)
+        return
+    if offer is None:
+        offer = RetailerOffer(retailer=retailer, in_stock=True, link_dead=False)
+        gear.offers.append(offer)
+    url = url or None
+    if offer.url != url:
+        offer.etag = None
+        offer.last_modified = None
+        offer.next_check = None
+        offer.check_status = None
+        offer.check_detail = None
+    offer.url = url
+    offer.link_dead = False
+    record_price(offer, price_to_cents(price), True)
+
+
+def flagged_offers():
+    """
+    Returns the offers the admins need to look at, with the name of their gear piece, in order of gear name.
+
+    These are the offers whose links are dead and the offers in stock whose price could not be read, which are found
+    through the indexes on link_dead and check_status rather than by reading every offer. Returns a list of (gear name,
+    offer) pairs.
+    """
+
+    return db.session.query(Gear.name, RetailerOffer).join(RetailerOffer, RetailerOffer.gear_id == Gear.id).filter(
+        or_(
+            RetailerOffer.link_dead.is_(True),
+            and_(RetailerOffer.check_status == PRICE_MISSING, RetailerOffer.in_stock.is_(True))
+        )
+    ).order_by(Gear.name, RetailerOffer.retailer).all()
+
+
+def lowest_prices(gear_ids=None):
+    """
+    Returns the lowest price in cents of every piece of gear, keyed by gear id, counting only live, in-stock offers.
+
+    PARAMETERS
+    ----------
+    gear_ids : list
+        The ids of the gear pieces to look up, or None for all of them.
+    """
+
+    query = db.session.query(RetailerOffer.gear_id, func.min(RetailerOffer.price_cents)).filter(
+        RetailerOffer.in_stock.is_(True),
+        RetailerOffer.link_dead.is_(False),
+        RetailerOffer.price_cents.isnot(None)
+    )
+    if gear_ids is not None:
+        query = query.filter(RetailerOffer.gear_id.in_(gear_ids))
+    return dict(query.group_by(RetailerOffer.gear_id))
+
+
+def price_drops(since):
+    """
+    Returns the offers whose price is now lower than it was at a point in time.
+
+    The price at that time is the last observation made before it, found through the (gear_id, retailer, observed_at)
+    index. Returns a list of (offer, previous price in cents) pairs, the largest drop first.
+
+    PARAMETERS
+    ----------
+    since : datetime
+        The point in time to compare prices to.
+    """
+
+    last_before = db.session.query(
+        PriceObservation.gear_id,
+        PriceObservation.retailer,
+        func.max(PriceObservation.observed_at).label("observed_at")
+    ).filter(PriceObservation.observed_at < since).group_by(PriceObservation.gear_id, PriceObservation.retailer) \
+        .subquery()
+    drops = db.session.query(RetailerOffer, PriceObservation.price_cents).join(
+        last_before,
+        and_(last_before.c.gear_id == RetailerOffer.gear_id, last_before.c.retailer == RetailerOffer.retailer)
+    ).join(
+        PriceObservation,
+        and_(
+            PriceObservation.gear_id == last_before.c.gear_id,
+            PriceObservation.retailer == last_before.c.retailer,
+            PriceObservation.observed_at == last_before.c.observed_at
+        )
+    ).filter(
+        RetailerOffer.in_stock.is_(True),
+        RetailerOffer.link_dead.is_(False),
+        RetailerOffer.price_cents < PriceObservation.price_cents
+    )
+    return sorted(drops, key=lambda drop: drop[0].price_cents - drop[1])
+
@@ -0,0 +1,242 @@
+"""Decides when each retailer offer is next scraped, checking popular and changing prices more often than others."""
+from collections import namedtuple
+import heapq
+import math
+
+MIN_INTERVAL = 60
+DEFAULT_INTERVAL = 900
+MAX_INTERVAL = 86400
+FAILURE_RETRY = 60
+CHANGED_FACTOR = 0.5
+STABLE_FACTOR = 1.5
+STALE_FACTOR = 2.0
+FAVORITE_WEIGHT = 50
+RETAILER_BUDGET = 30
+
+PRICE_CHANGED = "changed"
+PRICE_STABLE = "stable"
+OFFER_STALE = "stale"
+CHECK_FAILED = "failed"
+
+ScheduleEntry = namedtuple("ScheduleEntry", ["retailer", "interval", "failures", "next_due"])
+
+
+class RateBudget:
+    """
+    A class used to limit the number of requests sent to one retailer per minute, as a token bucket.
+
+    The bucket holds up to a minute's worth of requests and refills continuously, so requests can come in short bursts
+    but never average more than 'per_minute' over time.
+
+    PARAMETERS
+    ----------
+    per_minute : int
+        The number of requests allowed per minute.
+    now : float
+        The current time, in seconds since the epoch.
+    """
+
+    def __init__(self, per_minute, now):
+        self.per_minute = per_minute
+        self.tokens = float(per_minute)
+        self.updated = now
+
+    def take(self, now):
+        """Uses up one request if there is one left, returning True, or returns False if the budget is spent."""
+        self.refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def available(self, now):
+        """Returns the number of requests that can be sent straight away."""
+        self.refill(now)
+        return int(self.tokens)
+
+    def next_token(self, now):
+        """Returns the time at which the next request will be allowed."""
+        self.refill(now)
+        return now + max(0.0, 1 - self.tokens) * 60 / self.per_minute
+
+    def refill(self, now):
+        """Adds the requests allowed since the budget was last used."""
+        self.tokens = min(self.per_minute, self.tokens + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+
+class ScrapeScheduler:
+    """
+    A class used to decide which retailer offers are due to be scraped, replacing a sweep of every offer.
+
+    Every offer has its own check interval, and each retailer's offers are kept in a heap ordered by when they are next
+    due. After each check the interval adapts to what was found: a price that changed halves it, a price that stayed
+    the same, or a page the retailer reported unchanged, grows it by half, and a page without a price, which is a dead
+    link or an item out of stock, doubles it, so stable and dead offers back off exponentially towards 'max_interval'
+    while volatile ones are checked down to every 'min_interval' seconds. A check that fails to reach the retailer
+    leaves the interval as it is and is retried after FAILURE_RETRY seconds, doubling with every failure in a row.
+
+    The time until an offer is next due is its interval divided by its gear piece's popularity factor, which grows
+    with the logarithm of the piece's page views and favorites, so the gear people look at most has the freshest
+    prices. On top of that, each retailer has a budget of requests per minute, and offers that are due while their
+    retailer's budget is spent wait at the top of its heap until it refills.
+
+    Intervals are kept in memory only. When the scheduler starts, offers are scheduled from the time they were last
+    checked, so a restart doesn't check again the offers that were checked recently.
+
+    PARAMETERS
+    ----------
+    retailer_budget : int
+        The number of requests allowed per minute to each retailer.
+    min_interval : float
+        The shortest time in seconds between two checks of an offer.
+    max_interval : float
+        The longest time in seconds between two checks of an offer.
+    default_interval : float
+        The interval an offer starts with.
+    """
+
+    def __init__(self, retailer_budget=RETAILER_BUDGET, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 default_interval=DEFAULT_INTERVAL):
+        self.retailer_budget = retailer_budget
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+        self.heaps = {}
+        self.entries = {}
+        self.popularity = {}
+        self.budgets = {}
+
+    def sync(self, offers, popularity, now):
+        """
+        Brings the scheduled offers in line with the offers in the database.
+
+        New offers are scheduled from the time they were last checked, or straight away if they never have been, and
+        offers that have been removed, or whose link has been taken away, are dropped. The popularity of every gear
+        piece is replaced, and takes effect the next time each of its offers is scheduled.
+
+        PARAMETERS
+        ----------
+        offers : list
+            An (offer id, gear id, retailer, url, last checked) tuple for every offer in the database.
+        popularity : dict
+            Maps the id of every gear piece with page views or favorites to its popularity factor.
+        now : float
+            The current time, in seconds since the epoch.
+        """
+
+        self.popularity = popularity
+        current = set()
+        for offer_id, gear_id, retailer, url, last_checked in offers:
+            if not url:
+                continue
+            current.add(offer_id)
+            if offer_id not in self.entries:
+                next_due = now
+                if last_checked is not None:
+                    next_due = min(now + self.default_interval, last_checked.timestamp() + self.wait(
+                        self.default_interval, gear_id))
+                self.schedule(offer_id, ScheduleEntry(retailer, self.default_interval, 0, next_due), gear_id)
+        for offer_id in set(self.entries) - current:
+            del self.entries[offer_id]
+
+    def due(self, now, limit=None):
+        """
+        Takes the ids of the offers that are due to be scraped off the heaps.
+
+        Offers are taken from each retailer's heap until none are due or its budget is spent, and at most 'limit'
+        offers are returned altogether, if a limit is given.
+        """
+
+        due = []
+        for retailer, heap in self.heaps.items():
+            budget = self.budgets.setdefault(retailer, RateBudget(self.retailer_budget, now))
+            while heap and (limit is None or len(due) < limit):
+                next_due, offer_id, _ = heap[0]
+                if not self.is_current(offer_id, next_due):
+                    heapq.heappop(heap)
+                    continue
+                if next_due > now or not budget.take(now):
+                    break
+                heapq.heappop(heap)
+                due.append(offer_id)
+        return due
+
+    def reschedule(self, offer_id, gear_id, outcome, now):
+        """
+        Adapts the interval of an offer that has just been checked and schedules its next check.
+
+        PARAMETERS
+        ----------
+        offer_id : int
+            The id of the offer.
+        gear_id : int
+            The id of the offer's gear piece.
+        outcome : str
+            PRICE_CHANGED, PRICE_STABLE, OFFER_STALE or CHECK_FAILED.
+        now : float
+            The current time, in seconds since the epoch.
+        """
+
+        entry = self.entries.get(offer_id)
+        if entry is None:
+            return
+        if outcome == CHECK_FAILED:
+            retry = failure_retry(entry.interval, entry.failures)
+            self.schedule(offer_id, entry._replace(failures=entry.failures + 1, next_due=now + retry), gear_id)
+            return
+        interval = adapt_interval(entry.interval, outcome, self.min_interval, self.max_interval)
+        next_due = now + self.wait(interval, gear_id)
+        self.schedule(offer_id, ScheduleEntry(entry.retailer, interval, 0, next_due), gear_id)
+
+    def drop(self, offer_id):
+        """Stops scheduling an offer until the next sync, such as one removed since it was taken off the heap."""
+        self.entries.pop(offer_id, None)
+
+    def wait(self, interval, gear_id):
+        """Returns the time until an offer with an interval is next due, shortened by its gear piece's popularity."""
+        return popular_wait(interval, self.popularity.get(gear_id, 1), self.min_interval)
+
+    def schedule(self, offer_id, entry, gear_id):
+        """Stores an offer's schedule and pushes it onto its retailer's heap, where older items for it are skipped."""
+        self.entries[offer_id] = entry
+        heapq.heappush(self.heaps.setdefault(entry.retailer, []), (entry.next_due, offer_id, gear_id))
+
+    def is_current(self, offer_id, next_due):
+        """Returns True if a heap item is the offer's current schedule, rather than one replaced or dropped since."""
+        entry = self.entries.get(offer_id)
+        return entry is not None and entry.next_due == next_due
+
+    def next_due(self, now):
+        """Returns the time the next offer can be scraped, given the retailers' budgets, or None if there are none."""
+        times = []
+        for retailer, heap in self.heaps.items():
+            while heap and not self.is_current(heap[0][1], heap[0][0]):
+                heapq.heappop(heap)
+            if heap:
+                budget = self.budgets.get(retailer)
+                ready = now if budget is None else budget.next_token(now)
+                times.append(max(heap[0][0], ready))
+        return min(times, default=None)
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def popularity_factor(views, favorites):
+    """Returns the number a gear piece's check intervals are divided by, from its page views and favorites."""
+    return 1 + math.log10(1 + views + FAVORITE_WEIGHT * favorites)
+
+
+def adapt_interval(interval, outcome, min_interval, max_interval):
+    """Returns an offer's next check interval after a check with an outcome other than CHECK_FAILED."""
+    factor = {PRICE_CHANGED: CHANGED_FACTOR, PRICE_STABLE: STABLE_FACTOR, OFFER_STALE: STALE_FACTOR}[outcome]
+    return min(max_interval, max(min_interval, interval * factor))
+
+
+def failure_retry(interval, failures):
+    """Returns the time until a check that failed 'failures' times in a row before this one is retried."""
+    return min(interval, FAILURE_RETRY * 2 ** failures)
+
+
+def popular_wait(interval, popularity, min_interval):
+    """Returns the time until an offer with an interval is next due, divided by its gear piece's popularity factor."""
+    return max(min_interval, interval / popularity)
@@ -0,0 +1,75 @@
+"""Counts gear page views in memory and adds them to the gear table a batch at a time."""
+from flask import current_app
+from sqlalchemy import update, bindparam
+from hiking_blog.models import Gear
+from hiking_blog.db import db
+from collections import Counter
+import threading
+import time
+
+VIEW_COUNT_FLUSH_INTERVAL = 60
+
+view_counter = None
+
+
+class GearViewCounter:
+    """
+    A class used to count the views of each gear page in this process and write them to the database together.
+
+    Views are added to an in-memory count, and once 'flush_interval' seconds have passed since the counts were last
+    written, the request that notices adds them all to the view_count column with one batched UPDATE, run in its own
+    transaction so the request's session isn't committed and its gear piece isn't expired. Viewing a gear page is
+    therefore a write to the database only once every 'flush_interval' seconds per process, rather than on every
+    request. The scrape scheduler only uses the view counts as a rough sign of popularity, so the views counted since
+    the last write, which are lost if the process stops, don't matter.
+    """
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self.counts = Counter()
+        self.flushed_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, gear_id):
+        """Counts a view of a gear page, and writes every count to the database if they are due to be written."""
+        with self.lock:
+            self.counts[gear_id] += 1
+            if time.monotonic() - self.flushed_at < self.flush_interval:
+                return
+            counts, self.counts = self.counts, Counter()
+            self.flushed_at = time.monotonic()
+        self.write(counts)
+
+    def flush(self):
+        """Writes every count to the database straight away."""
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+            self.flushed_at = time.monotonic()
+        self.write(counts)
+
+    def write(self, counts):
+        """Adds the views of every gear piece to its view count with one batched UPDATE in its own transaction."""
+        if not counts:
+            return
+        gear = Gear.__table__
+        with db.engine.begin() as connection:
+            connection.execute(
+                update(gear).where(gear.c.id == bindparam("gear_id"))
+                .values(view_count=gear.c.view_count + bindparam("views")),
+                [{"gear_id": gear_id, "views": views} for gear_id, views in counts.items()]
+            )
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def create_view_counter(app):
+    """Creates the gear view counter."""
+    global view_counter
+    view_counter = GearViewCounter(app.config.get("VIEW_COUNT_FLUSH_INTERVAL", VIEW_COUNT_FLUSH_INTERVAL))
+    return view_counter
+
+
+def get_view_counter():
+    """Returns the gear view counter, creating it if the app was started without one."""
+    if view_counter is None:
+        create_view_counter(current_app)
+    return view_counter
@@ -2,7 +2,10 @@
 from flask import Blueprint, render_template, redirect, url_for, send_from_directory
 from flask_login import current_user
 from hiking_blog.models import Trails, Gear
+from hiking_blog.trails.trails import first_trail_pic
+from hiking_blog.fragment_cache import get_fragment_cache
 from hiking_blog.db import db
+from markupsafe import Markup
 # This import only exists for development purposes
 from hiking_blog.dev_db_autofill import create_database
 
@@ -13,6 +16,7 @@ WELCOME_TEXT = "Tamarack Treks is an online resource and community that aims to
                " Montana is situated in the northern Rocky Mountains where a number of unique ranges, rivers, and" \
                " habitats create a beautiful, wild outdoor space. The hiking, camping and outdoor recreational" \
                " opportunities are limitless. We will help you explore it all."
+RECENT_COUNT = 3
 
 home_bp = Blueprint(
     "home_bp",
@@ -33,25 +37,21 @@ def home():
     """
     Renders the home page.
 
-    Loads all information on saved trails and gear from the database to be sent to the dashboard.html template before
-    rendering said template.
+    The recent trail and recent gear sections of the page are rendered from the fragment cache, so on nearly every
+    visit the page is served without querying the database. The sections are rendered again, with one bounded query
+    each, after an admin adds or changes a trail, a trail picture or a piece of gear, or once the cache's ttl runs out.
     """
 
-    saved_trails = db.session.query(Trails).all()
-    saved_gear = db.session.query(Gear).all()
+    recent_trails, recent_gear = get_dashboard_sections()
     # The create_database function only exists for development purposes.
-    if not saved_gear:
+    if recent_gear is None:
         create_database()
         return redirect(url_for("home_bp.home"))
     # End of development only code.
-    recent_trails = db.session.query(Trails).order_by(Trails.date_time_added.desc())[0:3]
-    recent_gear = db.session.query(Gear).order_by(Gear.date_time_added.desc())[0:3]
     return render_template(
         "dashboard.html",
-        all_trails=saved_trails,
-        all_gear=saved_gear,
-        recent_trails=recent_trails,
-        recent_gear=recent_gear,
+        dashboard_recent_trails=recent_trails,
+        dashboard_recent_gear=recent_gear,
         logged_in=current_user.is_authenticated,
         user=current_user,
         body_text=WELCOME_TEXT
@@ -68,3 +68,40 @@ def display_main_carousel_pics(file_name):
 def about():
     """Renders the about page."""
     return render_template("about.html")
+
+
+def get_dashboard_sections():
+    """
+    Returns the rendered html of the recent trails and recent gear sections of the home page.
+
+    Sections missing from the fragment cache are rendered and stored, each along with the tables it is built from. The
+    recent gear section is returned as None if there is no gear in the database.
+    """
+
+    cache = get_fragment_cache()
+    recent_trails = cache.get("dashboard_recent_trails")
+    if recent_trails is None:
+        generation = cache.generation
+        recent_trails = render_template("dashboard_recent_trails.html", recent_trails=load_recent_trails())
+        cache.set("dashboard_recent_trails", recent_trails, ("trails", "trail_pics"), generation)
+    recent_gear = cache.get("dashboard_recent_gear")
+    if recent_gear is None:
+        generation = cache.generation
+        gear = load_recent_gear()
+        if not gear:
+            return Markup(recent_trails), None
+        recent_gear = render_template("dashboard_recent_gear.html", recent_gear=gear)
+        cache.set("dashboard_recent_gear", recent_gear, ("gear",), generation)
+    return Markup(recent_trails), Markup(recent_gear)
+
+
+def load_recent_trails():
+    """Returns the id, name and first picture of the most recently added trails, in one query."""
+    return db.session.query(Trails.id, Trails.name, first_trail_pic()) \
+        .order_by(Trails.date_time_added.desc()).limit(RECENT_COUNT).all()
+
+
+def load_recent_gear():
+    """Returns the id, name and image of the most recently added gear, in one query."""
+    return db.session.query(Gear.id, Gear.name, Gear.img) \
+        .order_by(Gear.date_time_added.desc()).limit(RECENT_COUNT).all()
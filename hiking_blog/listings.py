@@ -0,0 +1,48 @@
+"""Sorts, filters and pages the gear and trail listing pages in the database, a page of cards at a time."""
+from flask import current_app, request
+from sqlalchemy import func
+
+LISTING_PAGE_SIZE = 20
+DESCRIPTION_PREVIEW = 100
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def paginate_listing(query, sorts, default_sort):
+    """
+    Sorts a listing query by the 'sort' query argument and returns the page given by the 'page' query argument.
+
+    Only the rows of the page are read from the database, along with a count of the rows matching the query, so the
+    cost of a listing page depends on the page size rather than on the size of the catalog. Every sort ends with the
+    entry's id, so an entry is never shown on two pages when other entries share its sort value.
+
+    PARAMETERS
+    ----------
+    query : Query
+        A query of the columns the listing shows, with its filters applied.
+    sorts : dict
+        Maps the name of each sort the listing offers to the columns it orders by.
+    default_sort : str
+        The sort used when the 'sort' query argument is missing or isn't one of 'sorts'.
+
+    Returns the Pagination of the page and the name of the sort used.
+    """
+
+    sort = request.args.get("sort", default_sort)
+    if sort not in sorts:
+        sort = default_sort
+    page = query.order_by(*sorts[sort]).paginate(
+        page=request.args.get("page", 1, type=int),
+        per_page=current_app.config.get("LISTING_PAGE_SIZE", LISTING_PAGE_SIZE),
+        error_out=False
+    )
+    return page, sort
+
+
+def description_preview(column):
+    """Returns the start of a description column, as much of it as a listing card shows, labelled 'description'."""
+    return func.substr(column, 1, DESCRIPTION_PREVIEW).label("description")
+
+
+def listing_arguments():
+    """Returns the query arguments of the listing page, other than its page number, for the links to other pages."""
+    return {name: value for name, value in request.args.items() if name != "page" and value != ""}
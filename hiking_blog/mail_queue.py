@@ -0,0 +1,58 @@
+"""Sends emails one after another from a single background thread, so callers never wait on, or spawn, a mail thread."""
+from threading import Thread
+import queue
+
+mail_queue = None
+
+
+class MailQueue:
+    """
+    A class used to queue emails and send them in order from one daemon thread.
+
+    Unlike contact.send_async_email, which starts a thread for every email, the queue's one thread sends every email,
+    so a burst of emails never opens a burst of connections to the mail server. An email that fails to send is
+    reported and dropped, and the emails after it are still sent.
+    """
+
+    def __init__(self):
+        self.emails = queue.Queue()
+        self.thread = Thread(target=self.send_forever, daemon=True)
+        self.thread.start()
+
+    def send(self, email, subject, message, target):
+        """
+        Queues an email to be sent by the queue's thread.
+
+        PARAMETERS
+        ----------
+        email : str or list
+            The address, or list of addresses, the email is sent to.
+        subject : str
+            The subject line of the email.
+        message : str
+            The body of the email.
+        target : function
+            The function that sends the email, such as contact.send_email.
+        """
+
+        self.emails.put((email, subject, message, target))
+
+    def send_forever(self):
+        """Sends the queued emails, one at a time, for as long as the process runs."""
+        while True:
+            email, subject, message, target = self.emails.get()
+            try:
+                target(email, subject, message)
+            except Exception as e:
+                print(f"failed to send mail '{subject}': {e}")
+            finally:
+                self.emails.task_done()
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def get_mail_queue():
+    """Returns the mail queue of this process, starting it the first time it is needed."""
+    global mail_queue
+    if mail_queue is None:
+        mail_queue = MailQueue()
+    return mail_queue
@@ -0,0 +1,287 @@
+"""Upgrades the schema and data of an existing database to match the models, one versioned migration at a time."""
+from hiking_blog.models import SchemaMigrations, RetailerOffer, PriceObservation, UploadManifest
+from hiking_blog.gear.retailer_offers import price_to_cents
+from hiking_blog.gear.price_scraper import RETAILERS, PRICE_MISSING
+from hiking_blog.trails.trail_locations import parse_coordinate, geo_band
+from hiking_blog.admin.upload_manifest import upload_path, DIR_START, UPLOAD_BUCKETS, SUBMITTED_BUCKET, \
+    UPLOAD_PENDING, UPLOAD_REVIEWED, UPLOAD_STORED
+from hiking_blog.db import db
+from sqlalchemy import inspect, select, text, update
+from datetime import datetime
+import os
+
+LEGACY_OFFER_COLUMNS = ("url", "price", "link_dead", "out_of_stock")
+LEASE_COLUMNS = (
+    ("next_check", "TIMESTAMP"),
+    ("check_interval", "INTEGER"),
+    ("check_failures", "INTEGER NOT NULL DEFAULT 0"),
+    ("lease_owner", "VARCHAR(100)"),
+    ("lease_expires", "TIMESTAMP")
+)
+CHECK_COLUMNS = (
+    ("check_status", "VARCHAR(20)"),
+    ("check_detail", "VARCHAR(250)")
+)
+CHECK_INDEXES = (
+    ("ix_retailer_offers_link_dead", "link_dead"),
+    ("ix_retailer_offers_check_status", "check_status")
+)
+THREAD_INDEXES = (
+    ("ix_trail_comments_thread", "trail_comments", "trail_id, date_time_added"),
+    ("ix_gear_comments_thread", "gear_comments", "gear_id, date_time_added")
+)
+COORDINATE_COLUMNS = (
+    ("latitude_value", "FLOAT"),
+    ("longitude_value", "FLOAT"),
+    ("geo_band", "INTEGER")
+)
+LISTING_INDEXES = (
+    ("ix_trails_date_time_added", "trails", "date_time_added"),
+    ("ix_trails_difficulty", "trails", "difficulty, hiking_dist"),
+    ("ix_trails_hiking_dist", "trails", "hiking_dist"),
+    ("ix_trails_elev_change", "trails", "elev_change"),
+    ("ix_trail_pics_trail_id", "trail_pics", "trail_id"),
+    ("ix_gear_date_time_added", "gear", "date_time_added"),
+    ("ix_gear_category", "gear", "category, date_time_added"),
+    ("ix_gear_rating", "gear", "rating")
+)
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def upgrade_db():
+    """
+    Applies every migration in MIGRATIONS that hasn't been applied to the database yet, in order.
+
+    db.create_all only creates the tables that are missing, so changes to tables that already exist, and moving data
+    between tables, are made by migrations. Each migration runs in its own transaction, which also records its version
+    in the schema_migrations table, so a migration that fails leaves the database as it was and is tried again the next
+    time the app starts. A new database has nothing to migrate, since create_all has already built its tables as the
+    models describe them, so every migration checks for the old schema and only records its version if it isn't found.
+    """
+
+    with db.engine.begin() as connection:
+        applied = set(connection.execute(select(SchemaMigrations.version)).scalars())
+    for version, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        with db.engine.begin() as connection:
+            migration(connection)
+            connection.execute(SchemaMigrations.__table__.insert().values(version=version, applied_at=datetime.now()))
+
+
+def migrate_retailer_offers(connection):
+    """
+    Moves the retailer columns of the gear table into the retailer_offers and price_observations tables.
+
+    Every retailer that had a price listed for a gear piece becomes an offer, with its price stored in cents, or with
+    no price and marked out of stock if it was 'Out of stock'. The first observation in each offer's price history is
+    its price at the time of the migration. Validators stored in the page_validators table are moved onto the offers of
+    the same url. The twelve retailer columns and the page_validators table are then dropped.
+
+    PARAMETERS
+    ----------
+    connection : Connection
+        The connection the migration's transaction is running on.
+    """
+
+    inspector = inspect(connection)
+    gear_columns = {column["name"] for column in inspector.get_columns("gear")}
+    legacy_columns = [f"{retailer}_{column}" for retailer in RETAILERS for column in LEGACY_OFFER_COLUMNS]
+    if not gear_columns.issuperset(legacy_columns):
+        return
+    stored_validators = {}
+    has_validators = inspector.has_table("page_validators")
+    if has_validators:
+        validator_rows = connection.execute(text("SELECT url, etag, last_modified FROM page_validators"))
+        stored_validators = {url: (etag, last_modified) for url, etag, last_modified in validator_rows}
+
+    migrated_at = datetime.now()
+    offers = []
+    observations = []
+    for row in connection.execute(text(f"SELECT id, {', '.join(legacy_columns)} FROM gear")).mappings():
+        for retailer in RETAILERS:
+            price = row[f"{retailer}_price"]
+            if not price:
+                continue
+            url = row[f"{retailer}_url"] or None
+            in_stock = not row[f"{retailer}_out_of_stock"]
+            price_cents = price_to_cents(price)
+            etag, last_modified = stored_validators.get(url, (None, None))
+            offers.append({
+                "gear_id": row["id"], "retailer": retailer, "url": url, "price_cents": price_cents,
+                "in_stock": in_stock, "link_dead": bool(row[f"{retailer}_link_dead"]), "last_checked": None,
+                "etag": etag, "last_modified": last_modified
+            })
+            observations.append({
+                "gear_id": row["id"], "retailer": retailer, "price_cents": price_cents, "in_stock": in_stock,
+                "observed_at": migrated_at
+            })
+    if offers:
+        connection.execute(RetailerOffer.__table__.insert(), offers)
+        connection.execute(PriceObservation.__table__.insert(), observations)
+    for column in legacy_columns:
+        connection.execute(text(f"ALTER TABLE gear DROP COLUMN {column}"))
+    if has_validators:
+        connection.execute(text("DROP TABLE page_validators"))
+
+
+def add_gear_view_count(connection):
+    """Adds the view_count column, counting the times each gear page has been viewed, to the gear table."""
+    if "view_count" not in {column["name"] for column in inspect(connection).get_columns("gear")}:
+        connection.execute(text("ALTER TABLE gear ADD COLUMN view_count INTEGER NOT NULL DEFAULT 0"))
+
+
+def add_offer_leases(connection):
+    """
+    Adds the columns the scrape workers schedule and lease retailer offers with to the retailer_offers table.
+
+    Every offer starts with no next check, which makes it due straight away, and with no lease.
+
+    PARAMETERS
+    ----------
+    connection : Connection
+        The connection the migration's transaction is running on.
+    """
+
+    inspector = inspect(connection)
+    offer_columns = {column["name"] for column in inspector.get_columns("retailer_offers")}
+    for column, definition in LEASE_COLUMNS:
+        if column not in offer_columns:
+            connection.execute(text(f"ALTER TABLE retailer_offers ADD COLUMN {column} {definition}"))
+    if "ix_retailer_offers_next_check" not in {index["name"] for index in inspector.get_indexes("retailer_offers")}:
+        connection.execute(text("CREATE INDEX ix_retailer_offers_next_check ON retailer_offers (next_check)"))
+
+
+def backfill_upload_manifest(connection):
+    """
+    Adds every photo directory already in the admin's static folders to the upload_manifest table.
+
+    This is the last time the folders are walked. Each directory is entered with the time it was created, pending if
+    it holds submitted photos and reviewed if it is an empty submitted directory, so the manifest expires and lists
+    them as the walks of the folders did.
+
+    PARAMETERS
+    ----------
+    connection : Connection
+        The connection the migration's transaction is running on.
+    """
+
+    recorded = set(connection.execute(select(UploadManifest.path)).scalars())
+    entries = []
+    for bucket in UPLOAD_BUCKETS:
+        bucket_directory = f"{DIR_START}{bucket}"
+        if not os.path.isdir(bucket_directory):
+            continue
+        for date in os.listdir(bucket_directory):
+            date_directory = os.path.join(bucket_directory, date)
+            if not os.path.isdir(date_directory):
+                continue
+            for user_trail in os.listdir(date_directory):
+                path = upload_path(bucket, date, user_trail)
+                directory = os.path.join(date_directory, user_trail)
+                if path in recorded or not os.path.isdir(directory):
+                    continue
+                status = UPLOAD_STORED
+                if bucket == SUBMITTED_BUCKET:
+                    status = UPLOAD_PENDING if os.listdir(directory) else UPLOAD_REVIEWED
+                entries.append({
+                    "path": path, "bucket": bucket, "upload_day": date,
+                    "created_at": datetime.fromtimestamp(os.path.getctime(date_directory)), "status": status
+                })
+    if entries:
+        connection.execute(UploadManifest.__table__.insert(), entries)
+
+
+def add_offer_check_status(connection):
+    """
+    Adds the columns recording the outcome of each retailer offer's last check, and indexes the flags the admins view.
+
+    Until now, a link was marked dead whenever no price could be read from its page. Dead links are now only the ones
+    the retailer answers with 404 or 410, so the offers marked dead are moved to the price-missing flag, which is what
+    was known about them, until their next check classifies them.
+
+    PARAMETERS
+    ----------
+    connection : Connection
+        The connection the migration's transaction is running on.
+    """
+
+    inspector = inspect(connection)
+    offer_columns = {column["name"] for column in inspector.get_columns("retailer_offers")}
+    if "check_status" in offer_columns:
+        return
+    for column, definition in CHECK_COLUMNS:
+        connection.execute(text(f"ALTER TABLE retailer_offers ADD COLUMN {column} {definition}"))
+    connection.execute(
+        update(RetailerOffer.__table__).where(RetailerOffer.__table__.c.link_dead.is_(True))
+        .values(link_dead=False, check_status=PRICE_MISSING)
+    )
+    for index, column in CHECK_INDEXES:
+        connection.execute(text(f"CREATE INDEX {index} ON retailer_offers ({column})"))
+
+
+def add_comment_thread_indexes(connection):
+    """Indexes the comments of each gear and trail page by the time they were added, which they are paged in."""
+    create_missing_indexes(connection, THREAD_INDEXES)
+
+
+def add_listing_indexes(connection):
+    """Indexes the columns the gear and trail listing pages are sorted and filtered by, and each trail's pictures."""
+    create_missing_indexes(connection, LISTING_INDEXES)
+
+
+def convert_trail_coordinates(connection):
+    """
+    Replaces the latitude and longitude text columns of the trails table with numeric ones, and indexes them.
+
+    Each trail's coordinates are read from their text, and a coordinate that can't be read is left empty, which keeps
+    the trail off the map until an admin corrects it. Each trail's geo_band, the band of latitude it is in, is filled
+    in, and the trails are indexed by (geo_band, longitude) for the location queries of trail_locations.
+
+    PARAMETERS
+    ----------
+    connection : Connection
+        The connection the migration's transaction is running on.
+    """
+
+    if "geo_band" in {column["name"] for column in inspect(connection).get_columns("trails")}:
+        return
+    rows = connection.execute(text("SELECT id, latitude, longitude FROM trails")).all()
+    for column, definition in COORDINATE_COLUMNS:
+        connection.execute(text(f"ALTER TABLE trails ADD COLUMN {column} {definition}"))
+    coordinates = []
+    for trail_id, latitude, longitude in rows:
+        latitude, longitude = parse_coordinate(latitude, 90), parse_coordinate(longitude, 180)
+        coordinates.append({
+            "trail_id": trail_id, "latitude": latitude, "longitude": longitude, "geo_band": geo_band(latitude)
+        })
+    if coordinates:
+        connection.execute(
+            text("UPDATE trails SET latitude_value = :latitude, longitude_value = :longitude, geo_band = :geo_band "
+                 "WHERE id = :trail_id"),
+            coordinates
+        )
+    for column in ("latitude", "longitude"):
+        connection.execute(text(f"ALTER TABLE trails DROP COLUMN {column}"))
+        connection.execute(text(f"ALTER TABLE trails RENAME COLUMN {column}_value TO {column}"))
+    connection.execute(text("CREATE INDEX ix_trails_geo ON trails (geo_band, longitude)"))
+
+
+def create_missing_indexes(connection, indexes):
+    """Creates each (name, table, columns) index that the database doesn't have yet."""
+    inspector = inspect(connection)
+    for index, table, columns in indexes:
+        if index not in {existing["name"] for existing in inspector.get_indexes(table)}:
+            connection.execute(text(f"CREATE INDEX {index} ON {table} ({columns})"))
+
+
+MIGRATIONS = [
+    ("0001_retailer_offers", migrate_retailer_offers),
+    ("0002_gear_view_count", add_gear_view_count),
+    ("0003_offer_leases", add_offer_leases),
+    ("0004_upload_manifest", backfill_upload_manifest),
+    ("0005_offer_check_status", add_offer_check_status),
+    ("0006_comment_thread_indexes", add_comment_thread_indexes),
+    ("0007_listing_indexes", add_listing_indexes),
+    ("0008_trail_coordinates", convert_trail_coordinates)
+]
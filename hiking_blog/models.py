@@ -105,14 +105,22 @@ class Trails(db.Model):
     name = db.Column(db.String(100), unique=True, nullable=False)
     description = db.Column(db.Text, nullable=False)
     gear_trail = db.Column(db.String, nullable=False)
-    latitude = db.Column(db.String(100), nullable=False)
-    longitude = db.Column(db.String(100), nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geo_band = db.Column(db.Integer)
     hiking_dist = db.Column(db.Float, nullable=False)
     elev_change = db.Column(db.Integer, nullable=False)
     difficulty = db.Column(db.String, nullable=False)
     date_time_added = db.Column(db.DateTime, nullable=False)
     trail_page_comments = relationship("TrailComments", back_populates="parent_posts")
     trail_page_pics = relationship("TrailPictures", back_populates="parent_trail_posts")
+    __table_args__ = (
+        db.Index("ix_trails_date_time_added", "date_time_added"),
+        db.Index("ix_trails_difficulty", "difficulty", "hiking_dist"),
+        db.Index("ix_trails_hiking_dist", "hiking_dist"),
+        db.Index("ix_trails_elev_change", "elev_change"),
+        db.Index("ix_trails_geo", "geo_band", "longitude")
+    )
 
 
 class TrailPictures(db.Model):
@@ -128,6 +136,9 @@ class TrailPictures(db.Model):
     trail_id = db.Column(db.Integer, db.ForeignKey("trails.id"))
     parent_trail_posts = relationship("Trails", back_populates="trail_page_pics")
     get_user_rating = relationship("RatedPhoto", back_populates="rated_pic")
+    __table_args__ = (
+        db.Index("ix_trail_pics_trail_id", "trail_id"),
+    )
 
 
 class TrailComments(UserMixin, db.Model):
@@ -141,6 +152,9 @@ class TrailComments(UserMixin, db.Model):
     commenter = relationship("User", back_populates="trail_page_comments")
     trail_id = db.Column(db.Integer, db.ForeignKey("trails.id"))
     parent_posts = relationship("Trails", back_populates="trail_page_comments")
+    __table_args__ = (
+        db.Index("ix_trail_comments_thread", "trail_id", "date_time_added"),
+    )
 
 
 class Gear(db.Model):
@@ -157,22 +171,82 @@ class Gear(db.Model):
     description = db.Column(db.Text, nullable=False)
     keywords = db.Column(db.String, nullable=False)
     gear_trail = db.Column(db.String, nullable=False)
-    # Make it's own table----------------------------------------------------
-    moosejaw_url = db.Column(db.String(250))
-    moosejaw_price = db.Column(db.String(50))
-    moosejaw_link_dead = db.Column(db.Boolean, nullable=False)
-    moosejaw_out_of_stock = db.Column(db.Boolean, nullable=False)
-    rei_url = db.Column(db.String(250))
-    rei_price = db.Column(db.String(50))
-    rei_link_dead = db.Column(db.Boolean, nullable=False)
-    rei_out_of_stock = db.Column(db.Boolean, nullable=False)
-    backcountry_url = db.Column(db.String(250))
-    backcountry_price = db.Column(db.String(50))
-    backcountry_link_dead = db.Column(db.Boolean, nullable=False)
-    backcountry_out_of_stock = db.Column(db.Boolean, nullable=False)
-    # End new table-----------------------------------------------------------
     date_time_added = db.Column(db.DateTime, nullable=False)
+    view_count = db.Column(db.Integer, nullable=False, default=0)
     gear_comments = relationship("GearComments", back_populates="parent_posts")
+    offers = relationship("RetailerOffer", back_populates="gear", cascade="all, delete-orphan")
+    __table_args__ = (
+        db.Index("ix_gear_date_time_added", "date_time_added"),
+        db.Index("ix_gear_category", "category", "date_time_added"),
+        db.Index("ix_gear_rating", "rating")
+    )
+
+
+class RetailerOffer(db.Model):
+    """A class used to represent the listing of a piece of gear by one retailer, with its current price."""
+    __tablename__ = "retailer_offers"
+    id = db.Column(db.Integer, primary_key=True)
+    gear_id = db.Column(db.Integer, db.ForeignKey("gear.id"), nullable=False)
+    gear = relationship("Gear", back_populates="offers")
+    retailer = db.Column(db.String(50), nullable=False)
+    url = db.Column(db.String(250))
+    price_cents = db.Column(db.Integer)
+    in_stock = db.Column(db.Boolean, nullable=False, default=True)
+    link_dead = db.Column(db.Boolean, nullable=False, default=False)
+    last_checked = db.Column(db.DateTime)
+    etag = db.Column(db.String(250))
+    last_modified = db.Column(db.String(50))
+    next_check = db.Column(db.DateTime)
+    check_interval = db.Column(db.Integer)
+    check_failures = db.Column(db.Integer, nullable=False, default=0)
+    lease_owner = db.Column(db.String(100))
+    lease_expires = db.Column(db.DateTime)
+    check_status = db.Column(db.String(20))
+    check_detail = db.Column(db.String(250))
+    __table_args__ = (
+        db.UniqueConstraint("gear_id", "retailer", name="uq_retailer_offers_gear_retailer"),
+        db.Index("ix_retailer_offers_price", "price_cents"),
+        db.Index("ix_retailer_offers_next_check", "next_check"),
+        db.Index("ix_retailer_offers_link_dead", "link_dead"),
+        db.Index("ix_retailer_offers_check_status", "check_status"),
+    )
+
+
+class PriceObservation(db.Model):
+    """A class used to represent a change to the price or stock of a piece of gear at one retailer."""
+    __tablename__ = "price_observations"
+    id = db.Column(db.Integer, primary_key=True)
+    gear_id = db.Column(db.Integer, db.ForeignKey("gear.id"), nullable=False)
+    gear = relationship("Gear")
+    retailer = db.Column(db.String(50), nullable=False)
+    price_cents = db.Column(db.Integer)
+    in_stock = db.Column(db.Boolean, nullable=False)
+    observed_at = db.Column(db.DateTime, nullable=False)
+    __table_args__ = (
+        db.Index("ix_price_observations_offer", "gear_id", "retailer", "observed_at"),
+    )
+
+
+class UploadManifest(db.Model):
+    """A class used to represent a directory of user-submitted photos in one of the admin's static folders."""
+    __tablename__ = "upload_manifest"
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(500), nullable=False, unique=True)
+    bucket = db.Column(db.String(50), nullable=False)
+    upload_day = db.Column(db.String(10), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    __table_args__ = (
+        db.Index("ix_upload_manifest_created_at", "created_at"),
+        db.Index("ix_upload_manifest_status", "status", "bucket"),
+    )
+
+
+class SchemaMigrations(db.Model):
+    """A class used to represent a schema upgrade that has been applied to the database."""
+    __tablename__ = "schema_migrations"
+    version = db.Column(db.String(100), primary_key=True)
+    applied_at = db.Column(db.DateTime, nullable=False)
 
 
 class GearComments(UserMixin, db.Model):
@@ -186,3 +260,21 @@ class GearComments(UserMixin, db.Model):
     commenter = relationship("User", back_populates="gear_page_comments")
     gear_id = db.Column(db.Integer, db.ForeignKey("gear.id"))
     parent_posts = relationship("Gear", back_populates="gear_comments")
+    __table_args__ = (
+        db.Index("ix_gear_comments_thread", "gear_id", "date_time_added"),
+    )
+
+
+class SearchPostings(db.Model):
+    """A class used to represent the occurrences of one search term in one field of a gear or trail page."""
+    __tablename__ = "search_postings"
+    id = db.Column(db.Integer, primary_key=True)
+    term = db.Column(db.String(100), nullable=False, index=True)
+    gear_trail = db.Column(db.String, nullable=False)
+    doc_id = db.Column(db.Integer, nullable=False)
+    field = db.Column(db.String(20), nullable=False)
+    comment_id = db.Column(db.Integer)
+    term_frequency = db.Column(db.Integer, nullable=False)
+    __table_args__ = (
+        db.Index("ix_search_postings_document", "gear_trail", "comment_id", "doc_id"),
+    )
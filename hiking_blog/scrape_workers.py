@@ -0,0 +1,317 @@
+"""
+Checks gear prices with a pool of worker processes that lease retailer offers from the database.
+
+This is the scaled-out alternative to data_scraper.app_updates, which checks every price from a single loop in a single
+process. Here, each retailer offer's schedule, its next check, interval and failures in a row, is kept in the
+retailer_offers table, and any number of ScrapeWorkers, in any number of processes on any number of hosts, claim the
+offers that are due by leasing them: a claim sets the offer's lease_owner and lease_expires columns, and an offer can
+only be claimed when it has no lease or its lease has expired. A worker that crashes mid-batch therefore loses its
+offers only until their leases expire, after which any other worker checks them again.
+
+Start a pool of workers on a host from the root of the repository, instead of running data_scraper:
+
+    python -m hiking_blog.scrape_workers --workers 4
+
+The process that starts the pool restarts any worker that dies and deletes old photo files, as app_updates does.
+Each worker is given an equal share of SCRAPER_RETAILER_BUDGET requests per minute to each retailer, so when pools run
+on several hosts, SCRAPER_RETAILER_BUDGET should be the budget of one host.
+"""
+from hiking_blog.data_scraper import create_updater_app, init_updater, check_prices, load_popularity, clean_up_files, \
+    SCHEDULE_SYNC_INTERVAL, CLEANUP_INTERVAL
+from hiking_blog.gear.price_scraper import RETAILERS
+from hiking_blog.gear.scrape_scheduler import RateBudget, adapt_interval, failure_retry, popular_wait, \
+    RETAILER_BUDGET, MIN_INTERVAL, MAX_INTERVAL, DEFAULT_INTERVAL, CHECK_FAILED
+from hiking_blog import db
+from sqlalchemy import select, update, bindparam, and_, or_, func
+from datetime import datetime, timedelta
+import multiprocessing
+import argparse
+import socket
+import time
+import os
+
+CLAIM_BATCH_SIZE = 50
+LEASE_DURATION = 300
+POLL_INTERVAL = 5
+SUPERVISE_INTERVAL = 5
+
+
+class ScrapeWorker:
+    """
+    A class used to check the prices of the retailer offers that are due, claiming them from the database with leases.
+
+    Each round, the worker claims up to 'batch_size' due offers from every retailer whose budget allows it, checks
+    them all at once with data_scraper.check_prices, and then writes each offer's next check and releases its lease.
+    The next check adapts to what the check found, in the same way as in the ScrapeScheduler of the single-process
+    updater: intervals shrink for prices that change and grow for prices that don't, and are shortened for the gear
+    that is viewed and favorited the most.
+
+    Offers are claimed with a single UPDATE of the rows picked by a subquery, which sets the lease and returns the ids
+    that were claimed. On Postgres, the subquery locks the rows it picks with FOR UPDATE SKIP LOCKED, so workers
+    claiming at the same time pass over each other's rows rather than waiting on them. SQLite runs one write at a time,
+    which makes the UPDATE an atomic claim on its own. Either way, the lease condition is checked again by the UPDATE,
+    so an offer is never leased to two workers.
+
+    PARAMETERS
+    ----------
+    worker_id : str
+        The name the worker leases offers under, unique across every host.
+    price_readers : dict
+        Maps each retailer's name to the function that reads the price from the html of one of its pages.
+    retailer_budget : int
+        The number of requests this worker may send per minute to each retailer.
+    batch_size : int
+        The most offers claimed from one retailer at a time.
+    lease_duration : float
+        The number of seconds an offer is leased for, which must be longer than it takes to check a batch.
+    min_interval : float
+        The shortest time in seconds between two checks of an offer.
+    max_interval : float
+        The longest time in seconds between two checks of an offer.
+    default_interval : float
+        The interval an offer starts with.
+    """
+
+    def __init__(self, worker_id, price_readers, retailer_budget=RETAILER_BUDGET, batch_size=CLAIM_BATCH_SIZE,
+                 lease_duration=LEASE_DURATION, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 default_interval=DEFAULT_INTERVAL):
+        self.worker_id = worker_id
+        self.price_readers = price_readers
+        self.batch_size = batch_size
+        self.lease_duration = lease_duration
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+        now = time.time()
+        self.budgets = {retailer: RateBudget(retailer_budget, now) for retailer in RETAILERS}
+        self.popularity = {}
+
+    def run(self):
+        """Checks due offers until the process is stopped, sleeping for up to POLL_INTERVAL seconds when idle."""
+        from hiking_blog.contact import send_dead_link_digest
+
+        next_sync = 0
+        while True:
+            if time.time() >= next_sync:
+                self.popularity = load_popularity()
+                next_sync = time.time() + SCHEDULE_SYNC_INTERVAL
+            sweep = self.work_once()
+            if sweep is None:
+                time.sleep(self.idle_wait())
+                continue
+            print(f"{self.worker_id} checked {sweep.checked} offers: {sweep.changed} changed, "
+                  f"{sweep.observations} new prices, {sweep.failed} unreachable")
+            if sweep.flagged:
+                send_dead_link_digest(sweep.flagged)
+
+    def work_once(self):
+        """Claims, checks and schedules one batch of due offers, returning the PriceSweep, or None if none were due."""
+        from hiking_blog.models import RetailerOffer
+
+        offer_ids = []
+        for retailer, budget in self.budgets.items():
+            limit = min(self.batch_size, budget.available(time.time()))
+            if limit < 1:
+                continue
+            claimed = self.claim(retailer, limit, datetime.now())
+            for _ in claimed:
+                budget.take(time.time())
+            offer_ids.extend(claimed)
+        if not offer_ids:
+            return None
+
+        offers = RetailerOffer.query.filter(RetailerOffer.id.in_(offer_ids)).all()
+        schedules = {
+            offer.id: (offer.check_interval or self.default_interval, offer.check_failures) for offer in offers
+        }
+        sweep = check_prices(offers, self.price_readers)
+        self.finish(schedules, sweep.outcomes, datetime.now())
+        return sweep
+
+    def claim(self, retailer, limit, now):
+        """
+        Leases up to 'limit' of a retailer's offers that are due and not leased to another worker, most overdue first.
+
+        PARAMETERS
+        ----------
+        retailer : str
+            The name of the retailer.
+        limit : int
+            The most offers to claim.
+        now : datetime
+            The current time.
+
+        Returns the ids of the offers claimed.
+        """
+
+        from hiking_blog.models import RetailerOffer
+
+        session = db.db.session
+        claimable = and_(
+            RetailerOffer.retailer == retailer,
+            RetailerOffer.url.isnot(None),
+            RetailerOffer.url != "",
+            or_(RetailerOffer.next_check.is_(None), RetailerOffer.next_check <= now),
+            or_(RetailerOffer.lease_expires.is_(None), RetailerOffer.lease_expires < now)
+        )
+        candidates = select(RetailerOffer.id).where(claimable) \
+            .order_by(RetailerOffer.next_check.asc().nulls_first()).limit(limit).with_for_update(skip_locked=True)
+        claimed = session.execute(
+            update(RetailerOffer).where(RetailerOffer.id.in_(candidates.scalar_subquery()), claimable)
+            .values(lease_owner=self.worker_id, lease_expires=now + timedelta(seconds=self.lease_duration))
+            .returning(RetailerOffer.id).execution_options(synchronize_session=False)
+        ).scalars().all()
+        session.commit()
+        return claimed
+
+    def finish(self, schedules, outcomes, now):
+        """
+        Writes the next check of every offer in a batch and releases the worker's leases.
+
+        Only offers still leased to this worker are written, so a batch that ran past its leases doesn't overwrite the
+        schedule of offers another worker has claimed since. An offer in the batch that wasn't checked, such as one
+        whose link was removed after it was claimed, is retried later as a failed check would be, so it isn't claimed
+        again at the front of every batch.
+
+        PARAMETERS
+        ----------
+        schedules : dict
+            Maps the id of every offer in the batch to its (interval, failures in a row) before it was checked.
+        outcomes : list
+            An (offer id, gear id, outcome) tuple for every offer that was checked.
+        now : datetime
+            The time the batch was checked.
+        """
+
+        from hiking_blog.models import RetailerOffer
+
+        rows = []
+        checked = set()
+        for offer_id, gear_id, outcome in outcomes:
+            checked.add(offer_id)
+            interval, failures = schedules[offer_id]
+            if outcome == CHECK_FAILED:
+                wait = failure_retry(interval, failures)
+                failures += 1
+            else:
+                interval = adapt_interval(interval, outcome, self.min_interval, self.max_interval)
+                wait = popular_wait(interval, self.popularity.get(gear_id, 1), self.min_interval)
+                failures = 0
+            rows.append({
+                "offer_id": offer_id,
+                "next_check": now + timedelta(seconds=wait),
+                "check_interval": round(interval),
+                "check_failures": failures
+            })
+        for offer_id, (interval, failures) in schedules.items():
+            if offer_id not in checked:
+                rows.append({
+                    "offer_id": offer_id,
+                    "next_check": now + timedelta(seconds=failure_retry(interval, failures)),
+                    "check_interval": round(interval),
+                    "check_failures": failures + 1
+                })
+
+        session = db.db.session
+        offers = RetailerOffer.__table__
+        if rows:
+            session.execute(
+                update(offers).where(offers.c.id == bindparam("offer_id"), offers.c.lease_owner == self.worker_id)
+                .values(next_check=bindparam("next_check"), check_interval=bindparam("check_interval"),
+                        check_failures=bindparam("check_failures"), lease_owner=None, lease_expires=None),
+                rows
+            )
+        session.execute(
+            update(offers).where(offers.c.lease_owner == self.worker_id).values(lease_owner=None, lease_expires=None)
+        )
+        session.commit()
+
+    def idle_wait(self):
+        """Returns the time to sleep when no offers were due, up to when the next one is or POLL_INTERVAL seconds."""
+        from hiking_blog.models import RetailerOffer
+
+        next_check = db.db.session.query(func.min(RetailerOffer.next_check)).filter(
+            RetailerOffer.url.isnot(None),
+            RetailerOffer.url != "",
+            RetailerOffer.lease_owner.is_(None)
+        ).scalar()
+        db.db.session.commit()
+        if next_check is None:
+            return POLL_INTERVAL
+        return min(POLL_INTERVAL, max(1.0, (next_check - datetime.now()).total_seconds()))
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def run_worker(worker_count):
+    """
+    Sets up an app context in a new process and runs a ScrapeWorker in it until the process is stopped.
+
+    PARAMETERS
+    ----------
+    worker_count : int
+        The number of workers in the pool, which share this host's budget of requests to each retailer.
+    """
+
+    app = create_updater_app()
+    with app.app_context():
+        init_updater(app)
+
+        from hiking_blog.gear.gear_prices import PRICE_READERS
+
+        config = app.config
+        worker = ScrapeWorker(
+            f"{socket.gethostname()}-{os.getpid()}",
+            PRICE_READERS,
+            retailer_budget=max(1, config.get("SCRAPER_RETAILER_BUDGET", RETAILER_BUDGET) // worker_count),
+            batch_size=config.get("SCRAPER_CLAIM_BATCH_SIZE", CLAIM_BATCH_SIZE),
+            lease_duration=config.get("SCRAPER_LEASE_DURATION", LEASE_DURATION),
+            min_interval=config.get("SCRAPER_MIN_INTERVAL", MIN_INTERVAL),
+            max_interval=config.get("SCRAPER_MAX_INTERVAL", MAX_INTERVAL),
+            default_interval=config.get("SCRAPER_DEFAULT_INTERVAL", DEFAULT_INTERVAL)
+        )
+        worker.run()
+
+
+def run_pool(worker_count):
+    """
+    Starts 'worker_count' worker processes and keeps them running, deleting old photo files every hour meanwhile.
+
+    Workers are started with the spawn method, so none of them shares a database connection or retailer session with
+    the process that started it. A worker that dies is started again, and every worker is stopped when the pool is.
+    """
+
+    context = multiprocessing.get_context("spawn")
+    app = create_updater_app()
+    workers = []
+    next_cleanup = 0
+    try:
+        while True:
+            workers = [worker for worker in workers if worker.is_alive()]
+            while len(workers) < worker_count:
+                worker = context.Process(target=run_worker, args=(worker_count,), daemon=True)
+                worker.start()
+                workers.append(worker)
+            if time.time() >= next_cleanup:
+                with app.app_context():
+                    if db.db is None:
+                        db.init_db(app)
+                    clean_up_files()
+                next_cleanup = time.time() + CLEANUP_INTERVAL
+            time.sleep(SUPERVISE_INTERVAL)
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+
+
+def main():
+    """Parses the command line and runs a pool of scrape workers."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    args = parser.parse_args()
+    run_pool(max(1, args.workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Suggests gear names, trail names and gear keywords for the text typed so far into a search field."""
+from flask import current_app
+from sqlalchemy import event
+from hiking_blog.models import Gear, Trails
+from hiking_blog.db import db
+from bisect import bisect_left
+import threading
+import time
+
+NAMES_CHANGED = "autocomplete_names_changed"
+MAX_SUGGESTIONS = 8
+
+autocomplete_index = None
+
+
+class AutocompleteIndex:
+    """
+    A class used to look up the gear names, trail names and gear keywords starting with a prefix.
+
+    Every name is stored in a sorted list under each of the words it contains, along with the rest of the name from
+    that word onward, so that 'agn' finds 'Big Agnes Copper Spur' as well as 'big' does. Keywords are stored in a
+    second sorted list. A lookup is a binary search for the prefix followed by a walk over the matching keys, which
+    stops as soon as enough suggestions have been found, so it never touches the database and takes a few microseconds.
+
+    The lists are built from the database when the index is first used, and rebuilt on the next lookup after a change
+    to a gear or trail entry is committed, or once 'refresh_interval' seconds have passed, so that changes made by
+    another process are picked up. A rebuild replaces the lists in a single assignment, so lookups running at the same
+    time never see a half-built index.
+    """
+
+    def __init__(self, refresh_interval):
+        self.refresh_interval = refresh_interval
+        self.lists = None
+        self.built_at = 0
+        self.stale = True
+        self.lock = threading.Lock()
+
+    def suggest(self, prefix, limit=MAX_SUGGESTIONS):
+        """
+        Returns up to 'limit' suggestions for a prefix, names first and then keywords, each in alphabetical order.
+
+        PARAMETERS
+        ----------
+        prefix : str
+            The text typed so far into a search field.
+        limit : int
+            The largest number of suggestions to return.
+        """
+
+        prefix = " ".join(prefix.lower().split())
+        if not prefix:
+            return []
+        name_keys, name_values, keyword_keys = self.get_lists()
+        suggestions = []
+        seen = set()
+        position = bisect_left(name_keys, prefix)
+        while position < len(name_keys) and len(suggestions) < limit and name_keys[position].startswith(prefix):
+            gear_trail, db_id, name = name_values[position]
+            if (gear_trail, db_id) not in seen:
+                seen.add((gear_trail, db_id))
+                suggestions.append({"text": name, "gear/trail": gear_trail, "id": db_id})
+            position += 1
+        position = bisect_left(keyword_keys, prefix)
+        while position < len(keyword_keys) and len(suggestions) < limit and keyword_keys[position].startswith(prefix):
+            suggestions.append({"text": keyword_keys[position], "gear/trail": "Keyword", "id": None})
+            position += 1
+        return suggestions
+
+    def get_lists(self):
+        """Returns the sorted lists of the index, rebuilding them first if they are out of date."""
+        lists = self.lists
+        if lists is None or self.stale or time.monotonic() - self.built_at > self.refresh_interval:
+            with self.lock:
+                if self.lists is None or self.stale or time.monotonic() - self.built_at > self.refresh_interval:
+                    self.stale = False
+                    self.lists = build_lists()
+                    self.built_at = time.monotonic()
+                lists = self.lists
+        return lists
+
+    def mark_stale(self):
+        """Has the lists rebuilt on the next lookup."""
+        self.stale = True
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def create_autocomplete_index(app):
+    """Creates the autocomplete index and has it marked out of date every time a gear or trail change is committed."""
+    global autocomplete_index
+    autocomplete_index = AutocompleteIndex(app.config.get("AUTOCOMPLETE_REFRESH_INTERVAL", 300))
+    if not event.contains(db.session, "after_commit", mark_stale_after_commit):
+        event.listen(db.session, "after_commit", mark_stale_after_commit)
+        event.listen(db.session, "after_rollback", clear_names_changed)
+    return autocomplete_index
+
+
+def get_autocomplete_index():
+    """Returns the autocomplete index, creating it if the app was started without one."""
+    if autocomplete_index is None:
+        create_autocomplete_index(current_app)
+    return autocomplete_index
+
+
+def mark_names_changed():
+    """Marks the current session as having changed a gear or trail entry, which outdates the index on commit."""
+    db.session.info[NAMES_CHANGED] = True
+
+
+def mark_stale_after_commit(session):
+    """Marks the autocomplete index out of date after a session that changed a gear or trail entry is committed."""
+    if session.info.pop(NAMES_CHANGED, False) and autocomplete_index is not None:
+        autocomplete_index.mark_stale()
+
+
+def clear_names_changed(session):
+    """Clears the mark left by the indexing functions on a session that has been rolled back."""
+    session.info.pop(NAMES_CHANGED, None)
+
+
+def build_lists():
+    """
+    Loads every gear name, trail name and gear keyword and builds the sorted lists searched by the autocomplete index.
+
+    Returns a list of name keys, a list of the (gear/trail, id, name) each name key belongs to, in the same order, and
+    a list of distinct keywords.
+    """
+
+    names = []
+    keywords = set()
+    for db_id, name, gear_keywords in Gear.query.with_entities(Gear.id, Gear.name, Gear.keywords):
+        names.extend(name_keys("Gear", db_id, name))
+        keywords.update(word.strip(",;.").lower() for word in (gear_keywords or "").split())
+    for db_id, name in Trails.query.with_entities(Trails.id, Trails.name):
+        names.extend(name_keys("Trail", db_id, name))
+    names.sort()
+    keywords.discard("")
+    return [key for key, value in names], [value for key, value in names], sorted(keywords)
+
+
+def name_keys(gear_trail, db_id, name):
+    """Returns a (key, (gear/trail, id, name)) pair for every word of a name, keyed by the name from that word on."""
+    words = name.lower().split()
+    return [(" ".join(words[start:]), (gear_trail, db_id, name)) for start in range(len(words))]
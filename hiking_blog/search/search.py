@@ -1,12 +1,24 @@
 """This file handles site-wide search functionality."""
-from flask import Blueprint, render_template, current_app
+from flask import Blueprint, render_template, current_app, request, jsonify, url_for
 from hiking_blog.forms import SearchForm
 from hiking_blog.models import Gear, GearComments, Trails, TrailComments
-from hiking_blog.admin.admin import NO_TAGS, NO_CHARS
-from collections import Counter
+from hiking_blog.search.search_backends import get_search_backend
+from hiking_blog.search.search_cache import get_search_cache
+from hiking_blog.search.search_trace import start_search_trace, trace_stage, trace_detail, finish_search_trace
+from hiking_blog.search.search_vocabulary import get_search_vocabulary, MIN_PREFIX_LENGTH
+from hiking_blog.search.autocomplete import get_autocomplete_index
+from hiking_blog.search.search_index import clean_words, NO_CHARS
+from collections import defaultdict
+import math
 import operator
 import re
 
+RESULTS_PER_PAGE = 20
+MAX_RESULTS_PER_PAGE = 100
+PHRASE = re.compile('"([^"]*)"')
+FIELD_WEIGHTS = {"names": 10, "keywords": 7, "content": 3, "comments": 1}
+FIELD_COLUMNS = {"names": "name", "keywords": "keywords", "content": "description"}
+
 search_bp = Blueprint(
     "search_bp", __name__,
     template_folder="templates",
@@ -22,44 +34,82 @@ def send_form_to_navbar():
 
 
 # ----------------------------------------PARENT SEARCH FUNCTIONS----------------------------------------
-@search_bp.route("/tamarack-treks/search/search", methods=["POST"])
+@search_bp.route("/tamarack-treks/search/search", methods=["GET", "POST"])
 def search():
     """
-    Takes in the user-input to be searched and returns a list of all pages on the site containing relevant information.
+    Takes in the user-input to be searched and returns a page of the pages on the site containing relevant information.
 
     When the user submits the search form, this function runs the input through several other functions to clean the
-    input of any non-letter characters and create a sorted list of pages related to the user's input.
+    input of any non-letter characters and find the sorted list of pages related to the user's input, which is reused
+    from the search cache when the same terms were searched recently and nothing searchable has changed since. Only one
+    page of the sorted list, chosen by the 'page' and 'per_page' query arguments, is loaded from the database and
+    rendered. The pagination links on the results page send the searched string back to this function as a query
+    argument. A sample of searches, chosen by the SEARCH_TRACE_SAMPLE_RATE config variable, have the time taken by
+    each stage traced.
     """
     form = SearchForm()
     if form.validate_on_submit():
         searched = form.searched.data
-        print(searched)
-        clean_search = create_search_list(searched)
-        print(f"SEARCH: {clean_search}")
-        results = run_search_functions(clean_search)
-        sorted_results = sorted(results, reverse=True, key=operator.itemgetter("relevance_points"))
-        final_results = get_final_results(sorted_results)
-        print(f"final results: {final_results}")
+    else:
+        searched = request.args.get("searched", "")
+    if not searched:
         return render_template(
             "search.html",
             form=form,
-            searched=searched,
-            final_results=final_results,
+            searched="",
+            final_results=None
         )
+    page = request.args.get("page", 1, type=int)
+    per_page = request.args.get("per_page", RESULTS_PER_PAGE, type=int)
+    start_search_trace(searched)
+    clean_search = create_search_list(searched)
+    sorted_results = get_search_results(clean_search)
+    page, per_page, pages = get_page_bounds(len(sorted_results), page, per_page)
+    final_results = get_final_results(sorted_results[(page - 1) * per_page:page * per_page])
+    trace_stage("hydration", final_results)
+    trace_detail("results", len(sorted_results))
+    finish_search_trace()
     return render_template(
         "search.html",
         form=form,
-        searched="",
-        final_results=None
+        searched=searched,
+        final_results=final_results,
+        page=page,
+        per_page=per_page,
+        pages=pages,
+        total_results=len(sorted_results)
     )
 
 
+@search_bp.route("/tamarack-treks/search/autocomplete")
+def search_suggestions():
+    """
+    Returns json suggestions for the text typed so far into a search field, given as the 'prefix' query argument.
+
+    Suggestions come from the in-memory autocomplete index, so this can be called on every keystroke without querying
+    the database. Gear and trail names link straight to their pages, keywords link to a search for that keyword.
+    """
+
+    suggestions = get_autocomplete_index().suggest(request.args.get("prefix", ""))
+    for suggestion in suggestions:
+        if suggestion["gear/trail"] == "Gear":
+            suggestion["url"] = url_for("gear_bp.view_gear", db_id=suggestion["id"])
+        elif suggestion["gear/trail"] == "Trail":
+            suggestion["url"] = url_for("trail_bp.view_trail", db_id=suggestion["id"])
+        else:
+            suggestion["url"] = url_for("search_bp.search", searched=suggestion["text"])
+    return jsonify(suggestions=suggestions)
+
+
 def create_search_list(searched):
     """
-    Cleans every string in a list of strings, removing all non-letter characters.
+    Cleans a user-input string into a list of search terms, removing all non-letter characters.
 
-    Takes in a user-input string of characters from the search function and removes all non-letter characters before
-    appending the string to a new list consisting only of cleaned strings.
+    Text inside double quotes is kept together as a phrase, stored as its cleaned words joined by spaces, which only
+    matches pages containing those words next to each other. A word ending in '*' is kept as a prefix term, stored as
+    the cleaned word followed by '*', which matches every indexed word starting with it. Every other word has its
+    non-letter characters removed. A word made of letters separated by punctuation, such as 'trekking-pole', is also
+    searched for as a phrase of its parts, since a page may have written them as separate words.
 
     PARAMETERS
     ----------
@@ -67,318 +117,511 @@ def create_search_list(searched):
         A user-input string of characters.
     """
 
-    search_list = searched.split()
     clean_search = []
-    for word in search_list:
+    for phrase in PHRASE.findall(searched):
+        phrase_words = clean_words(phrase)
+        if phrase_words:
+            clean_search.append(" ".join(phrase_words))
+    for word in PHRASE.sub(" ", searched).split():
         clean_word = re.sub(NO_CHARS, '', word).lower()
-        if clean_word != "":
-            clean_search.append(clean_word)
+        if clean_word == "":
+            continue
+        if word.endswith("*") and len(clean_word) >= MIN_PREFIX_LENGTH:
+            clean_search.append(f"{clean_word}*")
+            continue
+        clean_search.append(clean_word)
+        parts = clean_words(re.sub(NO_CHARS, ' ', word))
+        if len(parts) > 1:
+            clean_search.append(" ".join(parts))
     return clean_search
 
 
+def expand_search_list(search_list):
+    """
+    Turns a list of search terms into the indexed words to look up, each with a weight, and a list of phrases.
+
+    Plain words are looked up as they are. Prefix terms are expanded into the most common indexed words starting with
+    them. A plain word missing from the search vocabulary is likely misspelled, so it is also expanded into the indexed
+    words closest to it by edit distance, weighted down by how far they are from it. Each word's weight is summed over
+    the terms it came from, so a word searched for twice still counts twice.
+
+    PARAMETERS
+    ----------
+    search_list : list
+        A list of cleaned search terms made by create_search_list.
+    """
+
+    vocabulary = get_search_vocabulary()
+    term_weights = defaultdict(int)
+    phrases = []
+    for search_item in search_list:
+        if " " in search_item:
+            phrases.append(search_item.split())
+        elif search_item.endswith("*"):
+            for term in vocabulary.complete(search_item[:-1]):
+                term_weights[term] += 1
+        else:
+            term_weights[search_item] += 1
+            if search_item not in vocabulary:
+                for term, distance in vocabulary.correct(search_item):
+                    term_weights[term] += 1 / (distance + 1)
+    return term_weights, phrases
+
+
+def get_search_results(search_list):
+    """
+    Returns the ranked (gear/trail, id, relevance points) results for a list of search terms from create_search_list.
+
+    Results are looked up in the search cache by the sorted search terms, since the order the terms were typed in
+    doesn't change the ranking. On a miss the results are ranked and stored in the cache, unless the search index was
+    changed while they were being ranked.
+
+    PARAMETERS
+    ----------
+    search_list : list
+        A list of cleaned user-input strings.
+    """
+
+    cache = get_search_cache()
+    key = tuple(sorted(search_list))
+    results = cache.get(key)
+    trace_detail("cache_hit", results is not None)
+    if results is None:
+        generation = cache.generation
+        results = tuple(
+            (listing["gear/trail"], listing["id"], listing["relevance_points"])
+            for listing in rank_search_results(search_list)
+        )
+        cache.set(key, results, generation)
+    return results
+
+
+def rank_search_results(search_list):
+    """Runs all of the search functions for a list of user input strings and sorts the results from high to low."""
+    results = run_search_functions(search_list)
+    return sorted(results.values(), reverse=True, key=operator.itemgetter("relevance_points"))
+
+
 def run_search_functions(search_list):
     """
     Runs all of the specific search functions for a list of user input strings.
 
-    Creates an empty list which will eventually store all of the information for pages that have data matching one or
-    more of the user-input search terms. This function then calls several search functions, attempting to match specific
-    strings from a list of strings input by the user to words or phrases associated with specific pages of the app.
+    Creates an empty dictionary which will eventually store all of the information for pages that have data matching
+    one or more of the user-input search terms, keyed by the (gear/trail, id) of each page. Prefix and misspelled terms
+    are first expanded into the indexed words they match. If the search backend leaves scoring to this module, this
+    function loads the postings for every word from the search index in a single query and calls several search
+    functions, each of which scores the postings for one kind of text (names, keywords, descriptions or comments)
+    associated with specific pages of the app, followed by one that scores quoted phrases. Full-text search backends
+    rank the matching pages themselves.
 
     PARAMETERS
     ----------
     search_list : list
-        A list of user-input strings.
+        A list of search terms made by create_search_list.
     """
 
-    results = []
-    results = check_gear_and_trail_review_names(search_list, results)
-    results = check_gear_review_keywords(search_list, results)
-    results = check_gear_and_trail_review_content(search_list, results)
-    results = check_gear_and_trail_review_comments(search_list, results)
-    results = check_exact_name_in_search(search_list, results)
+    results = {}
+    term_weights, phrases = expand_search_list(search_list)
+    searched_words = set(term_weights).union(*phrases)
+    trace_stage("expansion", searched_words)
+    backend = get_search_backend()
+    if backend.scores_in_python:
+        postings = backend.get_postings(searched_words)
+        trace_stage("postings")
+        results = check_gear_and_trail_review_names(term_weights, postings["names"], results)
+        results = check_gear_review_keywords(term_weights, postings["keywords"], results)
+        results = check_gear_and_trail_review_content(term_weights, postings["content"], results)
+        results = check_gear_and_trail_review_comments(term_weights, postings["comments"], results)
+        results = check_phrases(phrases, postings, results)
+        name_hits = {(hit.gear_trail, hit.doc_id) for hits in postings["names"].values() for hit in hits}
+    else:
+        results = check_full_text_search(term_weights, phrases, backend, results)
+        name_hits = set(results)
+    results = check_exact_name_in_search(searched_words, results, name_hits)
     return results
 
 
 # ----------------------------------------SEARCH FUNCTIONS----------------------------------------
-def check_gear_and_trail_review_names(searched, results):
+def check_gear_and_trail_review_names(searched, postings, results):
     """
-    Looks for trail and gear-piece names in the database that match the user-input search terms.
+    Looks for trail and gear-piece names in the search index that match the user-input search terms.
 
-    Iterates through every string in the list of user-input strings to be searched, queries the database to see if any
-    trail or gear-piece names match the string, and calls a separate function to update the list of results if there
-    are any matches.
+    Iterates through every word to be searched, looks up the name postings stored in the index for that word, and calls
+    a separate function to update the results if there are any matches.
 
     PARAMETERS
-    searched : list
-        A list of all individual words, in string form, input by the user into the search form.
-    results : list
-        A list of dictionaries. Each contained dictionary stores relevant info for pages with data matching searched
-        strings.
+    ----------
+    searched : dict
+        Maps every word to be searched, including the ones expanded from prefix and misspelled terms, to its weight.
+    postings : dict
+        Maps each searched string to the postings stored for it in the 'names' field of the search index.
+    results : dict
+        A dictionary of dictionaries keyed by the (gear/trail, id) of each page. Each contained dictionary stores
+        relevant info for pages with data matching searched strings.
     """
 
-    to_check = "names"
     if searched:
-        for search_item in searched:
-            hits = (Gear.query.filter(Gear.name.like(f"%{search_item}%")).all()) + \
-                   (Trails.query.filter(Trails.name.like(f"%{search_item}%")).all())
+        for search_item, weight in searched.items():
+            hits = postings[search_item]
             if hits:
-                results = add_or_adjust_entries_against_search_term_relevance(hits, results, to_check, search_item, 10)
-    print_results("Names", results)
+                results = add_or_adjust_entries_against_search_term_relevance(
+                    hits, results, FIELD_WEIGHTS["names"] * weight
+                )
+    trace_stage("names", results)
     return results
 
 
-def check_gear_review_keywords(searched, results):
+def check_gear_review_keywords(searched, postings, results):
     """
-    Looks for trail and gear-piece keywords in the database that match the user-input search terms.
+    Looks for gear-piece keywords in the search index that match the user-input search terms.
 
-    Iterates through every string in the list of user-input strings to be searched, queries the database to see if any
-    trail or gear-piece keywords match the string, and calls a separate function to update the list of results if there
-    are any matches.
+    Iterates through every word to be searched, looks up the keyword postings stored in the index for that word, and
+    calls a separate function to update the results if there are any matches.
 
     PARAMETERS
     ----------
-    searched : list
-        A list of all individual words, in string form, input by the user into the search form.
-    results : list
-        A list of dictionaries. Each contained dictionary stores relevant info for pages with data matching searched
-        strings.
+    searched : dict
+        Maps every word to be searched, including the ones expanded from prefix and misspelled terms, to its weight.
+    postings : dict
+        Maps each searched string to the postings stored for it in the 'keywords' field of the search index.
+    results : dict
+        A dictionary of dictionaries keyed by the (gear/trail, id) of each page. Each contained dictionary stores
+        relevant info for pages with data matching searched strings.
     """
 
-    to_check = "keywords"
     if searched:
-        for search_item in searched:
-            hits = Gear.query.filter(Gear.keywords.like(f"%{search_item}%")).all()
+        for search_item, weight in searched.items():
+            hits = postings[search_item]
             if hits:
-                results = add_or_adjust_entries_against_search_term_relevance(hits, results, to_check, search_item, 7)
-    print_results("Keywords", results)
+                results = add_or_adjust_entries_against_search_term_relevance(
+                    hits, results, FIELD_WEIGHTS["keywords"] * weight
+                )
+    trace_stage("keywords", results)
     return results
 
 
-def check_gear_and_trail_review_content(searched, results):
+def check_gear_and_trail_review_content(searched, postings, results):
     """
-    Looks for trail and gear-piece content in the database that match the user-input search terms.
+    Looks for trail and gear-piece content in the search index that match the user-input search terms.
 
-    Iterates through every string in the list of user-input strings to be searched, queries the database to see if any
-    trail or gear-piece descriptions match the string, and calls a separate function to update the list of results if
-    there are any matches.
+    Iterates through every word to be searched, looks up the description postings stored in the index for that word,
+    and calls a separate function to update the results if there are any matches.
 
     PARAMETERS
     ----------
-    searched : list
-        A list of all individual words, in string form, input by the user into the search form.
-    results : list
-        A list of dictionaries. Each contained dictionary stores relevant info for pages with data matching searched
-        strings.
+    searched : dict
+        Maps every word to be searched, including the ones expanded from prefix and misspelled terms, to its weight.
+    postings : dict
+        Maps each searched string to the postings stored for it in the 'content' field of the search index.
+    results : dict
+        A dictionary of dictionaries keyed by the (gear/trail, id) of each page. Each contained dictionary stores
+        relevant info for pages with data matching searched strings.
     """
 
-    to_check = "content"
     if searched:
-        for search_item in searched:
-            hits = (Gear.query.filter(Gear.description.like(f"%{search_item}%")).all()) + \
-                   (Trails.query.filter(Trails.description.like(f"%{search_item}%")).all())
+        for search_item, weight in searched.items():
+            hits = postings[search_item]
             if hits:
-                results = add_or_adjust_entries_against_search_term_relevance(hits, results, to_check, search_item, 3)
-    print_results("Content", results)
+                results = add_or_adjust_entries_against_search_term_relevance(
+                    hits, results, FIELD_WEIGHTS["content"] * weight
+                )
+    trace_stage("content", results)
     return results
 
 
-def check_gear_and_trail_review_comments(searched, results):
+def check_gear_and_trail_review_comments(searched, postings, results):
     """
-    Looks for trail and gear-piece comments in the database that match the user-input search terms.
+    Looks for trail and gear-piece comments in the search index that match the user-input search terms.
 
-    Iterates through every string in the list of user-input strings to be searched, queries the database to see if any
-    trail or gear-piece comments match the string, and calls a separate function to update the list of results if there
-    are any matches.
+    Iterates through every word to be searched, looks up the comment postings stored in the index for that word, and
+    calls a separate function to update the results if there are any matches. Comment postings are filed under the gear
+    or trail entry the comment was left on.
 
     PARAMETERS
     ----------
-    searched : list
-        A list of all individual words, in string form, input by the user into the search form.
-    results : list
-        A list of dictionaries. Each contained dictionary stores relevant info for pages with data matching searched
-        strings.
+    searched : dict
+        Maps every word to be searched, including the ones expanded from prefix and misspelled terms, to its weight.
+    postings : dict
+        Maps each searched string to the postings stored for it in the 'comments' field of the search index.
+    results : dict
+        A dictionary of dictionaries keyed by the (gear/trail, id) of each page. Each contained dictionary stores
+        relevant info for pages with data matching searched strings.
     """
 
-    to_check = "comments"
     if searched:
-        for search_item in searched:
-            hits = (GearComments.query.filter(GearComments.text.like(f"%{search_item}%")).all()) + \
-                   (TrailComments.query.filter(TrailComments.text.like(f"%{search_item}%")).all())
+        for search_item, weight in searched.items():
+            hits = postings[search_item]
             if hits:
-                results = add_or_adjust_entries_against_search_term_relevance(hits, results, to_check, search_item, 1)
-    print_results("Comments", results)
+                results = add_or_adjust_entries_against_search_term_relevance(
+                    hits, results, FIELD_WEIGHTS["comments"] * weight
+                )
+    trace_stage("comments", results)
+    return results
+
+
+def check_phrases(phrases, postings, results):
+    """
+    Looks for the quoted phrases of a search in the names, keywords, descriptions and comments of pages.
+
+    The index stores how often each word appears in a page's text but not where, so for every kind of text this first
+    narrows the pages down to the ones whose postings contain every word of the phrase, then loads the text of just
+    those pages and counts how many times the words appear next to each other. Each occurrence is worth the weight of
+    that kind of text for every word in the phrase.
+
+    PARAMETERS
+    ----------
+    phrases : list
+        A list of phrases, each a list of cleaned words.
+    postings : dict
+        Maps each kind of text to a dictionary mapping each searched word to the postings stored for it.
+    results : dict
+        A dictionary of dictionaries keyed by the (gear/trail, id) of each page. Each contained dictionary stores
+        relevant info for pages with data matching searched strings.
+    """
+
+    for phrase_words in phrases:
+        for field, hit_value in FIELD_WEIGHTS.items():
+            candidates = None
+            for word in set(phrase_words):
+                pages = {(hit.gear_trail, hit.doc_id) for hit in postings[field][word]}
+                candidates = pages if candidates is None else candidates & pages
+            if not candidates:
+                continue
+            for key, texts in load_field_texts(field, candidates).items():
+                occurrences = sum(count_phrase(phrase_words, clean_words(text)) for text in texts)
+                if occurrences:
+                    listing = results.get(key)
+                    if listing is None:
+                        listing = make_new_listing(*key)
+                        results[key] = listing
+                    listing["relevance_points"] += occurrences * hit_value * len(phrase_words)
+    trace_stage("phrases", results)
     return results
 
 
-def check_exact_name_in_search(searched, results):
+def check_full_text_search(searched, phrases, backend, results):
+    """
+    Asks a full-text search backend to rank the pages matching the user-input search terms.
+
+    The backend weights names, keywords, descriptions and comments itself, and matches phrases itself, so each
+    matching page is added to the results with the score the backend gave it.
+
+    PARAMETERS
+    ----------
+    searched : dict
+        Maps every word to be searched, including the ones expanded from prefix and misspelled terms, to its weight.
+    phrases : list
+        A list of phrases, each a list of cleaned words.
+    backend : object
+        The full-text search backend chosen when the app was created.
+    results : dict
+        A dictionary of dictionaries keyed by the (gear/trail, id) of each page. Each contained dictionary stores
+        relevant info for pages with data matching searched strings.
+    """
+
+    for (gear_trail, doc_id), score in backend.rank(list(searched), phrases).items():
+        listing = make_new_listing(gear_trail, doc_id)
+        listing["relevance_points"] = score
+        results[(gear_trail, doc_id)] = listing
+    trace_stage("full_text", results)
+    return results
+
+
+def check_exact_name_in_search(searched, results, name_hits):
     """
     Checks if gear/trail_name of any entry in 'results' contains all words matching searched strings.
 
-    Iterates through every entry in the 'results' list to check if the gear/trail_name of the entry contains exclusively
-    words that are included in the list of strings input by the user in the search form.
+    A name made up only of searched words must have matched at least one of them, so only the entries with a hit in
+    the 'names' field are candidates. Loads the gear/trail_name of just those entries, then checks if the
+    gear/trail_name of each contains exclusively words that were searched for.
 
     PARAMETERS
     ----------
-    searched : list
-        A list of all individual words, in string form, input by the user into the search form.
-    results : list
-        A list of dictionaries. Each contained dictionary stores relevant info for pages with data matching searched
-        strings.
+    searched : set
+        Every word searched for, including the ones expanded from prefix and misspelled terms and the words of phrases.
+    results : dict
+        A dictionary of dictionaries keyed by the (gear/trail, id) of each page. Each contained dictionary stores
+        relevant info for pages with data matching searched strings.
+    name_hits : set
+        The (gear/trail, id) of every page whose name matched a searched word.
     """
 
-    for listing in results:
+    candidates = [key for key in name_hits if key in results]
+    add_listing_names(results, candidates)
+    for key in candidates:
+        listing = results[key]
         listing_entry_words = listing["gear/trail_name"].lower().split()
         searched_for_product_name = all(item in searched for item in listing_entry_words)
         if searched_for_product_name:
             listing["relevance_points"] += 1000
-    print_results("Exact Name", results)
+    trace_stage("exact_name", results)
     return results
 
 
 # ----------------------------------------UTILITY FUNCTIONS----------------------------------------
-def add_or_adjust_entries_against_search_term_relevance(hits, results, to_check, search_item, hit_value):
+def add_or_adjust_entries_against_search_term_relevance(hits, results, hit_value):
     """
-    Adds new entries to the 'results' list, as well as adjusting entries already included in the list.
+    Adds new entries to the 'results' dictionary, as well as adjusting entries already included in the dictionary.
 
-    Most of the search functions call this function. It iterates through the list of hits, which are all the gear and
-    trail entries with data matching the current search_item. It then compares the hit to every listing in the 'results'
-    list to see if the information from that page is already included in the list. If it is already included, the
-    current listing is adjusted. The adjustment is to the 'relevance_points' key of the relevant listing. Different
+    Most of the search functions call this function. It iterates through the list of hits, which are all the postings
+    stored in the search index for the current search_item in one kind of text. It then looks up the (gear/trail, id)
+    of the page the posting belongs to in the 'results' dictionary, creating a new listing if the page isn't included
+    yet, and adjusts the listing. The adjustment is to the 'relevance_points' key of the relevant listing. Different
     texts being searched through (the name of the gear or trail object is one kind of text, the comments of an object
     are another) have different values. Matching a search term to an object's name is more valuable than matching it to
     one word from an object's comments. When adjusted, a listing's 'relevance_points' are adjusted up by a value equal
-    to the number of times the search_item appears in the text being examined multiplied by the hit_value, which is
-    assigned by the function calling this function in order to properly weight the importance of the match.
+    to the number of times the search_item appears in the text being examined, which the index stores as the posting's
+    term_frequency, multiplied by the hit_value, which is assigned by the function calling this function in order to
+    properly weight the importance of the match.
 
     PARAMETERS
     ----------
     hits : list
-        An list of gear or trail objects from the database with data matching one or more of the user-input search
-        strings.
-    results : list
-        A list of dictionaries. Each contained dictionary stores relevant info for pages with data matching searched
-        strings.
-    to_check : str
-        A string set by the function calling this function; used to determine which table in the database this function
-        needs to access.
-    search_item : str
-        One of the user-input strings from the search form.
+        A list of postings from the search index for one of the user-input search strings.
+    results : dict
+        A dictionary of dictionaries keyed by the (gear/trail, id) of each page. Each contained dictionary stores
+        relevant info for pages with data matching searched strings.
     hit_value : int
         A number assigned by the function calling this function. It's used as a modifier to the listing's
         'relevance_points'.
     """
 
     for hit in hits:
-        text, name = set_adjustment_variables(to_check, hit)
-        entry_change = False
-        for listing in results:
-            if name == listing["gear/trail_name"].lower():
-                adjustment = clean_and_count_words(text, search_item)
-                listing["relevance_points"] += adjustment * hit_value
-                entry_change = True
-        if not entry_change:
-            listing = make_new_listing(hit, to_check)
-            adjustment = clean_and_count_words(text, search_item)
-            listing["relevance_points"] += adjustment * hit_value
-            results.append(listing)
+        key = (hit.gear_trail, hit.doc_id)
+        listing = results.get(key)
+        if listing is None:
+            listing = make_new_listing(hit.gear_trail, hit.doc_id)
+            results[key] = listing
+        listing["relevance_points"] += hit.term_frequency * hit_value
     return results
 
 
-def set_adjustment_variables(to_check, hit):
-    """Sets two variables for the 'add_or_adjust_entries_against_search_term_relevance' function."""
-    text = None
-    name = None
-    if to_check == "names":
-        text = hit.name.lower()
-        name = hit.name.lower()
-    elif to_check == "keywords":
-        text = hit.keywords.lower()
-        name = hit.name.lower()
-    elif to_check == "content":
-        text = hit.description.lower()
-        name = hit.name.lower()
-    elif to_check == "comments":
-        text = hit.text.lower()
-        name = hit.parent_posts.name.lower()
-    return text, name
-
-
-def make_new_listing(hit, to_check):
+def make_new_listing(gear_trail, doc_id):
     """
-    Creates a new entry to be appended to the 'results' list.
+    Creates a new entry to be added to the 'results' dictionary.
 
     This function is called when one of the search functions has identified a page with data relevant to one or more of
-    the user-input search strings, but no entry for that page exists in the 'results' list. This function then creates
-    that entry.
+    the user-input search strings, but no entry for that page exists in the 'results' dictionary. This function then
+    creates that entry. The entry's gear/trail_name is filled in if it's needed to check for an exact name match.
 
     PARAMETERS
     ----------
-    hit : class
-        A gear or trail object identified in another function as having data matching one or more of the user-input
-        search strings.
-    to_check : str
-        A string set by the function calling this function; used to determine which table in the database this function
-        needs to access.
-    """
-
-    if to_check == "comments":
-        listing = {
-            "gear/trail": hit.parent_posts.gear_trail,
-            "gear/trail_name": hit.parent_posts.name,
-            "id": hit.parent_posts.id,
-            "relevance_points": 0
-        }
-    else:
-        listing = {
-            "gear/trail": hit.gear_trail,
-            "gear/trail_name": hit.name,
-            "id": hit.id,
-            "relevance_points": 0
-        }
+    gear_trail : str
+        Either 'Gear' or 'Trail', the kind of page with data matching one or more of the user-input search strings.
+    doc_id : int
+        The primary key of the page's entry in the gear or trails table.
+    """
+
+    listing = {
+        "gear/trail": gear_trail,
+        "gear/trail_name": None,
+        "id": doc_id,
+        "relevance_points": 0
+    }
     return listing
 
 
-def clean_and_count_words(text, search_item):
+def add_listing_names(results, keys):
+    """Fills in the gear/trail_name of the 'results' entries with the given keys, using one query per table."""
+    gear_ids = [db_id for gear_trail, db_id in keys if gear_trail == "Gear"]
+    trail_ids = [db_id for gear_trail, db_id in keys if gear_trail != "Gear"]
+    names = {}
+    if gear_ids:
+        for db_id, name in Gear.query.with_entities(Gear.id, Gear.name).filter(Gear.id.in_(gear_ids)):
+            names[("Gear", db_id)] = name
+    if trail_ids:
+        for db_id, name in Trails.query.with_entities(Trails.id, Trails.name).filter(Trails.id.in_(trail_ids)):
+            names[("Trail", db_id)] = name
+    for key in keys:
+        results[key]["gear/trail_name"] = names.get(key, "")
+
+
+def load_field_texts(field, keys):
     """
-    Removes unwanted characters from strings and counts occurrences of searched term in a text.
+    Loads one kind of text for a set of pages, with one query per table, for checking which of them contain a phrase.
 
-    Cleans the text by removing all html tags (the text editor used for comments and descriptions returns <p> tags) and
-    non-letter characters. After doing so, counts all words in the text and returns a variable equal to the number of
-    times the search_item appears in the text.
+    Returns a dictionary mapping the (gear/trail, id) of each page to a list of its texts: a single name, keyword list
+    or description, or every undeleted comment left on the page.
 
     PARAMETERS
     ----------
-    text :
-        The text from a part of page currently being checked for occurrences of the search_item.
-    search_item : str
-        One of the user-input strings from the search form.
+    field : str
+        The kind of text to load: 'names', 'keywords', 'content' or 'comments'.
+    keys : set
+        The (gear/trail, id) of every page to load the text of.
     """
 
-    no_tag_text = re.sub(NO_TAGS, '', text).lower()
-    word_list = no_tag_text.split()
-    clean_word_list = []
-    for word in word_list:
-        clean_word = re.sub(NO_CHARS, '', word)
-        clean_word_list.append(clean_word)
-    text_word_counts = Counter(clean_word_list)
-    adjustment = text_word_counts[search_item]
-    return adjustment
+    texts = defaultdict(list)
+    tables = (("Gear", Gear, GearComments, "gear_id"), ("Trail", Trails, TrailComments, "trail_id"))
+    for gear_trail, model, comment_model, parent_column in tables:
+        ids = [db_id for page, db_id in keys if page == gear_trail]
+        if not ids:
+            continue
+        if field == "comments":
+            parent_id = getattr(comment_model, parent_column)
+            query = comment_model.query.with_entities(parent_id, comment_model.text).filter(
+                parent_id.in_(ids), comment_model.deleted_by.is_(None)
+            )
+        else:
+            query = model.query.with_entities(model.id, getattr(model, FIELD_COLUMNS[field])).filter(model.id.in_(ids))
+        for db_id, page_text in query:
+            texts[(gear_trail, db_id)].append(page_text)
+    return texts
+
+
+def count_phrase(phrase_words, words):
+    """Counts the number of times the words of a phrase appear next to each other, in order, in a list of words."""
+    length = len(phrase_words)
+    return sum(1 for start in range(len(words) - length + 1) if words[start:start + length] == phrase_words)
+
+
+def get_page_bounds(total_results, page, per_page):
+    """
+    Clamps the requested page number and page size of a search to ones that exist for the number of results found.
+
+    PARAMETERS
+    ----------
+    total_results : int
+        The number of pages on the site that matched the search.
+    page : int
+        The page of results requested by the user, counting from 1.
+    per_page : int
+        The number of results requested per page, which is kept between 1 and MAX_RESULTS_PER_PAGE.
+    """
+
+    per_page = min(max(per_page, 1), MAX_RESULTS_PER_PAGE)
+    pages = max(math.ceil(total_results / per_page), 1)
+    page = min(max(page, 1), pages)
+    return page, per_page, pages
 
 
 def get_final_results(sorted_results):
-    the_list = []
-    for result in sorted_results:
-        if result["gear/trail"] == "Gear":
-            new_result = Gear.query.get(result["id"])
-        else:
-            new_result = Trails.query.get(result["id"])
-        the_list.append(new_result)
-    return the_list
+    """
+    Loads the gear and trail entries for a list of ranked results, keeping the order they were ranked in.
+
+    Every gear entry in the list is loaded with a single query, as is every trail entry, rather than one query per
+    result. Comment hits are filed under the gear or trail entry they were left on, so no comments need to be loaded.
+    Entries deleted since the search index was last updated are left out.
 
+    PARAMETERS
+    ----------
+    sorted_results : list
+        The (gear/trail, id, relevance points) results, sorted from most to least relevant, for the page of results
+        being shown.
+    """
 
-def print_results(category, results):
-    """Prints to the terminal info useful to the developer."""
-    print(f"{category} Check:")
-    if results:
-        for entry in results:
-            print(f"    hit: {entry['gear/trail_name']} points: {entry['relevance_points']}")
+    gear_ids = [db_id for gear_trail, db_id, relevance_points in sorted_results if gear_trail == "Gear"]
+    trail_ids = [db_id for gear_trail, db_id, relevance_points in sorted_results if gear_trail != "Gear"]
+    entries = {}
+    if gear_ids:
+        for gear in Gear.query.filter(Gear.id.in_(gear_ids)):
+            entries[("Gear", gear.id)] = gear
+    if trail_ids:
+        for trail in Trails.query.filter(Trails.id.in_(trail_ids)):
+            entries[("Trail", trail.id)] = trail
+    the_list = []
+    for gear_trail, db_id, relevance_points in sorted_results:
+        entry = entries.get((gear_trail, db_id))
+        if entry is not None:
+            the_list.append(entry)
+    return the_list
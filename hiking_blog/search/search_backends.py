@@ -0,0 +1,420 @@
+"""Contains the backends that store the search index and look up the pages matching a search."""
+from flask import current_app
+from hiking_blog.models import SearchPostings
+from hiking_blog.db import db
+from sqlalchemy import text, func
+from sqlalchemy.exc import OperationalError
+from collections import Counter, defaultdict
+
+POSTGRES_UPSERT = " ON CONFLICT (id) DO UPDATE SET names = EXCLUDED.names, keywords = EXCLUDED.keywords, " \
+                  "content = EXCLUDED.content, comments = EXCLUDED.comments"
+
+search_backend = None
+
+
+class IndexSearchBackend:
+    """
+    A class used to store the search index as postings in the search_postings table.
+
+    This backend works on every database. It only looks up the postings for the searched terms; scoring them with the
+    10/7/3/1 field weights is left to the search functions in the search module.
+    """
+
+    name = "index"
+    scores_in_python = True
+
+    def create(self):
+        """The search_postings table is created along with the rest of the database, so there is nothing to do."""
+
+    def is_empty(self):
+        """Returns True if no postings have been stored yet."""
+        return SearchPostings.query.first() is None
+
+    def clear(self):
+        """Deletes every posting in the index."""
+        SearchPostings.query.delete()
+
+    def replace_entry(self, gear_trail, doc_id, fields):
+        """Deletes the postings stored for a gear or trail entry and adds new ones for each of its fields."""
+        SearchPostings.query.filter(
+            SearchPostings.gear_trail == gear_trail,
+            SearchPostings.doc_id == doc_id,
+            SearchPostings.comment_id.is_(None)
+        ).delete(synchronize_session=False)
+        self.add_entry(gear_trail, doc_id, fields)
+
+    def replace_comment(self, gear_trail, doc_id, comment_id, words):
+        """Deletes the postings stored for a comment and adds new ones built from the comment's current words."""
+        SearchPostings.query.filter_by(
+            gear_trail=gear_trail,
+            field="comments",
+            comment_id=comment_id
+        ).delete(synchronize_session=False)
+        if doc_id is not None:
+            self.add_comment(gear_trail, doc_id, comment_id, words)
+
+    def add_entry(self, gear_trail, doc_id, fields):
+        """Adds postings for each field of a gear or trail entry, without checking for postings already stored."""
+        self.add_entries([(gear_trail, doc_id, fields)])
+
+    def add_comment(self, gear_trail, doc_id, comment_id, words):
+        """Adds postings for a comment, without checking for postings already stored."""
+        self.add_comments([(gear_trail, doc_id, comment_id, words)])
+
+    @staticmethod
+    def add_entries(entries):
+        """Adds postings for a batch of (gear/trail, id, fields) entries with a single executemany."""
+        rows = []
+        for gear_trail, doc_id, fields in entries:
+            for field, words in fields.items():
+                rows += make_postings(gear_trail, doc_id, field, words, None)
+        insert_postings(rows)
+
+    @staticmethod
+    def add_comments(comments):
+        """Adds postings for a batch of (gear/trail, id, comment id, words) comments with a single executemany."""
+        rows = []
+        for gear_trail, doc_id, comment_id, words in comments:
+            rows += make_postings(gear_trail, doc_id, "comments", words, comment_id)
+        insert_postings(rows)
+
+    @staticmethod
+    def vocabulary():
+        """Returns a (term, number of postings) pair for every distinct term stored in the index."""
+        return SearchPostings.query.with_entities(SearchPostings.term, func.count()).group_by(SearchPostings.term).all()
+
+    @staticmethod
+    def get_postings(search_list):
+        """
+        Loads the postings for every user-input search term in a single query.
+
+        Returns a dictionary, keyed by field name, of dictionaries mapping each search term to the postings stored for
+        it in that field. Only the columns needed for scoring are selected, so no ORM objects are built for postings.
+
+        PARAMETERS
+        ----------
+        search_list : list
+            A list of cleaned user-input strings.
+        """
+
+        postings = defaultdict(lambda: defaultdict(list))
+        if search_list:
+            rows = SearchPostings.query.with_entities(
+                SearchPostings.term,
+                SearchPostings.field,
+                SearchPostings.gear_trail,
+                SearchPostings.doc_id,
+                SearchPostings.term_frequency
+            ).filter(SearchPostings.term.in_(set(search_list)))
+            for posting in rows:
+                postings[posting.field][posting.term].append(posting)
+        return postings
+
+
+class SqliteFtsSearchBackend:
+    """
+    A class used to store the search index in an SQLite FTS5 virtual table.
+
+    Every gear or trail entry gets one row holding its cleaned name, keywords and description, and every comment gets
+    its own row holding its cleaned text, so a single comment can be re-indexed without rewriting the whole thread.
+    Searches are ranked with bm25, weighting the columns the same way the index backend weights its fields.
+    """
+
+    name = "sqlite_fts"
+    scores_in_python = False
+
+    def create(self):
+        """Creates the FTS5 table and its vocabulary table, raising an OperationalError if SQLite lacks FTS5."""
+        db.session.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+            "gear_trail UNINDEXED, doc_id UNINDEXED, comment_id UNINDEXED, names, keywords, content, comments)"
+        ))
+        db.session.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS search_fts_vocab USING fts5vocab(search_fts, row)"))
+        db.session.commit()
+
+    def is_empty(self):
+        """Returns True if no rows have been stored yet."""
+        return db.session.execute(text("SELECT rowid FROM search_fts LIMIT 1")).first() is None
+
+    def clear(self):
+        """Deletes every row in the index."""
+        db.session.execute(text("DELETE FROM search_fts"))
+
+    def replace_entry(self, gear_trail, doc_id, fields):
+        """Replaces the row of a gear or trail entry with one built from the words of its fields."""
+        self.delete_row(document_rowid(gear_trail, doc_id, None))
+        self.add_entry(gear_trail, doc_id, fields)
+
+    def replace_comment(self, gear_trail, doc_id, comment_id, words):
+        """Replaces the row of a comment with one built from the comment's current words."""
+        self.delete_row(document_rowid(gear_trail, None, comment_id))
+        if doc_id is not None:
+            self.add_comment(gear_trail, doc_id, comment_id, words)
+
+    def add_entry(self, gear_trail, doc_id, fields):
+        """Adds the row of a gear or trail entry, without checking for a row already stored."""
+        self.add_entries([(gear_trail, doc_id, fields)])
+
+    def add_comment(self, gear_trail, doc_id, comment_id, words):
+        """Adds the row of a comment, without checking for a row already stored."""
+        self.add_comments([(gear_trail, doc_id, comment_id, words)])
+
+    @staticmethod
+    def add_entries(entries):
+        """Adds the rows of a batch of (gear/trail, id, fields) entries with a single executemany."""
+        insert_documents("search_fts", "rowid", entry_documents(entries))
+
+    @staticmethod
+    def add_comments(comments):
+        """Adds the rows of a batch of (gear/trail, id, comment id, words) comments with a single executemany."""
+        insert_documents("search_fts", "rowid", comment_documents(comments))
+
+    @staticmethod
+    def delete_row(rowid):
+        """Deletes a row of the FTS5 table by its rowid."""
+        db.session.execute(text("DELETE FROM search_fts WHERE rowid = :rowid"), {"rowid": rowid})
+
+    @staticmethod
+    def vocabulary():
+        """Returns a (term, number of rows) pair for every distinct term stored in the FTS5 table."""
+        return db.session.execute(text("SELECT term, doc FROM search_fts_vocab")).all()
+
+    @staticmethod
+    def rank(search_list, phrases=()):
+        """
+        Returns a dictionary mapping the (gear/trail, id) of every matching page to its summed bm25 score.
+
+        PARAMETERS
+        ----------
+        search_list : list
+            A list of cleaned search terms, any of which may match.
+        phrases : list
+            A list of phrases, each a list of cleaned words, which match rows containing the words next to each other.
+        """
+
+        scores = defaultdict(float)
+        if search_list or phrases:
+            matches = [f'"{term}"' for term in set(search_list)] + [f'"{" ".join(words)}"' for words in phrases]
+            query = " OR ".join(matches)
+            rows = db.session.execute(
+                text(
+                    "SELECT gear_trail, doc_id, -bm25(search_fts, 0, 0, 0, 10.0, 7.0, 3.0, 1.0) FROM search_fts "
+                    "WHERE search_fts MATCH :query"
+                ),
+                {"query": query}
+            )
+            for gear_trail, doc_id, score in rows:
+                scores[(gear_trail, doc_id)] += score
+        return scores
+
+
+class PostgresFtsSearchBackend:
+    """
+    A class used to store the search index in a Postgres table with a generated, GIN-indexed tsvector column.
+
+    Rows are laid out the same way as the SQLite FTS5 backend. The name, keyword, content and comment columns are given
+    the tsvector weights A, B, C and D, and searches are ranked with ts_rank using weights proportional to 10/7/3/1.
+    """
+
+    name = "postgres_fts"
+    scores_in_python = False
+
+    def create(self):
+        """Creates the search_documents table and its GIN index."""
+        db.session.execute(text(
+            "CREATE TABLE IF NOT EXISTS search_documents ("
+            "id BIGINT PRIMARY KEY, "
+            "gear_trail VARCHAR NOT NULL, "
+            "doc_id INTEGER NOT NULL, "
+            "comment_id INTEGER, "
+            "names TEXT NOT NULL DEFAULT '', "
+            "keywords TEXT NOT NULL DEFAULT '', "
+            "content TEXT NOT NULL DEFAULT '', "
+            "comments TEXT NOT NULL DEFAULT '', "
+            "document TSVECTOR GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('simple', names), 'A') || "
+            "setweight(to_tsvector('simple', keywords), 'B') || "
+            "setweight(to_tsvector('simple', content), 'C') || "
+            "setweight(to_tsvector('simple', comments), 'D')) STORED)"
+        ))
+        db.session.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_search_documents_document ON search_documents USING GIN (document)"
+        ))
+        db.session.commit()
+
+    def is_empty(self):
+        """Returns True if no rows have been stored yet."""
+        return db.session.execute(text("SELECT id FROM search_documents LIMIT 1")).first() is None
+
+    def clear(self):
+        """Deletes every row in the index."""
+        db.session.execute(text("DELETE FROM search_documents"))
+
+    def replace_entry(self, gear_trail, doc_id, fields):
+        """Replaces the row of a gear or trail entry with one built from the words of its fields."""
+        self.add_entry(gear_trail, doc_id, fields)
+
+    def replace_comment(self, gear_trail, doc_id, comment_id, words):
+        """Replaces the row of a comment with one built from the comment's current words."""
+        if doc_id is None:
+            rowid = document_rowid(gear_trail, None, comment_id)
+            db.session.execute(text("DELETE FROM search_documents WHERE id = :rowid"), {"rowid": rowid})
+        else:
+            self.add_comment(gear_trail, doc_id, comment_id, words)
+
+    def add_entry(self, gear_trail, doc_id, fields):
+        """Adds the row of a gear or trail entry, overwriting any row already stored for it."""
+        self.add_entries([(gear_trail, doc_id, fields)])
+
+    def add_comment(self, gear_trail, doc_id, comment_id, words):
+        """Adds the row of a comment, overwriting any row already stored for it."""
+        self.add_comments([(gear_trail, doc_id, comment_id, words)])
+
+    @staticmethod
+    def add_entries(entries):
+        """Adds the rows of a batch of (gear/trail, id, fields) entries with a single executemany."""
+        insert_documents("search_documents", "id", entry_documents(entries), POSTGRES_UPSERT)
+
+    @staticmethod
+    def add_comments(comments):
+        """Adds the rows of a batch of (gear/trail, id, comment id, words) comments with a single executemany."""
+        insert_documents("search_documents", "id", comment_documents(comments), POSTGRES_UPSERT)
+
+    @staticmethod
+    def vocabulary():
+        """Returns a (term, number of rows) pair for every distinct term stored in the search_documents table."""
+        return db.session.execute(text("SELECT word, ndoc FROM ts_stat('SELECT document FROM search_documents')")).all()
+
+    @staticmethod
+    def rank(search_list, phrases=()):
+        """
+        Returns a dictionary mapping the (gear/trail, id) of every matching page to its summed ts_rank score.
+
+        PARAMETERS
+        ----------
+        search_list : list
+            A list of cleaned search terms, any of which may match.
+        phrases : list
+            A list of phrases, each a list of cleaned words, which match rows containing the words next to each other.
+        """
+
+        scores = defaultdict(float)
+        if search_list or phrases:
+            rows = db.session.execute(
+                text(
+                    "SELECT gear_trail, doc_id, SUM(ts_rank('{0.1, 0.3, 0.7, 1.0}', document, query)) "
+                    "FROM search_documents, to_tsquery('simple', :query) AS query "
+                    "WHERE document @@ query GROUP BY gear_trail, doc_id"
+                ),
+                {"query": " | ".join(list(set(search_list)) + [f"({' <-> '.join(words)})" for words in phrases])}
+            )
+            for gear_trail, doc_id, score in rows:
+                scores[(gear_trail, doc_id)] += score
+        return scores
+
+
+SEARCH_BACKENDS = {
+    "sqlite": SqliteFtsSearchBackend,
+    "postgresql": PostgresFtsSearchBackend
+}
+
+
+def create_search_backend(app):
+    """
+    Chooses the search backend used by the app.
+
+    If the SEARCH_BACKEND config variable is set to 'fts' and the database supports full-text search, the matching FTS
+    backend is used. Otherwise, or if the FTS table cannot be created, the index backend is used.
+    """
+
+    global search_backend
+    search_backend = IndexSearchBackend()
+    if app.config.get("SEARCH_BACKEND", "index") == "fts":
+        backend_class = SEARCH_BACKENDS.get(db.engine.dialect.name)
+        if backend_class:
+            try:
+                backend = backend_class()
+                backend.create()
+                search_backend = backend
+            except OperationalError:
+                db.session.rollback()
+                app.logger.warning("Full-text search is unavailable; falling back to the index search backend.")
+
+
+def get_search_backend():
+    """Returns the search backend, choosing one first if the app has not done so yet."""
+    if search_backend is None:
+        create_search_backend(current_app)
+    return search_backend
+
+
+def document_rowid(gear_trail, doc_id, comment_id):
+    """
+    Gives every gear entry, trail entry and comment its own fixed row id in the FTS tables.
+
+    Entries get positive ids and comments get negative ones, with the lowest bit telling gear apart from trails. A
+    fixed id lets a single entry or comment be replaced by its primary key instead of scanning the table for it.
+    """
+
+    type_bit = 0 if gear_trail == "Gear" else 1
+    if comment_id is None:
+        return doc_id * 2 + type_bit
+    return -(comment_id * 2 + type_bit) - 1
+
+
+def make_postings(gear_trail, doc_id, field, words, comment_id):
+    """Counts the words of one field and returns a row for the search_postings table for every distinct term."""
+    return [
+        {
+            "term": term,
+            "gear_trail": gear_trail,
+            "doc_id": doc_id,
+            "field": field,
+            "comment_id": comment_id,
+            "term_frequency": term_frequency
+        }
+        for term, term_frequency in Counter(words).items()
+    ]
+
+
+def insert_postings(rows):
+    """Inserts rows into the search_postings table with a single executemany."""
+    if rows:
+        db.session.execute(SearchPostings.__table__.insert(), rows)
+
+
+def entry_documents(entries):
+    """Turns a batch of (gear/trail, id, fields) entries into rows for the full-text search tables."""
+    return [
+        dict(rowid=document_rowid(gear_trail, doc_id, None), gear_trail=gear_trail, doc_id=doc_id, comment_id=None,
+             **join_fields(fields))
+        for gear_trail, doc_id, fields in entries
+    ]
+
+
+def comment_documents(comments):
+    """Turns a batch of (gear/trail, id, comment id, words) comments into rows for the full-text search tables."""
+    return [
+        dict(rowid=document_rowid(gear_trail, None, comment_id), gear_trail=gear_trail, doc_id=doc_id,
+             comment_id=comment_id, **join_fields({"comments": words}))
+        for gear_trail, doc_id, comment_id, words in comments
+    ]
+
+
+def insert_documents(table, id_column, rows, on_conflict=""):
+    """Inserts rows into one of the full-text search tables with a single executemany."""
+    if rows:
+        db.session.execute(
+            text(
+                f"INSERT INTO {table} ({id_column}, gear_trail, doc_id, comment_id, "
+                "names, keywords, content, comments) "
+                "VALUES (:rowid, :gear_trail, :doc_id, :comment_id, :names, :keywords, :content, :comments)"
+                f"{on_conflict}"
+            ),
+            rows
+        )
+
+
+def join_fields(fields):
+    """Joins the cleaned words of every field back into a string and fills in any missing fields."""
+    return {field: " ".join(fields.get(field, [])) for field in ("names", "keywords", "content", "comments")}
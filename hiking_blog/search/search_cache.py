@@ -0,0 +1,131 @@
+"""Keeps the ranked results of recent searches so that popular searches aren't recomputed on every request."""
+from flask import current_app
+from sqlalchemy import event
+from hiking_blog.db import db
+from collections import OrderedDict
+import threading
+import time
+
+INDEX_CHANGED = "search_index_changed"
+
+search_cache = None
+
+
+class SearchCache:
+    """
+    A class used to store the ranked results of recent searches, keyed by the cleaned search terms.
+
+    Results are thrown out once they are older than 'ttl' seconds, or once 'max_size' newer searches have been stored,
+    starting with the least recently used. Every time a change to a gear, trail or comment entry is committed, the
+    cache's generation is bumped and every stored result is thrown out, so a result is never served after the pages it
+    was built from have changed. The generation is kept in memory, so when the app runs in several processes the ttl
+    bounds how long another process can serve a result built before a change.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the results stored for a search, or None if they are missing, out of date or too old."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                generation, stored_at, results = entry
+                if generation == self.generation and time.monotonic() - stored_at < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return results
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, results, generation):
+        """
+        Stores the results of a search, unless the search index has changed since the search started.
+
+        PARAMETERS
+        ----------
+        key : tuple
+            The cleaned search terms, sorted.
+        results : tuple
+            A (gear/trail, id, relevance points) tuple for every matching page, from most to least relevant.
+        generation : int
+            The generation of the cache when the search started.
+        """
+
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = (generation, time.monotonic(), results)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        """Throws out every stored result and bumps the generation so searches already running aren't stored."""
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        """Returns the hit and miss counts of the cache, along with its size, to help choose SEARCH_CACHE_SIZE."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "generation": self.generation
+            }
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def create_search_cache(app):
+    """
+    Creates the search cache and has it invalidated every time a change to the search index is committed.
+
+    The indexing functions mark the session when they change the search index. The cache is only invalidated once that
+    change is committed, so that a search can't store results read from the database before the commit under the new
+    generation. Marks left by a session that is rolled back are cleared.
+    """
+
+    global search_cache
+    search_cache = SearchCache(app.config.get("SEARCH_CACHE_SIZE", 256), app.config.get("SEARCH_CACHE_TTL", 300))
+    if not event.contains(db.session, "after_commit", invalidate_after_commit):
+        event.listen(db.session, "after_commit", invalidate_after_commit)
+        event.listen(db.session, "after_rollback", clear_index_changed)
+    return search_cache
+
+
+def get_search_cache():
+    """Returns the search cache, creating it if the app was started without one."""
+    if search_cache is None:
+        create_search_cache(current_app)
+    return search_cache
+
+
+def mark_index_changed():
+    """Marks the current session as having changed the search index, which invalidates the cache on commit."""
+    db.session.info[INDEX_CHANGED] = True
+
+
+def invalidate_after_commit(session):
+    """Invalidates the search cache after a session that changed the search index is committed."""
+    if session.info.pop(INDEX_CHANGED, False) and search_cache is not None:
+        search_cache.invalidate()
+
+
+def clear_index_changed(session):
+    """Clears the mark left by the indexing functions on a session that has been rolled back."""
+    session.info.pop(INDEX_CHANGED, None)
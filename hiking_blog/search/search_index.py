@@ -0,0 +1,188 @@
+"""Cleans the text of gear and trail pages and keeps the site-wide search index up to date."""
+from hiking_blog.models import Gear, GearComments, Trails, TrailComments
+from hiking_blog.search.search_backends import get_search_backend
+from hiking_blog.search.search_cache import mark_index_changed
+from hiking_blog.search.autocomplete import mark_names_changed
+from hiking_blog.db import db
+from collections import Counter
+import re
+
+NO_TAGS = re.compile("<.*?>")
+NO_CHARS = re.compile("[^a-zA-Z]")
+MAX_TERM_LENGTH = 100
+BATCH_SIZE = 1000
+
+
+# ----------------------------------------TOKENIZING FUNCTIONS----------------------------------------
+def clean_words(text):
+    """
+    Removes unwanted characters from a text and returns the words left in it, in order.
+
+    The text editor used for comments and descriptions returns <p> tags, so all html tags are removed before the text is
+    split into words. Each word then has its non-letter characters removed, the same way the user-input search terms
+    are cleaned, so that the words stored in the index line up with the terms being searched for.
+
+    PARAMETERS
+    ----------
+    text : str
+        The text from a part of a page being added to the index.
+    """
+
+    if not text:
+        return []
+    no_tag_text = NO_TAGS.sub('', text).lower()
+    clean_word_list = []
+    for word in no_tag_text.split():
+        clean_word = NO_CHARS.sub('', word)
+        if clean_word != "" and len(clean_word) <= MAX_TERM_LENGTH:
+            clean_word_list.append(clean_word)
+    return clean_word_list
+
+
+def count_terms(text):
+    """Counts the occurrences of every cleaned word in a text."""
+    return Counter(clean_words(text))
+
+
+# ----------------------------------------INDEXING FUNCTIONS----------------------------------------
+def index_gear(gear):
+    """Replaces the name, keyword and content entries of a gear piece in the index with ones built from its text."""
+    fields = {
+        "names": gear.name,
+        "keywords": gear.keywords,
+        "content": gear.description
+    }
+    replace_entry(gear, fields)
+
+
+def index_trail(trail):
+    """Replaces the name and content entries of a trail in the index with ones built from its current text."""
+    fields = {
+        "names": trail.name,
+        "content": trail.description
+    }
+    replace_entry(trail, fields)
+
+
+def index_gear_comment(comment):
+    """Replaces the index entry of a single gear comment, which is filed under the comment's parent gear entry."""
+    replace_comment(comment, "Gear", "gear_id")
+
+
+def index_trail_comment(comment):
+    """Replaces the index entry of a single trail comment, which is filed under the comment's parent trail entry."""
+    replace_comment(comment, "Trail", "trail_id")
+
+
+def remove_gear_comment(comment):
+    """Removes a gear comment deleted by its commenter or an admin from the index, so its text isn't searched."""
+    get_search_backend().replace_comment("Gear", None, comment.id, [])
+    mark_index_changed()
+
+
+def remove_trail_comment(comment):
+    """Removes a trail comment deleted by its commenter or an admin from the index, so its text isn't searched."""
+    get_search_backend().replace_comment("Trail", None, comment.id, [])
+    mark_index_changed()
+
+
+def replace_entry(entry, fields):
+    """
+    Replaces everything the search backend has stored for the searchable fields of a gear or trail entry.
+
+    The entry must have a primary key before it can be indexed, so new entries are flushed to the database first.
+    Committing is left to the function that made the change to the entry. The search cache and the autocomplete index
+    are brought up to date once the change is committed.
+
+    PARAMETERS
+    ----------
+    entry : object
+        An object from the gear or trails table of the database.
+    fields : dict
+        Maps the name of each searchable field ('names', 'keywords', 'content') to the text stored in that field.
+    """
+
+    if entry.id is None:
+        db.session.add(entry)
+        db.session.flush()
+    clean_fields = {field: clean_words(text) for field, text in fields.items()}
+    get_search_backend().replace_entry(entry.gear_trail, entry.id, clean_fields)
+    mark_index_changed()
+    mark_names_changed()
+
+
+def replace_comment(comment, gear_trail, parent_column):
+    """
+    Replaces everything the search backend has stored for a comment with entries built from its current text.
+
+    Deleted comments keep their text in the database, so a comment with a deleted_by value is left out of the index.
+    """
+
+    if comment.id is None:
+        db.session.add(comment)
+        db.session.flush()
+    doc_id = getattr(comment, parent_column) if comment.deleted_by is None else None
+    get_search_backend().replace_comment(gear_trail, doc_id, comment.id, clean_words(comment.text))
+    mark_index_changed()
+
+
+def rebuild_search_index():
+    """
+    Deletes everything in the search index and rebuilds it from every gear, trail and undeleted comment entry.
+
+    Only the columns that are indexed are loaded, a batch of rows at a time, every text is cleaned exactly once, and
+    each batch is written to the index in a single executemany. Since the index starts out empty, entries are added
+    without first deleting what was stored for them.
+    """
+
+    backend = get_search_backend()
+    backend.clear()
+    all_gear = Gear.query.with_entities(Gear.id, Gear.name, Gear.keywords, Gear.description)
+    for batch in iterate_in_batches(all_gear):
+        backend.add_entries([
+            ("Gear", db_id, {"names": clean_words(name), "keywords": clean_words(keywords),
+                             "content": clean_words(description)})
+            for db_id, name, keywords, description in batch
+        ])
+    all_trails = Trails.query.with_entities(Trails.id, Trails.name, Trails.description)
+    for batch in iterate_in_batches(all_trails):
+        backend.add_entries([
+            ("Trail", db_id, {"names": clean_words(name), "content": clean_words(description)})
+            for db_id, name, description in batch
+        ])
+    all_gear_comments = GearComments.query.with_entities(
+        GearComments.id, GearComments.gear_id, GearComments.text
+    ).filter(GearComments.deleted_by.is_(None))
+    for batch in iterate_in_batches(all_gear_comments):
+        backend.add_comments([
+            ("Gear", doc_id, comment_id, clean_words(comment_text))
+            for comment_id, doc_id, comment_text in batch if doc_id is not None
+        ])
+    all_trail_comments = TrailComments.query.with_entities(
+        TrailComments.id, TrailComments.trail_id, TrailComments.text
+    ).filter(TrailComments.deleted_by.is_(None))
+    for batch in iterate_in_batches(all_trail_comments):
+        backend.add_comments([
+            ("Trail", doc_id, comment_id, clean_words(comment_text))
+            for comment_id, doc_id, comment_text in batch if doc_id is not None
+        ])
+    mark_index_changed()
+    db.session.commit()
+
+
+def create_search_index():
+    """Builds the search index when the app starts against a database whose index has never been built."""
+    if get_search_backend().is_empty():
+        rebuild_search_index()
+
+
+def iterate_in_batches(query):
+    """Runs a query, fetching BATCH_SIZE rows at a time, and yields its rows in lists of up to BATCH_SIZE rows."""
+    batch = []
+    for row in query.yield_per(BATCH_SIZE):
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,182 @@
+"""Times the stages of a sample of searches and hands the timings to pluggable sinks."""
+from flask import current_app, g
+from collections import deque
+import json
+import logging
+import random
+import threading
+import time
+
+search_tracer = None
+
+
+class SearchTrace:
+    """
+    A class used to record how long each stage of one search took and how many pages it had found by then.
+
+    PARAMETERS
+    ----------
+    query : str
+        The user-input string being searched.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.started = time.perf_counter()
+        self.last_mark = self.started
+        self.stages = []
+        self.details = {}
+
+    def add_stage(self, stage, candidates):
+        """Records the time taken since the previous stage ended, along with the number of pages found so far."""
+        now = time.perf_counter()
+        self.stages.append({"stage": stage, "ms": (now - self.last_mark) * 1000, "candidates": candidates})
+        self.last_mark = now
+
+    def finish(self):
+        """Returns the trace as a dictionary, with the total time taken by the search."""
+        return {
+            "query": self.query,
+            "total_ms": (time.perf_counter() - self.started) * 1000,
+            "stages": self.stages,
+            **self.details
+        }
+
+
+class SearchTracer:
+    """
+    A class used to choose which searches are traced and to send every finished trace to its sinks.
+
+    A sink is any callable taking a finished trace. Tracing is off when the sample rate is 0, which is the default, and
+    the only cost a search then pays is one random number and a few lookups of an empty value on flask's g.
+
+    PARAMETERS
+    ----------
+    sample_rate : float
+        The fraction of searches to trace, from 0 to 1.
+    sinks : list
+        The callables every finished trace is sent to.
+    """
+
+    def __init__(self, sample_rate, sinks):
+        self.sample_rate = sample_rate
+        self.sinks = list(sinks)
+
+    def sample(self):
+        """Returns True if the search about to run should be traced."""
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def emit(self, trace):
+        """Sends a finished trace to every sink, logging any sink that fails rather than failing the search."""
+        for sink in self.sinks:
+            try:
+                sink(trace)
+            except Exception:
+                logging.getLogger(__name__).exception("Search trace sink %r failed.", sink)
+
+
+class LogSink:
+    """A class used to write every search trace to the 'hiking_blog.search' logger as a line of json."""
+
+    def __init__(self):
+        self.logger = logging.getLogger("hiking_blog.search")
+
+    def __call__(self, trace):
+        self.logger.info("search trace %s", json.dumps(trace))
+
+
+class MemorySink:
+    """
+    A class used to keep the most recent search traces in memory, for the admin search traces page.
+
+    PARAMETERS
+    ----------
+    size : int
+        The number of traces kept. Older traces are dropped as new ones arrive.
+    """
+
+    def __init__(self, size):
+        self.traces = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def __call__(self, trace):
+        with self.lock:
+            self.traces.append(trace)
+
+    def summary(self):
+        """Returns the kept traces along with the mean and worst time taken by each stage across them."""
+        with self.lock:
+            traces = list(self.traces)
+        stage_times = {}
+        for trace in traces:
+            for stage in trace["stages"]:
+                stage_times.setdefault(stage["stage"], []).append(stage["ms"])
+            stage_times.setdefault("total", []).append(trace["total_ms"])
+        stages = {
+            stage: {"count": len(times), "mean_ms": sum(times) / len(times), "max_ms": max(times)}
+            for stage, times in stage_times.items()
+        }
+        return {"stages": stages, "traces": traces}
+
+
+TRACE_SINKS = {
+    "log": lambda app: LogSink(),
+    "memory": lambda app: MemorySink(app.config.get("SEARCH_TRACE_BUFFER_SIZE", 200))
+}
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def create_search_tracer(app):
+    """
+    Creates the search tracer from the SEARCH_TRACE_SAMPLE_RATE and SEARCH_TRACE_SINKS config variables.
+
+    SEARCH_TRACE_SINKS is a comma-separated list of the names in TRACE_SINKS. Other sinks, such as one feeding a metrics
+    system, can be added to the tracer's sinks list once the app has been created.
+    """
+
+    global search_tracer
+    sink_names = [name.strip() for name in app.config.get("SEARCH_TRACE_SINKS", "log").split(",") if name.strip()]
+    sinks = [TRACE_SINKS[name](app) for name in sink_names]
+    search_tracer = SearchTracer(app.config.get("SEARCH_TRACE_SAMPLE_RATE", 0.0), sinks)
+    return search_tracer
+
+
+def get_search_tracer():
+    """Returns the search tracer, creating it if the app was started without one."""
+    if search_tracer is None:
+        create_search_tracer(current_app)
+    return search_tracer
+
+
+def get_memory_sink():
+    """Returns the tracer's in-memory sink, or None if traces aren't being kept in memory."""
+    for sink in get_search_tracer().sinks:
+        if isinstance(sink, MemorySink):
+            return sink
+    return None
+
+
+def start_search_trace(query):
+    """Starts tracing the search of a user-input string, if it is chosen to be sampled."""
+    g.search_trace = SearchTrace(query) if get_search_tracer().sample() else None
+
+
+def trace_stage(stage, results=None):
+    """Ends a stage of the current search's trace, if it is being traced, recording how many pages it found so far."""
+    trace = g.get("search_trace")
+    if trace is not None:
+        trace.add_stage(stage, None if results is None else len(results))
+
+
+def trace_detail(name, value):
+    """Adds a detail, such as whether the search cache was hit, to the current search's trace if it is being traced."""
+    trace = g.get("search_trace")
+    if trace is not None:
+        trace.details[name] = value
+
+
+def finish_search_trace():
+    """Sends the current search's trace to the tracer's sinks, if it is being traced."""
+    trace = g.pop("search_trace", None)
+    if trace is not None:
+        get_search_tracer().emit(trace.finish())
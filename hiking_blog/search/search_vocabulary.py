@@ -0,0 +1,179 @@
+"""Keeps the words stored in the search index in memory so that prefix and misspelled search terms can be expanded."""
+from flask import current_app
+from hiking_blog.search.search_backends import get_search_backend
+from hiking_blog.search.search_cache import get_search_cache
+from collections import defaultdict
+from bisect import bisect_left
+from threading import Thread
+import heapq
+import time
+
+DELETE_PREFIX_LENGTH = 7
+MAX_EDIT_DISTANCE = 2
+MIN_FUZZY_LENGTH = 4
+MIN_PREFIX_LENGTH = 2
+MAX_EXPANSIONS = 20
+MAX_CORRECTIONS = 3
+
+search_vocabulary = None
+rebuilding = False
+
+
+class SearchVocabulary:
+    """
+    A class used to look up the words stored in the search index by prefix and by edit distance.
+
+    Words are kept in a sorted list, so every word starting with a prefix is found with a binary search. Misspelled
+    words are looked up with a symmetric-delete dictionary: every word is stored under each string that can be made by
+    deleting up to MAX_EDIT_DISTANCE letters from its first DELETE_PREFIX_LENGTH letters. A search term is then matched
+    by generating the same deletes from the term and looking each one up, so only the handful of words sharing a
+    delete with the term have their edit distance computed, however many words the index holds.
+
+    PARAMETERS
+    ----------
+    document_counts : dict
+        Maps every word stored in the search index to the number of index rows or postings it appears in.
+    generation : int
+        The generation of the search cache when the words were loaded, used to tell when they are out of date.
+    """
+
+    def __init__(self, document_counts, generation):
+        self.document_counts = document_counts
+        self.words = sorted(document_counts)
+        self.generation = generation
+        self.built_at = time.monotonic()
+        self.deletes = defaultdict(list)
+        for word in self.words:
+            if len(word) >= MIN_FUZZY_LENGTH - MAX_EDIT_DISTANCE:
+                for delete in make_deletes(word[:DELETE_PREFIX_LENGTH], MAX_EDIT_DISTANCE):
+                    self.deletes[delete].append(word)
+
+    def __contains__(self, word):
+        return word in self.document_counts
+
+    def complete(self, prefix, limit=MAX_EXPANSIONS):
+        """Returns up to 'limit' words starting with a prefix, the most common words first."""
+        if len(prefix) < MIN_PREFIX_LENGTH:
+            return []
+        matches = []
+        position = bisect_left(self.words, prefix)
+        while position < len(self.words) and self.words[position].startswith(prefix):
+            matches.append(self.words[position])
+            position += 1
+        return heapq.nlargest(limit, matches, key=self.document_counts.get)
+
+    def correct(self, word, limit=MAX_CORRECTIONS):
+        """
+        Returns up to 'limit' (word, edit distance) pairs for the words closest to a word missing from the index.
+
+        Words shorter than MIN_FUZZY_LENGTH aren't corrected, since almost every short word is one or two edits away
+        from another. Words shorter than five letters may be one edit away from a match, longer words two. Only the
+        matches at the smallest edit distance found are returned, the most common first.
+
+        PARAMETERS
+        ----------
+        word : str
+            A cleaned search term.
+        limit : int
+            The largest number of corrections to return.
+        """
+
+        if len(word) < MIN_FUZZY_LENGTH:
+            return []
+        max_distance = 1 if len(word) < 5 else MAX_EDIT_DISTANCE
+        candidates = set()
+        for delete in make_deletes(word[:DELETE_PREFIX_LENGTH], max_distance):
+            candidates.update(self.deletes.get(delete, ()))
+        best_distance = max_distance
+        matches = []
+        for candidate in candidates:
+            if abs(len(candidate) - len(word)) > best_distance:
+                continue
+            distance = edit_distance(word, candidate, best_distance + 1)
+            if distance < best_distance:
+                best_distance = distance
+                matches = [candidate]
+            elif distance == best_distance:
+                matches.append(candidate)
+        best = heapq.nlargest(limit, matches, key=self.document_counts.get)
+        return [(match, best_distance) for match in best]
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def create_search_vocabulary(app):
+    """Loads the words stored in the search index when the app starts."""
+    global search_vocabulary
+    search_vocabulary = load_vocabulary()
+    return search_vocabulary
+
+
+def get_search_vocabulary():
+    """
+    Returns the search vocabulary, loading it if the app was started without one.
+
+    Once the search index has changed and VOCABULARY_REFRESH_INTERVAL seconds have passed since the vocabulary was
+    loaded, a new one is loaded in a background thread and swapped in when it's ready. Searches keep using the old
+    vocabulary in the meantime, so a new word can take a little while to be suggested as a correction, but every word
+    is still searchable the moment it's indexed.
+    """
+
+    global rebuilding
+    if search_vocabulary is None:
+        return create_search_vocabulary(current_app)
+    refresh_interval = current_app.config.get("VOCABULARY_REFRESH_INTERVAL", 60)
+    out_of_date = search_vocabulary.generation != get_search_cache().generation
+    if out_of_date and not rebuilding and time.monotonic() - search_vocabulary.built_at > refresh_interval:
+        rebuilding = True
+        thread = Thread(target=reload_vocabulary, args=(current_app._get_current_object(),))
+        thread.daemon = True
+        thread.start()
+    return search_vocabulary
+
+
+def load_vocabulary():
+    """Loads every word stored in the search index, with the number of rows or postings it appears in."""
+    generation = get_search_cache().generation
+    return SearchVocabulary(dict(get_search_backend().vocabulary()), generation)
+
+
+def reload_vocabulary(app):
+    """Loads a new search vocabulary in a background thread and swaps it in for the old one."""
+    global search_vocabulary, rebuilding
+    try:
+        with app.app_context():
+            search_vocabulary = load_vocabulary()
+    finally:
+        rebuilding = False
+
+
+def make_deletes(word, max_distance):
+    """Returns every string that can be made by deleting up to 'max_distance' letters from a word, including itself."""
+    deletes = {word}
+    edges = {word}
+    for _ in range(max_distance):
+        edges = {edge[:i] + edge[i + 1:] for edge in edges for i in range(len(edge))}
+        deletes.update(edges)
+    return deletes
+
+
+def edit_distance(first, second, cutoff):
+    """
+    Returns the number of insertions, deletions, substitutions and transpositions turning one word into another.
+
+    Stops early and returns 'cutoff' once every cell of a row of the table reaches it, since the distance can only grow
+    from there.
+    """
+
+    previous_row = None
+    row = list(range(len(second) + 1))
+    for i in range(1, len(first) + 1):
+        before_previous, previous_row = previous_row, row
+        row = [i] + [0] * len(second)
+        for j in range(1, len(second) + 1):
+            cost = 0 if first[i - 1] == second[j - 1] else 1
+            row[j] = min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + cost)
+            if i > 1 and j > 1 and first[i - 1] == second[j - 2] and first[i - 2] == second[j - 1]:
+                row[j] = min(row[j], before_previous[j - 2] + 1)
+        if min(row) >= cutoff:
+            return cutoff
+    return row[-1]
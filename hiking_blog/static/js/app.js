@@ -4,3 +4,55 @@
 //navLinks.forEach((l) => {
 //    l.addEventListener('click', () => { bsCollapse.toggle() })
 //})
+
+// Fills the navbar search field's datalist with suggestions for the text typed so far.
+const searchInput = document.querySelector('input[data-autocomplete-url]')
+if (searchInput) {
+    const suggestionList = document.getElementById(searchInput.getAttribute('list'))
+    let pendingRequest = null
+    searchInput.addEventListener('input', () => {
+        const prefix = searchInput.value.trim()
+        if (pendingRequest) {
+            pendingRequest.abort()
+        }
+        if (!prefix) {
+            suggestionList.replaceChildren()
+            return
+        }
+        pendingRequest = new AbortController()
+        const url = `${searchInput.dataset.autocompleteUrl}?prefix=${encodeURIComponent(prefix)}`
+        fetch(url, { signal: pendingRequest.signal })
+            .then((response) => response.json())
+            .then((data) => {
+                suggestionList.replaceChildren(...data.suggestions.map((suggestion) => {
+                    const option = document.createElement('option')
+                    option.value = suggestion.text
+                    return option
+                }))
+            })
+            .catch(() => {})
+    })
+}
+
+// Appends the next page of a gear or trail page's comments to its thread when "Load more comments" is clicked.
+document.querySelectorAll('.load-more-comments').forEach((button) => {
+    const thread = document.getElementById(button.dataset.thread)
+    button.addEventListener('click', () => {
+        button.disabled = true
+        const url = `${thread.dataset.moreUrl}?after=${encodeURIComponent(button.dataset.cursor)}`
+        fetch(url)
+            .then((response) => response.json())
+            .then((data) => {
+                thread.insertAdjacentHTML('beforeend', data.html)
+                if (data.next_cursor) {
+                    button.dataset.cursor = data.next_cursor
+                    button.disabled = false
+                } else {
+                    button.remove()
+                }
+            })
+            .catch(() => {
+                button.disabled = false
+            })
+    })
+})
@@ -0,0 +1,129 @@
+"""Filters trails by difficulty, distance and elevation and counts the trails in each facet of those filters."""
+from hiking_blog.models import Trails
+from hiking_blog.forms import TRAIL_DIFFICULTIES
+from hiking_blog.fragment_cache import get_fragment_cache
+from hiking_blog.db import db
+from sqlalchemy import and_, case, func, true
+from collections import namedtuple
+
+DISTANCE_BUCKETS = (0, 2, 5, 10, 15)
+ELEVATION_BUCKETS = (0, 500, 1000, 2000, 3000)
+
+TrailFilters = namedtuple("TrailFilters", ["difficulties", "min_dist", "max_dist", "min_elev", "max_elev"])
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def read_trail_filters(args):
+    """
+    Reads the trail filters from the query arguments of a request.
+
+    Any number of 'difficulty' arguments may be given, and a trail matches if it has any of them. 'min_dist' and
+    'max_dist' bound the hiking distance in miles, and 'min_elev' and 'max_elev' the elevation change in feet.
+    Arguments that can't be read are ignored.
+    """
+
+    return TrailFilters(
+        difficulties=tuple(sorted(set(args.getlist("difficulty")) & set(TRAIL_DIFFICULTIES))),
+        min_dist=args.get("min_dist", type=float),
+        max_dist=args.get("max_dist", type=float),
+        min_elev=args.get("min_elev", type=int),
+        max_elev=args.get("max_elev", type=int)
+    )
+
+
+def filter_conditions(filters):
+    """Returns the conditions of the trail filters, as a list of conditions for each of the three facets."""
+    conditions = {"difficulty": [], "distance": [], "elevation": []}
+    if filters.difficulties:
+        conditions["difficulty"].append(Trails.difficulty.in_(filters.difficulties))
+    conditions["distance"].extend(range_conditions(Trails.hiking_dist, filters.min_dist, filters.max_dist))
+    conditions["elevation"].extend(range_conditions(Trails.elev_change, filters.min_elev, filters.max_elev))
+    return conditions
+
+
+def range_conditions(column, low, high):
+    """Returns the conditions keeping a column between 'low' and 'high', either of which may be None."""
+    conditions = []
+    if low is not None:
+        conditions.append(column >= low)
+    if high is not None:
+        conditions.append(column <= high)
+    return conditions
+
+
+def apply_trail_filters(query, filters):
+    """Filters a query of the trails table to the trails matching every one of the filters."""
+    for conditions in filter_conditions(filters).values():
+        query = query.filter(*conditions)
+    return query
+
+
+def get_facet_counts(filters):
+    """
+    Returns the number of matching trails and the counts of each facet for a set of filters, from the fragment cache.
+
+    Counts are computed by count_facets and stored under the filters they were counted for, and thrown out whenever a
+    change to the trails table is committed, so browsing the same filters again doesn't read the trails table.
+    """
+
+    cache = get_fragment_cache()
+    key = ("trail_facets", filters)
+    facets = cache.get(key)
+    if facets is None:
+        generation = cache.generation
+        facets = count_facets(filters)
+        cache.set(key, facets, ("trails",), generation)
+    return facets
+
+
+def count_facets(filters):
+    """
+    Counts the trails matching a set of filters, and the trails in each difficulty, distance and elevation bucket.
+
+    Every count is a conditional sum in a single aggregate query over the trails table. The counts of a facet's
+    buckets apply the filters of the other two facets but not its own, so that each bucket shows how many trails
+    choosing it would give, as faceted browsing does. Distance and elevation buckets run from each bound in
+    DISTANCE_BUCKETS and ELEVATION_BUCKETS up to, but not including, the next, and the last one has no upper bound.
+
+    Returns a dictionary with the 'total' number of matching trails and the 'difficulty', 'distance' and 'elevation'
+    facets, each a list of buckets with their counts.
+    """
+
+    conditions = filter_conditions(filters)
+
+    def matching(facet, *bucket):
+        other_filters = [condition for name, facet_conditions in conditions.items() if name != facet
+                         for condition in facet_conditions]
+        return func.sum(case((and_(true(), *other_filters, *bucket), 1), else_=0))
+
+    difficulty_buckets = [{"value": difficulty} for difficulty in TRAIL_DIFFICULTIES]
+    distance_buckets = histogram_buckets(DISTANCE_BUCKETS)
+    elevation_buckets = histogram_buckets(ELEVATION_BUCKETS)
+    columns = [matching(None)]
+    columns += [matching("difficulty", Trails.difficulty == bucket["value"]) for bucket in difficulty_buckets]
+    columns += [matching("distance", *bucket_conditions(Trails.hiking_dist, bucket)) for bucket in distance_buckets]
+    columns += [matching("elevation", *bucket_conditions(Trails.elev_change, bucket)) for bucket in elevation_buckets]
+    counts = iter(db.session.query(*columns).one())
+
+    total = next(counts) or 0
+    for bucket in difficulty_buckets + distance_buckets + elevation_buckets:
+        bucket["count"] = next(counts) or 0
+    return {
+        "total": total,
+        "difficulty": difficulty_buckets,
+        "distance": distance_buckets,
+        "elevation": elevation_buckets
+    }
+
+
+def histogram_buckets(bounds):
+    """Returns a bucket from each bound to the next, with the last bucket's 'max' set to None."""
+    return [{"min": low, "max": high} for low, high in zip(bounds, bounds[1:] + (None,))]
+
+
+def bucket_conditions(column, bucket):
+    """Returns the conditions keeping a column in a histogram bucket, which includes its min and excludes its max."""
+    conditions = [column >= bucket["min"]]
+    if bucket["max"] is not None:
+        conditions.append(column < bucket["max"])
+    return conditions
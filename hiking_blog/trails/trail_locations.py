@@ -0,0 +1,141 @@
+"""Finds the trails near a point or inside a map viewport, using a grid index of the trails' coordinates."""
+from hiking_blog.models import Trails
+from hiking_blog.db import db
+from sqlalchemy import event
+import math
+
+GEO_BAND_DEGREES = 0.1
+MAX_BAND_SEEKS = 200
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LATITUDE = 69.0
+MAX_RADIUS_MILES = 250
+MAX_LOCATED_TRAILS = 500
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def geo_band(latitude):
+    """Returns the number of the band of latitude, GEO_BAND_DEGREES high, that a latitude is in, or None."""
+    if latitude is None:
+        return None
+    return math.floor(latitude / GEO_BAND_DEGREES)
+
+
+@event.listens_for(Trails, "before_insert")
+@event.listens_for(Trails, "before_update")
+def set_geo_band(mapper, connection, trail):
+    """Keeps a trail's geo_band in step with its latitude whenever it is added or changed."""
+    trail.geo_band = geo_band(trail.latitude)
+
+
+def parse_coordinate(text, limit):
+    """
+    Returns a latitude or longitude read from text, such as '46.8721', or None if it can't be read.
+
+    PARAMETERS
+    ----------
+    text : str
+        The coordinate as it was written.
+    limit : float
+        The largest the coordinate can be either side of 0, which is 90 for a latitude and 180 for a longitude.
+    """
+
+    try:
+        coordinate = float(str(text).strip())
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(coordinate) or abs(coordinate) > limit:
+        return None
+    return coordinate
+
+
+def distance_miles(latitude, longitude, other_latitude, other_longitude):
+    """Returns the great-circle distance in miles between two points, by the haversine formula."""
+    latitude, longitude, other_latitude, other_longitude = map(
+        math.radians, (latitude, longitude, other_latitude, other_longitude)
+    )
+    a = math.sin((other_latitude - latitude) / 2) ** 2 \
+        + math.cos(latitude) * math.cos(other_latitude) * math.sin((other_longitude - longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(a)))
+
+
+def radius_box(latitude, longitude, radius):
+    """Returns the (south, north, west, east) bounds of the smallest box holding every point within 'radius' miles."""
+    latitude_span = radius / MILES_PER_DEGREE_LATITUDE
+    south = max(-90.0, latitude - latitude_span)
+    north = min(90.0, latitude + latitude_span)
+    widest = max(abs(south), abs(north))
+    if widest >= 90.0:
+        return south, north, -180.0, 180.0
+    longitude_span = latitude_span / math.cos(math.radians(widest))
+    return south, north, max(-180.0, longitude - longitude_span), min(180.0, longitude + longitude_span)
+
+
+def trails_in_box(south, north, west, east):
+    """
+    Returns the id, name, difficulty, distance, elevation change and coordinates of every trail inside a box.
+
+    Trails are indexed by (geo_band, longitude), where geo_band is the band of latitude each trail is in. Each band
+    the box crosses is a single range scan of the index over the box's longitudes, so the cost of the query depends on
+    the number of bands and trails in the box rather than on the number of trails in the database. A box crossing
+    more than MAX_BAND_SEEKS bands is scanned as one range of bands instead.
+    """
+
+    low_band, high_band = geo_band(south), geo_band(north)
+    query = db.session.query(
+        Trails.id, Trails.name, Trails.difficulty, Trails.hiking_dist, Trails.elev_change, Trails.latitude,
+        Trails.longitude
+    )
+    if high_band - low_band < MAX_BAND_SEEKS:
+        query = query.filter(Trails.geo_band.in_(range(low_band, high_band + 1)))
+    else:
+        query = query.filter(Trails.geo_band.between(low_band, high_band))
+    return query.filter(
+        Trails.longitude.between(west, east),
+        Trails.latitude.between(south, north)
+    ).all()
+
+
+def trails_near(latitude, longitude, radius, limit=MAX_LOCATED_TRAILS):
+    """
+    Returns the trails within 'radius' miles of a point, nearest first, each with its distance in miles.
+
+    The trails in the box around the circle are read on the grid index, and only those are measured, so the trails
+    in the corners of the box, outside the circle, are the only ones read and thrown away.
+
+    PARAMETERS
+    ----------
+    latitude : float
+        The latitude of the point.
+    longitude : float
+        The longitude of the point.
+    radius : float
+        The distance in miles from the point to search to.
+    limit : int
+        The most trails returned.
+
+    Returns a list of (distance, trail) tuples.
+    """
+
+    located = []
+    for trail in trails_in_box(*radius_box(latitude, longitude, radius)):
+        distance = distance_miles(latitude, longitude, trail.latitude, trail.longitude)
+        if distance <= radius:
+            located.append((distance, trail))
+    located.sort(key=lambda pair: (pair[0], pair[1].id))
+    return located[:limit]
+
+
+def trails_in_view(south, north, west, east, limit=MAX_LOCATED_TRAILS):
+    """
+    Returns the trails inside a map viewport, nearest to its centre first, each with its distance in miles from it.
+
+    Returns a list of (distance, trail) tuples.
+    """
+
+    centre_latitude, centre_longitude = (south + north) / 2, (west + east) / 2
+    located = [
+        (distance_miles(centre_latitude, centre_longitude, trail.latitude, trail.longitude), trail)
+        for trail in trails_in_box(south, north, west, east)
+    ]
+    located.sort(key=lambda pair: (pair[0], pair[1].id))
+    return located[:limit]
@@ -0,0 +1,368 @@
+"""Recommends the trails most like each trail, from a matrix of trail features compared all at once with NumPy."""
+from flask import current_app
+from sqlalchemy import event, inspect
+from hiking_blog.models import Trails
+from hiking_blog.forms import TRAIL_DIFFICULTIES
+from hiking_blog.search.search_index import count_terms
+from hiking_blog.db import db
+import numpy as np
+import threading
+import time
+import zlib
+
+TRAILS_CHANGED = "recommendation_trails_changed"
+RECOMMENDATION_COUNT = 5
+RECOMMENDATION_REFRESH_INTERVAL = 3600
+TERM_DIMENSIONS = 256
+SIMILARITY_BATCH_SIZE = 512
+NUMERIC_WEIGHTS = np.array([1.0, 1.0, 1.0, 1.5, 1.5], dtype=np.float32)
+DESCRIPTION_WEIGHT = 2.0
+
+trail_recommender = None
+
+
+class TrailRecommender:
+    """
+    A class used to look up the trails most like a trail, which are found ahead of time for every trail.
+
+    The most similar trails of every trail are kept in a TrailNeighbours table, which is built when the app starts and
+    is never changed once built. When update_trail_entry changes a trail, a new table with the trail's row computed
+    again is made in a background thread once the change is committed, and the whole table is built again in the
+    background every 'refresh_interval' seconds, which picks up changes made by other processes and rescales every
+    feature. Each new table is swapped in for the old one when it's ready, so a lookup only holds the lock long enough
+    to read the current table, and never waits on a table being built. Lookups keep using the old table in the
+    meantime, so a change can take a moment to show in the recommendations.
+
+    PARAMETERS
+    ----------
+    count : int
+        The number of most similar trails kept for each trail.
+    refresh_interval : float
+        The number of seconds after which the whole table is built again.
+    """
+
+    def __init__(self, count, refresh_interval):
+        self.count = count
+        self.refresh_interval = refresh_interval
+        self.table = None
+        self.pending = set()
+        self.updating = False
+        self.lock = threading.Lock()
+
+    def similar(self, trail_id, limit=None):
+        """
+        Returns the trails most like a trail, most similar first, as dictionaries of their id, name and similarity.
+
+        Returns an empty list until the first table has been built. Starts an update of the table in the background if
+        a trail has changed or the table is older than the refresh interval.
+
+        PARAMETERS
+        ----------
+        trail_id : int
+            The id of the trail.
+        limit : int
+            The most trails returned, which can't be more than the recommender's count.
+        """
+
+        with self.lock:
+            table = self.table
+            due = not self.updating and (
+                table is None or self.pending or time.monotonic() - table.built_at > self.refresh_interval
+            )
+            if due:
+                self.updating = True
+        if due:
+            thread = threading.Thread(target=self.update_in_background, args=(current_app._get_current_object(),))
+            thread.daemon = True
+            thread.start()
+        if table is None:
+            return []
+        return table.similar(trail_id)[:limit]
+
+    def mark_changed(self, trail_ids):
+        """Has the rows of the trails computed again by the next update."""
+        with self.lock:
+            self.pending.update(trail_ids)
+
+    def update(self):
+        """
+        Builds a new table, or makes one with the rows of the changed trails computed again, and swaps it in.
+
+        The whole table is built if there is none yet or it is older than the refresh interval. Trails marked as changed
+        while the new table is being made are left for the next update.
+        """
+
+        with self.lock:
+            changed_ids, self.pending = self.pending, set()
+            table = self.table
+        try:
+            if table is None or time.monotonic() - table.built_at > self.refresh_interval:
+                table = build_neighbour_table(self.count)
+            elif changed_ids:
+                table = refresh_neighbour_table(table, changed_ids)
+        except Exception:
+            with self.lock:
+                self.pending.update(changed_ids)
+            raise
+        with self.lock:
+            self.table = table
+
+    def update_in_background(self, app):
+        """Updates the table in a background thread, in its own app context."""
+        try:
+            with app.app_context():
+                self.update()
+        finally:
+            with self.lock:
+                self.updating = False
+
+
+class TrailNeighbours:
+    """
+    A class used to store the most similar trails of every trail, with the feature matrix they were found from.
+
+    Each trail is described by a row of a feature matrix: its hiking distance, elevation change, difficulty, latitude
+    and longitude, each scaled to a mean of 0 and a standard deviation of 1 across the trails, followed by the terms of
+    its description, hashed into TERM_DIMENSIONS columns and weighted by how rare they are among the trails. Each row
+    is scaled to a length of 1, so the similarity of two trails is the cosine of their rows, and the similarity of
+    every trail to every other is a product of the matrix with itself, computed SIMILARITY_BATCH_SIZE rows at a time
+    so that the whole similarity matrix is never held in memory. The 'count' most similar trails of each trail are
+    kept, and a lookup reads them without computing anything.
+
+    A table is only changed while it is being made, by build_neighbour_table and refresh_neighbour_table, and is read
+    by any number of threads once it has been swapped in.
+
+    PARAMETERS
+    ----------
+    count : int
+        The number of most similar trails kept for each trail.
+    ids : ndarray
+        The id of the trail in each row.
+    names : list
+        The name of the trail in each row.
+    features : ndarray
+        The feature matrix, with a row for each trail.
+    scaling : tuple
+        The means, standard deviations and inverse document frequencies the features were scaled by.
+    built_at : float
+        The time the whole table was last built, from time.monotonic.
+    """
+
+    def __init__(self, count, ids, names, features, scaling, built_at):
+        self.count = count
+        self.ids = ids
+        self.names = names
+        self.positions = {int(trail_id): position for position, trail_id in enumerate(ids)}
+        self.features = features
+        self.scaling = scaling
+        self.built_at = built_at
+        self.neighbours = np.full((len(ids), count), -1, dtype=np.int64)
+        self.scores = np.full((len(ids), count), -np.inf, dtype=np.float32)
+
+    def similar(self, trail_id):
+        """Returns the most similar trails of a trail, most similar first, with their ids, names and similarities."""
+        position = self.positions.get(trail_id)
+        if position is None:
+            return []
+        return [
+            {"id": int(self.ids[neighbour]), "name": self.names[neighbour], "similarity": float(score)}
+            for neighbour, score in zip(self.neighbours[position], self.scores[position]) if neighbour >= 0
+        ]
+
+    def find_neighbours(self, positions):
+        """Finds the most similar trails of the trails at some positions of the matrix, a batch of rows at a time."""
+        count = min(self.count, len(self.ids) - 1)
+        if count < 1:
+            return
+        for start in range(0, len(positions), SIMILARITY_BATCH_SIZE):
+            batch = positions[start:start + SIMILARITY_BATCH_SIZE]
+            similarities = self.features[batch] @ self.features.T
+            similarities[np.arange(len(batch)), batch] = -np.inf
+            nearest = np.argpartition(-similarities, count - 1, axis=1)[:, :count]
+            nearest_scores = np.take_along_axis(similarities, nearest, axis=1)
+            order = np.argsort(-nearest_scores, axis=1, kind="stable")
+            self.neighbours[batch, :count] = np.take_along_axis(nearest, order, axis=1)
+            self.scores[batch, :count] = np.take_along_axis(nearest_scores, order, axis=1)
+
+
+# ----------------------------------------FUNCTIONS----------------------------------------
+def create_trail_recommender(app, build=True):
+    """
+    Creates the trail recommender and has it update the trails changed by update_trail_entry once committed.
+
+    PARAMETERS
+    ----------
+    app : Flask
+        The app, whose app context must be pushed.
+    build : bool
+        Whether to build the first table straight away, as the app does when it starts, or leave it to be built in
+        the background on the first lookup.
+    """
+
+    global trail_recommender
+    trail_recommender = TrailRecommender(
+        app.config.get("RECOMMENDATION_COUNT", RECOMMENDATION_COUNT),
+        app.config.get("RECOMMENDATION_REFRESH_INTERVAL", RECOMMENDATION_REFRESH_INTERVAL)
+    )
+    if not event.contains(db.session, "after_commit", update_after_commit):
+        event.listen(db.session, "after_commit", update_after_commit)
+        event.listen(db.session, "after_rollback", clear_trails_changed)
+    if build:
+        trail_recommender.update()
+    return trail_recommender
+
+
+def get_trail_recommender():
+    """Returns the trail recommender, creating it if the app was started without one, without building its table."""
+    if trail_recommender is None:
+        create_trail_recommender(current_app, build=False)
+    return trail_recommender
+
+
+def build_neighbour_table(count):
+    """Builds the feature matrix of every trail and finds the 'count' most similar trails of each."""
+    rows = load_trail_rows()
+    scaling = feature_scaling(rows)
+    table = TrailNeighbours(
+        count, np.array([row.id for row in rows], dtype=np.int64), [row.name for row in rows],
+        trail_features(rows, scaling), scaling, time.monotonic()
+    )
+    table.find_neighbours(np.arange(len(rows)))
+    return table
+
+
+def refresh_neighbour_table(table, changed_ids):
+    """
+    Returns a copy of a table with the rows of the changed trails computed again, scaled as the rest of the matrix is.
+
+    A changed trail's neighbours are all found again. Of the other trails, only those it was a neighbour of, and those
+    it is now more similar to than their least similar neighbour, have their neighbours found again. New trails are
+    added to the end of the matrix. If a changed trail has been deleted, the whole table is built again.
+    """
+
+    rows = load_trail_rows(sorted(changed_ids))
+    if len(rows) < len(changed_ids):
+        return build_neighbour_table(table.count)
+    new_rows = [row for row in rows if row.id not in table.positions]
+    refreshed = TrailNeighbours(
+        table.count,
+        np.concatenate([table.ids, np.array([row.id for row in new_rows], dtype=np.int64)]),
+        table.names + [row.name for row in new_rows],
+        np.vstack([table.features, np.zeros((len(new_rows), table.features.shape[1]), dtype=np.float32)]),
+        table.scaling, table.built_at
+    )
+    refreshed.neighbours[:len(table.ids)] = table.neighbours
+    refreshed.scores[:len(table.ids)] = table.scores
+    changed = np.array([refreshed.positions[row.id] for row in rows], dtype=np.int64)
+    for position, row in zip(changed, rows):
+        refreshed.names[position] = row.name
+    refreshed.features[changed] = trail_features(rows, refreshed.scaling)
+
+    similarities = refreshed.features @ refreshed.features[changed].T
+    lowest_scores = refreshed.scores[:, -1][:, np.newaxis]
+    affected = np.isin(refreshed.neighbours, changed).any(axis=1) | (similarities > lowest_scores).any(axis=1)
+    affected[changed] = True
+    refreshed.find_neighbours(np.flatnonzero(affected))
+    return refreshed
+
+
+def mark_trail_changed(trail):
+    """Marks a trail as changed on the current session, which has its recommendations updated once it is committed."""
+    db.session.info.setdefault(TRAILS_CHANGED, []).append(trail)
+
+
+def update_after_commit(session):
+    """
+    Has the recommender update the trails a committed session changed.
+
+    A trail's id is read from its identity in the session, which a new trail has once it is flushed, rather than from
+    the trail itself, whose attributes can't be loaded again after the commit until the session is next used.
+    """
+
+    trails = session.info.pop(TRAILS_CHANGED, None)
+    if not trails or trail_recommender is None:
+        return
+    identities = [inspect(trail).identity for trail in trails]
+    trail_recommender.mark_changed(identity[0] for identity in identities if identity is not None)
+
+
+def clear_trails_changed(session):
+    """Clears the marks left on a session that has been rolled back."""
+    session.info.pop(TRAILS_CHANGED, None)
+
+
+def load_trail_rows(trail_ids=None):
+    """Loads the columns the features of every trail, or of the trails with the given ids, are built from."""
+    query = db.session.query(
+        Trails.id, Trails.name, Trails.hiking_dist, Trails.elev_change, Trails.difficulty, Trails.latitude,
+        Trails.longitude, Trails.description
+    )
+    if trail_ids is not None:
+        query = query.filter(Trails.id.in_(trail_ids))
+    return query.order_by(Trails.id).all()
+
+
+def numeric_features(rows):
+    """Returns the hiking distance, elevation change, difficulty, latitude and longitude of each trail as a matrix."""
+    difficulty_levels = {difficulty: level for level, difficulty in enumerate(TRAIL_DIFFICULTIES)}
+    return np.array([
+        [row.hiking_dist, row.elev_change, difficulty_levels.get(row.difficulty), row.latitude, row.longitude]
+        for row in rows
+    ], dtype=np.float32).reshape(len(rows), len(NUMERIC_WEIGHTS))
+
+
+def term_features(rows):
+    """
+    Returns the terms of each trail's description, hashed into TERM_DIMENSIONS columns, as a matrix.
+
+    Each term is counted in the column given by the CRC-32 of the term, which is the same in every process, with a
+    weight of 1 plus the log of the number of times it appears, so a term repeated many times doesn't dominate.
+    """
+
+    trail_positions, columns, weights = [], [], []
+    for position, row in enumerate(rows):
+        for term, occurrences in count_terms(row.description).items():
+            trail_positions.append(position)
+            columns.append(zlib.crc32(term.encode()) % TERM_DIMENSIONS)
+            weights.append(1.0 + np.log(occurrences))
+    terms = np.zeros((len(rows), TERM_DIMENSIONS), dtype=np.float32)
+    np.add.at(terms, (np.array(trail_positions, dtype=np.int64), np.array(columns, dtype=np.int64)), weights)
+    return terms
+
+
+def feature_scaling(rows):
+    """
+    Returns the mean and standard deviation of each numeric feature, and the inverse document frequency of each term
+    column, across every trail.
+
+    Missing values are left out of the mean and standard deviation, and a feature no trail has a value for is given a
+    mean of 0 and a standard deviation of 1.
+    """
+
+    numeric = numeric_features(rows)
+    known = ~np.isnan(numeric)
+    known_counts = np.maximum(known.sum(axis=0), 1)
+    means = np.where(known, numeric, 0).sum(axis=0) / known_counts
+    deviations = np.sqrt(np.where(known, (numeric - means) ** 2, 0).sum(axis=0) / known_counts)
+    deviations[deviations == 0] = 1.0
+    document_frequency = (term_features(rows) > 0).sum(axis=0)
+    inverse_frequency = np.log((len(rows) + 1) / (document_frequency + 1)) + 1
+    return means.astype(np.float32), deviations.astype(np.float32), inverse_frequency.astype(np.float32)
+
+
+def trail_features(rows, scaling):
+    """
+    Returns the feature rows of some trails, scaled by 'scaling', each with a length of 1.
+
+    Numeric features are scaled to their z-scores, with a missing value, such as a trail's unknown location, counted
+    as the mean, and weighted by NUMERIC_WEIGHTS. Term columns are weighted by their inverse document frequency and
+    scaled together to a length of DESCRIPTION_WEIGHT.
+    """
+
+    means, deviations, inverse_frequency = scaling
+    numeric = np.nan_to_num((numeric_features(rows) - means) / deviations) * NUMERIC_WEIGHTS
+    terms = term_features(rows) * inverse_frequency
+    terms *= DESCRIPTION_WEIGHT / np.maximum(np.linalg.norm(terms, axis=1, keepdims=True), 1e-12)
+    features = np.hstack([numeric, terms]).astype(np.float32)
+    features /= np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+    return features
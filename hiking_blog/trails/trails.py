@@ -1,10 +1,17 @@
 """Contains the functionality for viewing trail info and creating trail entries in the database."""
-from flask import render_template, redirect, url_for, flash, Blueprint, request, send_from_directory
+from flask import render_template, redirect, url_for, flash, Blueprint, request, send_from_directory, jsonify
 from flask_login import current_user, login_required
-from hiking_blog.forms import CommentForm, AddTrailPhotoForm
-from hiking_blog.models import Trails, TrailComments, RatedPhoto, db
+from hiking_blog.forms import CommentForm, AddTrailPhotoForm, TRAIL_DIFFICULTIES
+from hiking_blog.models import Trails, TrailComments, TrailPictures, RatedPhoto, db
 from hiking_blog.admin.admin import allowed_file, create_initial_trail_directory, delete_comment, NO_TAGS
 from hiking_blog.auth.auth import admin_only
+from hiking_blog.search.search_index import index_trail_comment, remove_trail_comment
+from hiking_blog.comment_threads import get_comment_page, InvalidCursor
+from hiking_blog.listings import paginate_listing, description_preview, listing_arguments
+from hiking_blog.trails.trail_facets import read_trail_filters, apply_trail_filters, get_facet_counts
+from hiking_blog.trails.trail_locations import trails_near, trails_in_view, MAX_RADIUS_MILES
+from hiking_blog.trails.trail_recommendations import get_trail_recommender
+from sqlalchemy.orm import selectinload
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import os
@@ -16,6 +23,13 @@ PICTURE_UPLOAD_SUCCESS = "You're photos have been successfully uploaded! They wi
                          "has been approved, you will be notified via email. Thank you for supporting the Tamarack " \
                          "Treks community!"
 
+TRAIL_SORTS = {
+    "newest": (Trails.date_time_added.desc(), Trails.id.desc()),
+    "name": (Trails.name, Trails.id),
+    "distance": (Trails.hiking_dist, Trails.id),
+    "elevation": (Trails.elev_change, Trails.id)
+}
+
 trail_bp = Blueprint(
     "trail_bp", __name__,
     template_folder="templates",
@@ -25,9 +39,93 @@ trail_bp = Blueprint(
 
 @trail_bp.route("/tamarack-treks/gear/view_all_trails")
 def view_all_trails():
-    """Collects all trail items from the database to display to the user."""
-    all_trails = db.session.query(Trails).all()
-    return render_template("view_all_trails.html", all_trails=all_trails)
+    """
+    Lists the trails in the database a page at a time, to display to the user.
+
+    Only the columns shown on the listing cards are read, with the start of each description and the trail's first
+    picture, for the page given by the 'page' query argument. The trails are sorted by the 'sort' query argument, one
+    of TRAIL_SORTS, and filtered by difficulty, hiking distance and elevation change as trail_facets.read_trail_filters
+    describes.
+    """
+
+    difficulty = request.args.get("difficulty")
+    query = db.session.query(
+        Trails.id, Trails.name, Trails.difficulty, Trails.hiking_dist, Trails.elev_change,
+        description_preview(Trails.description), first_trail_pic()
+    )
+    query = apply_trail_filters(query, read_trail_filters(request.args))
+    trail_page, sort = paginate_listing(query, TRAIL_SORTS, "newest")
+    return render_template(
+        "view_all_trails.html",
+        trail_page=trail_page,
+        sort=sort,
+        sorts=TRAIL_SORTS,
+        difficulty=difficulty,
+        difficulties=TRAIL_DIFFICULTIES,
+        listing_arguments=listing_arguments()
+    )
+
+
+@trail_bp.route("/tamarack-treks/trails/browse")
+def browse_trails():
+    """
+    Returns json holding a page of the trails matching the filters of the request, and the counts of every facet.
+
+    Trails are filtered by the 'difficulty', 'min_dist', 'max_dist', 'min_elev' and 'max_elev' query arguments, as
+    trail_facets.read_trail_filters describes, sorted by the 'sort' query argument, one of TRAIL_SORTS, and paged by
+    the 'page' query argument. Along with the page, the number of trails in each difficulty, distance and elevation
+    bucket is returned, for a browsing page to show next to each of its filters. The counts are cached for each set of
+    filters until the trails change.
+    """
+
+    filters = read_trail_filters(request.args)
+    query = db.session.query(Trails.id, Trails.name, Trails.difficulty, Trails.hiking_dist, Trails.elev_change)
+    trail_page, sort = paginate_listing(apply_trail_filters(query, filters), TRAIL_SORTS, "newest")
+    trails = [
+        {"id": trail.id, "name": trail.name, "difficulty": trail.difficulty, "hiking_dist": trail.hiking_dist,
+         "elev_change": trail.elev_change, "url": url_for("trail_bp.view_trail", db_id=trail.id)}
+        for trail in trail_page.items
+    ]
+    return jsonify(
+        trails=trails, page=trail_page.page, pages=trail_page.pages, sort=sort, facets=get_facet_counts(filters)
+    )
+
+
+@trail_bp.route("/tamarack-treks/trails/near")
+def trails_near_point():
+    """
+    Returns json of the trails within 'radius' miles of the point at 'lat' and 'lon', nearest first.
+
+    The radius defaults to 25 miles and can be at most MAX_RADIUS_MILES. Each trail is returned with its distance from
+    the point in miles.
+    """
+
+    latitude = request.args.get("lat", type=float)
+    longitude = request.args.get("lon", type=float)
+    radius = request.args.get("radius", 25.0, type=float)
+    if latitude is None or longitude is None or not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return jsonify(error="'lat' and 'lon' must be a latitude and a longitude."), 400
+    if not 0 < radius <= MAX_RADIUS_MILES:
+        return jsonify(error=f"'radius' must be above 0 and at most {MAX_RADIUS_MILES} miles."), 400
+    return jsonify(trails=located_trails_json(trails_near(latitude, longitude, radius)))
+
+
+@trail_bp.route("/tamarack-treks/trails/in_view")
+def trails_in_map_view():
+    """
+    Returns json of the trails inside a map viewport, nearest to its centre first.
+
+    The viewport is bounded by the 'south' and 'north' latitudes and the 'west' and 'east' longitudes. Each trail is
+    returned with its distance in miles from the centre of the viewport.
+    """
+
+    bounds = [request.args.get(name, type=float) for name in ("south", "north", "west", "east")]
+    if None in bounds:
+        return jsonify(error="'south', 'north', 'west' and 'east' must all be given as numbers."), 400
+    south, north, west, east = bounds
+    if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+        return jsonify(error="The viewport must have south below north and west below east."), 400
+    return jsonify(trails=located_trails_json(trails_in_view(south, north, west, east)))
 
 
 @trail_bp.route("/tamarack-treks/<int:db_id>/view_trail", methods=["GET", "POST"])
@@ -37,7 +135,9 @@ def view_trail(db_id):
 
     Directs the user to a template containing all stored information regarding a specific trail in the database.
     Additionally, loads the comment form, allowing the user to comment on the trail and, when submitted, stores their
-    comment in the database as well.
+    comment in the database as well. Only the first page of comments is shown, and the rest are loaded a page at a
+    time from trail_comments. The trails most like it are read from the trail recommender, which found them ahead of
+    time.
 
     PARAMETERS
     ----------
@@ -45,14 +145,11 @@ def view_trail(db_id):
         The primary key for the specified trail in the trails table of the database
     """
     form = CommentForm()
-    trail = Trails.query.get(db_id)
-    # trail_pics = TrailPictures.query.filter_by(trail_id=db_id).all()
-    # pic_ids = [pic.id for pic in trail_pics]
+    trail = load_trail_page(db_id)
     if current_user.is_authenticated:
-        user_rated_pics = RatedPhoto.query.filter_by(user_id=current_user.id).all()
-        user_rated_pic_ids = [pic.photo_id for pic in user_rated_pics]
+        user_pic_ratings = get_user_pic_ratings(current_user.id, db_id)
     else:
-        user_rated_pic_ids = []
+        user_pic_ratings = {}
     if form.validate_on_submit():
         if not current_user.is_authenticated:
             flash("You must be logged in to comment.")
@@ -60,7 +157,31 @@ def view_trail(db_id):
         create_new_trail_comment(form, trail)
         form.comment_text.data = ""
         return redirect(url_for('trail_bp.view_trail', db_id=db_id))
-    return render_template("view_trail.html", trail=trail, form=form, current_user=current_user, user_rated_pic_ids=user_rated_pic_ids)
+    comments, next_cursor = get_comment_page(TrailComments, TrailComments.trail_id, db_id)
+    similar_trails = get_trail_recommender().similar(db_id)
+    return render_template("view_trail.html", trail=trail, form=form, current_user=current_user,
+                           user_pic_ratings=user_pic_ratings, comments=comments, next_cursor=next_cursor,
+                           similar_trails=similar_trails)
+
+
+@trail_bp.route("/tamarack-treks/<int:db_id>/view_trail/comments")
+def trail_comments(db_id):
+    """
+    Returns json holding the html of the page of comments on a trail page after the one ending at the 'after' cursor.
+
+    Called by the "Load more comments" button of the view_trail page, which appends the html to the comment thread
+    and asks for the page after it with the returned next_cursor, until next_cursor is null.
+    """
+
+    trail = Trails.query.get_or_404(db_id)
+    try:
+        comments, next_cursor = get_comment_page(
+            TrailComments, TrailComments.trail_id, db_id, request.args.get("after")
+        )
+    except InvalidCursor as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(html=render_template("trail_comment_list.html", trail=trail, comments=comments),
+                   next_cursor=next_cursor)
 
 
 @trail_bp.route("/tamarack-treks/trail/edit_comment/<comment_id>", methods=["GET", "POST"])
@@ -73,6 +194,7 @@ def edit_trail_comment(comment_id):
     )
     if form.validate_on_submit():
         comment.text = re.sub(NO_TAGS, '', form.comment_text.data)
+        index_trail_comment(comment)
         db.session.commit()
         form.comment_text.data = ""
         return redirect(url_for("trail_bp.view_trail", db_id=db_id))
@@ -89,6 +211,7 @@ def user_delete_trail_comment(comment_id):
     trail_id = request.args["trail_id"]
     comment = TrailComments.query.get(comment_id)
     comment.deleted_by = comment.commenter.username
+    remove_trail_comment(comment)
     db.session.commit()
     return redirect(url_for("trail_bp.view_trail", db_id=trail_id))
 
@@ -122,6 +245,48 @@ def display_trail_pics(file_name):
     return send_from_directory("trails/static/dev_pics/", file_name)
 
 
+def load_trail_page(db_id):
+    """
+    Loads a trail along with its pictures, in two queries.
+
+    Loading the pictures up front keeps the number of queries the page makes the same however many pictures the trail
+    has. Its comments are loaded a page at a time, with their commenters, by comment_threads.get_comment_page.
+    """
+
+    return Trails.query.options(selectinload(Trails.trail_page_pics)).get_or_404(db_id)
+
+
+def first_trail_pic():
+    """
+    Returns a correlated subquery of the image of a trail's first picture, labelled 'first_pic'.
+
+    Used in queries of the trails table to read each trail's first picture along with it, rather than loading every
+    one of its pictures to show one.
+    """
+
+    return db.session.query(TrailPictures.img).filter(TrailPictures.trail_id == Trails.id) \
+        .order_by(TrailPictures.id).limit(1).correlate(Trails).scalar_subquery().label("first_pic")
+
+
+def located_trails_json(located):
+    """Returns the (distance, trail) tuples of a location query as a list of dictionaries that can be sent as json."""
+    return [
+        {"id": trail.id, "name": trail.name, "difficulty": trail.difficulty, "hiking_dist": trail.hiking_dist,
+         "elev_change": trail.elev_change, "latitude": trail.latitude, "longitude": trail.longitude,
+         "distance_miles": round(distance, 2), "url": url_for("trail_bp.view_trail", db_id=trail.id)}
+        for distance, trail in located
+    ]
+
+
+def get_user_pic_ratings(user_id, trail_id):
+    """Returns a dictionary mapping the id of each of a trail's pictures that a user has rated to their rating."""
+    ratings = db.session.query(RatedPhoto.photo_id, RatedPhoto.rating).join(TrailPictures).filter(
+        RatedPhoto.user_id == user_id,
+        TrailPictures.trail_id == trail_id
+    )
+    return {photo_id: rating for photo_id, rating in ratings}
+
+
 def create_new_trail_comment(form, trail):
     """Creates a new entry in the trail_comments table of the database."""
     comment_text = re.sub(NO_TAGS, '', form.comment_text.data)
@@ -133,6 +298,7 @@ def create_new_trail_comment(form, trail):
         parent_posts=trail
     )
     db.session.add(new_comment)
+    index_trail_comment(new_comment)
     db.session.commit()
 
 
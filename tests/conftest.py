@@ -0,0 +1,40 @@
+"""Fixtures shared by the tests: the app, backed by a new SQLite database, and a test client for it."""
+import pytest
+import os
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """
+    Returns the app, created once for the whole test session with a new SQLite database.
+
+    The config is read from the environment when the app is first created, so the variables it needs are set before.
+    The app is only created once, since the models are bound to the database object of the first app.
+    """
+
+    database = tmp_path_factory.mktemp("database") / "hiking_blog.db"
+    os.environ.setdefault("SECRET_KEY", "test")
+    os.environ.setdefault("EMAIL", "test@example.com")
+    os.environ.setdefault("EMAIL_PW", "test")
+    os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{database}"
+
+    from hiking_blog.app import init_app
+
+    app = init_app()
+    app.config.update(WTF_CSRF_ENABLED=False, MAIL_SUPPRESS_SEND=True)
+    return app
+
+
+@pytest.fixture
+def client(app):
+    """Returns a test client for the app."""
+    return app.test_client()
+
+
+@pytest.fixture
+def session(app):
+    """Returns the database session inside an app context."""
+    from hiking_blog import db
+
+    with app.app_context():
+        yield db.db.session
@@ -0,0 +1,86 @@
+"""Checks that the number of queries the trail page runs doesn't grow with its comments and pictures."""
+from sqlalchemy import event
+from datetime import datetime
+import pytest
+
+
+def add_user(session, username):
+    """Adds a user with a confirmed email and approved username."""
+    from hiking_blog.models import User
+
+    user = User(username=username, email=f"{username}@example.com", password="password", first_name="Test",
+                last_name="User", is_admin=False, joined_on=datetime.now(), email_confirmed=True,
+                username_approved=True, username_needs_verification=False)
+    session.add(user)
+    session.flush()
+    return user
+
+
+def add_trail(session, name, poster, content_count):
+    """
+    Adds a trail with 'content_count' pictures, each rated by the poster, and 'content_count' comments, each from a
+    different user.
+    """
+
+    from hiking_blog.models import Trails, TrailPictures, TrailComments, RatedPhoto
+
+    trail = Trails(name=name, description=f"The {name}.", gear_trail="Trail", latitude=46.87, longitude=-113.99,
+                   hiking_dist=4.5, elev_change=1200, difficulty="Medium", date_time_added=datetime.now())
+    session.add(trail)
+    session.flush()
+    for number in range(content_count):
+        picture = TrailPictures(community_rating="4", img=f"{name}-{number}.jpg", img_taker="Tester",
+                                date_time_added=datetime.now(), trail_id=trail.id, poster_id=poster.id)
+        session.add(picture)
+        session.flush()
+        session.add(RatedPhoto(rating=3, date_time_added=datetime.now(), photo_id=picture.id, user_id=poster.id))
+        commenter = add_user(session, f"{name}-commenter-{number}")
+        session.add(TrailComments(text="Great hike!", date_time_added=datetime.now(), commenter=commenter,
+                                  trail_id=trail.id))
+    session.commit()
+    return trail.id
+
+
+def count_queries(app, client, url):
+    """GETs a page and returns the number of statements run on the database while it was served."""
+    from hiking_blog import db
+
+    statements = []
+
+    def count_statement(*args):
+        statements.append(args[2])
+
+    with app.app_context():
+        engine = db.db.engine
+    event.listen(engine, "before_cursor_execute", count_statement)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statement)
+    assert response.status_code == 200
+    return len(statements)
+
+
+@pytest.fixture
+def logged_in_client(session, client):
+    """Returns a test client logged in as a new user."""
+    user = add_user(session, "trail-viewer")
+    session.commit()
+    with client.session_transaction() as client_session:
+        client_session["_user_id"] = str(user.id)
+        client_session["_fresh"] = True
+    client.user = user
+    return client
+
+
+def test_view_trail_query_count_is_constant(app, session, logged_in_client):
+    """The trail page runs as many queries for a trail with 50 comments and pictures as for one with 1 of each."""
+    small_trail = add_trail(session, "small trail", logged_in_client.user, 1)
+    large_trail = add_trail(session, "large trail", logged_in_client.user, 50)
+
+    # The first request loads the caches the page reads from, which aren't part of the cost of the page itself.
+    count_queries(app, logged_in_client, f"/tamarack-treks/{small_trail}/view_trail")
+
+    small_count = count_queries(app, logged_in_client, f"/tamarack-treks/{small_trail}/view_trail")
+    large_count = count_queries(app, logged_in_client, f"/tamarack-treks/{large_trail}/view_trail")
+    assert small_count == large_count